@@ -23,6 +23,103 @@ NDJSON_FILE_NAME_TO_LOAD = NDJSON_FILE_NAME_LIST[2]
 NDJSON_TOTAL_LINE_NUM = LINE_NUM_INFO[NDJSON_FILE_NAME_TO_LOAD]
 
 FILE_PIECES_FOR_MPI_V4 = 8
+# Recorded in the manifest next to split pieces; bump it whenever filter_a_record() changes what
+# pieces keep (2: doc.id is kept for --dedup), so that older pieces are split again
+PIECE_FORMAT_VERSION = 2
+
+# Counters kept per sentiment sign by the --approx user sketches
+APPROX_SKETCH_CAPACITY = 2048
+
+# --checkpoint: minimum seconds between two commits of a work unit, and the smallest
+# byte range a resumed run splits off to give idle ranks work
+CHECKPOINT_INTERVAL_SECONDS = 60
+CHECKPOINT_MIN_SPLIT_BYTES = 1 << 20
+
+# --root-reader (v1): bytes rank 0 reads per rank and round before scattering them
+ROOT_READER_BLOCK_BYTES = 64 << 20
+
+# --stream (v1): records rank 0 parses per rank and round before scattering them
+STREAM_BATCH_RECORDS = 10000
+
+# --memory-budget: where ranks spill sorted runs of their user table (must be readable by
+# rank 0), the estimated in-memory bytes of one user entry, users per pickled run chunk,
+# and the most runs merged at once
+SPILL_DATA_FOLDER = DATA_FOLDER / "a005_spill"
+SPILL_USER_ENTRY_BYTES = 320
+SPILL_RUN_CHUNK_USERS = 4096
+SPILL_MERGE_FAN_IN = 64
+# Users per sorted run when the result store sorts the user score column on disk
+RESULT_STORE_RANK_RUN_USERS = 1 << 18
+
+# --metrics: user buckets of the hour_user_bucket metric, and the instance_domain
+# reported for local accounts (acct without "@domain")
+METRIC_USER_BUCKETS = 16
+LOCAL_INSTANCE_DOMAIN = "(local)"
+# --metrics top_users_per_day / top_hours_per_weekday: entries kept per group and direction
+GROUP_TOP_K = 5
+# --metrics hour_quantiles: KLL sketch size per hour, and the sentiment quantiles reported
+QUANTILE_SKETCH_K = 200
+HOUR_QUANTILES = [0.1, 0.5, 0.9]
+
+# --sample: size of the byte blocks drawn, and the normal quantile of the reported
+# confidence intervals (1.96 for 95%)
+SAMPLE_BLOCK_BYTES = 1 << 20
+SAMPLE_CONFIDENCE_Z = 1.96
+
+# --dedup: default false-positive rate of the per-rank Bloom filters of post ids, lines each
+# rank parses per id-hash exchange round, and bytes each rank reads to estimate the post count
+DEDUP_FALSE_POSITIVE_RATE = 1e-4
+DEDUP_BATCH_LINES = 10000
+DEDUP_ESTIMATE_BYTES = 1 << 20
+
+# --auto: cost model written by `a006_benchmark.py calibrate` (the defaults below are used until
+# then), the log of planned vs. measured runs, and the smallest block a root-scatter plan reads
+# per rank and round
+PLANNER_COST_MODEL_PATH = DATA_FOLDER / "planner_cost_model.json"
+PLANNER_LOG_PATH = DATA_FOLDER / "planner_log.ndjson"
+PLANNER_MIN_BLOCK_BYTES = 1 << 20
+PLANNER_DEFAULT_COST_MODEL = {
+    "read_bytes_per_second": 500e6,  # One sequential reader
+    "node_read_bytes_per_second": 1.5e9,  # All readers of one node together
+    "scatter_bytes_per_second": 2e9,  # Scatterv out of rank 0
+    "parse_seconds_per_byte": 2e-8,  # Parse and aggregate, per raw byte
+    "split_seconds_per_byte": 3e-8,  # Write filtered pieces, per raw byte
+    "piece_bytes_ratio": 0.25,  # Filtered piece bytes per raw byte
+    "piece_parse_seconds_per_byte": 2e-8,  # Parse and aggregate, per piece byte
+    "gather_seconds_per_rank": 0.05,
+}
+
+# --mpiio: bytes each rank reads per collective Read_at_all round, and the default MPI-IO hints
+# (ROMIO names; collective buffering with 16 MiB aggregator buffers)
+MPIIO_BLOCK_BYTES = 64 << 20
+MPIIO_DEFAULT_HINTS = {
+    "romio_cb_read": "enable",
+    "cb_buffer_size": str(16 << 20),
+}
+
+# --node-reader: bytes the node reader reads per block into the shared ring buffer, and ring
+# slots per parsing rank of the node (a slot holds two blocks to fit the carried-over line)
+NODE_READER_BLOCK_BYTES = 8 << 20
+NODE_READER_SLOTS_PER_PARSER = 2
+
+# --late-names: users per direction whose usernames are fetched, as many as high_level_api_sort_result() prints
+LATE_NAMES_TOP_K = 5
+
+# --compress-transport: zlib level of gathered payloads, the link probe used to measure the
+# bandwidth to rank 0, the size of the pickled user table the codec is timed on, and the least
+# time compressing one payload must save
+TRANSPORT_ZLIB_LEVEL = 1
+TRANSPORT_PROBE_BYTES = 4 << 20
+TRANSPORT_CALIBRATION_USERS = 20000
+TRANSPORT_MIN_SAVED_SECONDS = 1e-3
+
+# --stage: environment variable naming the node-local scratch folder (falling back to the
+# system temp folder), and the folder under it v4 pieces are staged to
+STAGE_DIR_ENV = "TMPDIR"
+STAGE_SUBFOLDER = "a004_stage"
+
+# a016_service: Unix socket the resident service listens on
+SERVICE_SOCKET_PATH = DATA_FOLDER / "service.sock"
 
 COMM = MPI.COMM_WORLD
 RANK = COMM.Get_rank()
@@ -1,5 +1,10 @@
 import argparse
+import functools
+import itertools
 import time
+from pathlib import Path
+
+from mpi4py import MPI
 
 from a004_assignment_1.a000_CFG import (
     RAW_DATA_FOLDER,
@@ -10,24 +15,93 @@ from a004_assignment_1.a000_CFG import (
     COMM,
     NDJSON_TOTAL_LINE_NUM,
     PIECES_DATA_FOLDER, FILE_PIECES_FOR_MPI_V4,
+    APPROX_SKETCH_CAPACITY,
+    ROOT_READER_BLOCK_BYTES,
+    STREAM_BATCH_RECORDS,
+    SPILL_DATA_FOLDER,
+    DEDUP_FALSE_POSITIVE_RATE,
+    MPIIO_BLOCK_BYTES,
+    NODE_READER_BLOCK_BYTES,
+    LATE_NAMES_TOP_K,
+    STAGE_DIR_ENV,
+    STAGE_SUBFOLDER,
 )
 from a004_assignment_1.a002_utils import (
     write_data_to_ndjson,
     load_ndjson_file_multi_lines_to_list,
+    iter_ndjson_file_multi_lines,
     aggregate_score_by_hour,
     split_list,
     join_dict_pieces_hour_score,
     load_ndjson_file_by_process,
+    iter_ndjson_file_by_process,
     mpi_v3_subprocess,
     split_file,
     mpi_v4_subprocess,
     check_split_files_exist,
+    compute_byte_ranges,
+    iter_root_scattered_blocks,
+    root_scatter_subprocess,
+    aggregation_init,
+    parse_one_line,
+    RECORD_EXTRACTOR,
 )
-from a004_assignment_1.a003_top_k import high_level_api_sort_result
-
+from a004_assignment_1.a003_top_k import (
+    high_level_api_sort_result, print_and_write_approx_user_top_k, register_group_top_k_aggregators,
+)
+from a004_assignment_1.a004_hierarchical import hierarchical_gather
+from a004_assignment_1.a005_sketch import user_sketches_merge
+from a004_assignment_1.a007_time_cube import time_cube_merge, write_time_cube
+from a004_assignment_1.a008_result_store import write_result_store
+from a004_assignment_1.a009_checkpoint import checkpointed_subprocess, clear_checkpoint
+from a004_assignment_1.a010_pushdown import (
+    build_line_filter, format_line_filter_stats, load_account_ids, reset_line_filter_stats,
+)
+from a004_assignment_1.a011_spill import (
+    user_spill_merge,
+    user_spill_flush,
+    user_spill_iter_sorted,
+    iter_and_write_ndjson,
+    format_spill_stats,
+)
+from a004_assignment_1.a012_dataset import (
+    resolve_input_paths,
+    assign_byte_ranges_by_size,
+    assign_files_by_size,
+    dataset_subprocess,
+)
+from a004_assignment_1.a013_profile import profile_init, profile_section, gather_and_write_profiles
+from a004_assignment_1.a014_aggregators import AGGREGATORS, aggregators_merge, aggregators_reduce
+from a004_assignment_1.a015_sample import sampled_subprocess, write_sample_intervals
+from a004_assignment_1.a017_dedup import dedup_subprocess, report_dedup
+from a004_assignment_1.a018_planner import make_plan, ensure_plan_pieces, log_plan_result
+from a004_assignment_1.a019_mpiio import mpiio_subprocess, parse_mpiio_hints
+from a004_assignment_1.a020_node_reader import node_reader_subprocess
+from a004_assignment_1.a021_late_names import gather_id_score_late_names, print_and_write_late_names_top_k
+from a004_assignment_1.a022_transport import transport_init, transport_gather, report_transport
+from a004_assignment_1.a024_staging import get_stage_dir, stage_ranges
+from a004_assignment_1.a025_extract import report_extract_failures
+
+# Complete the aggregator registry before get_args() lists it for --metrics
+register_group_top_k_aggregators()
+
+
+def mpi_v1(root_reader=False, stream=False):
+    """Root process (rank 0) reads all data, then scatters chunks to worker processes.
+
+    Args:
+        root_reader (bool): Scatter raw newline-aligned byte blocks instead of parsed records,
+            see mpi_v1_root_reader().
+        stream (bool): Read, scatter and aggregate in rounds of parsed records instead of loading
+            the whole file first, see mpi_v1_stream().
+    """
+    if root_reader:
+        mpi_v1_root_reader()
+        return
+    if stream:
+        mpi_v1_stream()
+        return
 
-def mpi_v1():
-    """Root process (rank 0) reads all data, then scatters chunks to worker processes."""
     if RANK == 0:
         records: list | None = load_ndjson_file_multi_lines_to_list(
             ndjson_path_for_loading=RAW_DATA_FOLDER / NDJSON_FILE_NAME_TO_LOAD,
@@ -69,24 +143,127 @@ def mpi_v1():
         print(f"7. rank={RANK}, Saving results to disk finished")
 
 
-def mpi_v2():
-    """All processes read their assigned chunk of the data file concurrently."""
+def mpi_v1_stream(batch_records=STREAM_BATCH_RECORDS):
+    """Like mpi_v1(), but rank 0 parses and scatters the records in rounds while every rank aggregates.
+
+    Rank 0 pulls SIZE * batch_records records a round from a lazy reader, splits and scatters
+    them like mpi_v1(), and every rank adds its chunk to running totals before the next round,
+    so no rank holds more than one round of records. A round with no records ends the loop.
+
+    Args:
+        batch_records (int): Records per rank and round.
+    """
+    records = None
+    if RANK == 0:
+        records = iter_ndjson_file_multi_lines(RAW_DATA_FOLDER / NDJSON_FILE_NAME_TO_LOAD, use_filter=True)
+    hour_score = {}
+    rounds = 0
+    while True:
+        chunks = None
+        if RANK == 0:
+            chunks = split_list(lst=list(itertools.islice(records, SIZE * batch_records)), pieces_num=SIZE)
+        received_msg = COMM.scatter(chunks, root=0)
+        if COMM.allreduce(len(received_msg), op=MPI.SUM) == 0:
+            break
+        aggregate_score_by_hour(received_msg, hour_score)
+        rounds += 1
+    print(f"3. rank={RANK}, Streamed scatter and node statistics finished ({rounds} rounds)")
+
+    all_hour_score = COMM.gather(hour_score, root=0)
+    print(f"5. rank={RANK}, Gather finished")
+
+    if RANK == 0:
+        merged_score: dict = join_dict_pieces_hour_score(
+            all_hour_score,
+            value_type="scalar",
+            mode="sum",
+        )
+        print(f"6. rank={RANK}, Aggregation finished")
+
+        write_data_to_ndjson(
+            records=merged_score,
+            target_path=TEST_DATA_FOLDER / "gathered_v1.ndjson",
+            if_dict_is_single_dict=False,
+        )
+        print(f"7. rank={RANK}, Saving results to disk finished")
+
+
+def mpi_v1_root_reader(block_bytes=ROOT_READER_BLOCK_BYTES):
+    """Rank 0 reads the file in rounds of raw byte blocks and scatters them; every rank parses its own.
+
+    Unlike mpi_v1(), rank 0 neither parses the whole file nor pickles records: each round it reads
+    about SIZE * block_bytes, cuts them into SIZE newline-aligned blocks, broadcasts the block sizes
+    and scatters the bytes with a buffer-based Scatterv. Memory on rank 0 stays bounded by one round.
+
+    Args:
+        block_bytes (int): Bytes per rank and round.
+    """
+    hour_score = {}
+    scattered_bytes = 0
+    rounds = 0
+    for block_offset, received in iter_root_scattered_blocks(RAW_DATA_FOLDER / NDJSON_FILE_NAME_TO_LOAD, block_bytes):
+        scattered_bytes = block_offset + len(received)
+        rounds += 1
+
+        records = (parse_one_line(line, use_filter=True) for line in received.splitlines() if line.strip())
+        # Add each block to the running totals in place instead of merging a copy every round
+        aggregate_score_by_hour(records, hour_score)
+    scattered_bytes = COMM.reduce(scattered_bytes, op=MPI.MAX, root=0)
+    print(f"1. rank={RANK}, Parsed own blocks from {rounds} round(s)")
+
+    all_hour_score = COMM.gather(hour_score, root=0)
+    print(f"2. rank={RANK}, Gather finished")
+
+    if RANK == 0:
+        merged_score: dict = join_dict_pieces_hour_score(
+            all_hour_score,
+            value_type="scalar",
+            mode="sum",
+        )
+        print(f"3. rank={RANK}, Aggregation finished, {scattered_bytes} raw bytes scattered")
+
+        write_data_to_ndjson(
+            records=merged_score,
+            target_path=TEST_DATA_FOLDER / "gathered_v1.ndjson",
+            if_dict_is_single_dict=False,
+        )
+        print(f"4. rank={RANK}, Saving results to disk finished")
+
+
+def mpi_v2(stream=False):
+    """All processes read their assigned chunk of the data file concurrently.
+
+    Args:
+        stream (bool): Aggregate each record as it is read instead of loading the chunk into a
+            list first, so memory does not grow with the chunk size.
+    """
     ndjson_path = RAW_DATA_FOLDER / NDJSON_FILE_NAME_TO_LOAD
     ndjson_line_num = NDJSON_TOTAL_LINE_NUM
 
-    # Each process reads its portion of the file directly
-    records = load_ndjson_file_by_process(
-        ndjson_path_for_loading=ndjson_path,
-        ndjson_line_num=ndjson_line_num,
-        process_num=SIZE,
-        r=RANK,
-        use_filter=True,
-    )
-    print(f"1. rank={RANK}, Node finished reading data")
+    if stream:
+        # Read and aggregate in one pass over a lazy record stream
+        hour_score = aggregate_score_by_hour(iter_ndjson_file_by_process(
+            ndjson_path_for_loading=ndjson_path,
+            ndjson_line_num=ndjson_line_num,
+            process_num=SIZE,
+            r=RANK,
+            use_filter=True,
+        ))
+        print(f"1-2. rank={RANK}, Node finished streaming read and individual statistics")
+    else:
+        # Each process reads its portion of the file directly
+        records = load_ndjson_file_by_process(
+            ndjson_path_for_loading=ndjson_path,
+            ndjson_line_num=ndjson_line_num,
+            process_num=SIZE,
+            r=RANK,
+            use_filter=True,
+        )
+        print(f"1. rank={RANK}, Node finished reading data")
 
-    # Each process calculates scores for its read chunk
-    hour_score = aggregate_score_by_hour(records)
-    print(f"2. rank={RANK}, Node finished individual statistics")
+        # Each process calculates scores for its read chunk
+        hour_score = aggregate_score_by_hour(records)
+        print(f"2. rank={RANK}, Node finished individual statistics")
 
     # Gather results back to rank 0
     all_hour_score = COMM.gather(hour_score, root=0)
@@ -109,48 +286,316 @@ def mpi_v2():
         print(f"5. rank={RANK}, Saving results to disk finished")
 
 
-def mpi_v3():
-    """All processes read data concurrently, calculating hourly and ID scores during the read process."""
+def mpi_v3(
+        hierarchical=False,
+        aggregation=None,
+        checkpoint_dir=None,
+        input_paths=None,
+        profile=None,
+        sample_fraction=None,
+        sample_seed=None,
+        dedup_fp_rate=None,
+        dedup_budget=None,
+        root_scatter_bytes=None,
+        mpiio_block_bytes=None,
+        mpiio_hints=None,
+        node_reader_bytes=None,
+        late_names=False,
+        transport=None,
+):
+    """All processes read data concurrently, calculating hourly and ID scores during the read process.
+
+    Args:
+        hierarchical (bool): Reduce results per node through shared memory first, then only
+            across node leaders (see a004_hierarchical). Defaults to a flat gather to rank 0.
+        aggregation (dict | None): aggregation_init() state shared by whichever read backend runs:
+            with approx_capacity, users are tracked in bounded-memory sketches and reported as an
+            approximate top-k with error bounds (see a005_sketch); with memory_budget, bytes each
+            rank may hold in its exact user table before spilling sorted runs to disk, merged
+            externally by rank 0 (see a011_spill); its line_filter skips ruled-out lines before JSON
+            parsing (see a010_pushdown); its time cube is persisted (see a007_time_cube) and its
+            metrics written to metric_<name>_v3.ndjson (see a014_aggregators).
+        checkpoint_dir (str | Path | None): If set, read newline-aligned byte ranges instead of
+            line ranges and commit progress there, so that a killed job can be resumed with any
+            rank count (see a009_checkpoint).
+        input_paths (list[Path] | None): If set, read these files as one dataset instead of
+            NDJSON_FILE_NAME_TO_LOAD, each rank getting an equal share of their bytes (see a012_dataset).
+        profile (dict | None): profile_init() state; the read-and-aggregate step runs under it
+            (see a013_profile).
+        sample_fraction (float | None): If set, every rank reads only this share of its byte range,
+            as randomly drawn newline-aligned blocks, and the scaled estimates are written with
+            confidence intervals under the suffix "v3_sample" (see a015_sample).
+        sample_seed (int | None): Seed of the block sample; None draws a different one every run.
+        dedup_fp_rate (float | None): If set, count every post id only once, checking ids against
+            per-rank Bloom filters with this false-positive rate (see a017_dedup).
+        dedup_budget (int | None): Most bytes of each rank's Bloom filter with dedup_fp_rate.
+        root_scatter_bytes (int | None): If set, rank 0 reads the file and scatters raw blocks of
+            this many bytes per rank and round instead (see root_scatter_subprocess()).
+        mpiio_block_bytes (int | None): If set, read equal byte ranges with collective MPI-IO
+            calls of this many bytes per rank instead of Python open() (see a019_mpiio).
+        mpiio_hints (dict | None): MPI-IO hints with mpiio_block_bytes; None for the defaults.
+        node_reader_bytes (int | None): If set, split the input over nodes instead of ranks; one
+            rank per node reads its node's share in blocks of this many bytes into a shared
+            ring buffer the other ranks of the node parse from (see a020_node_reader).
+        late_names (bool): Gather user scores as compact id and score arrays and fetch only the
+            top users' usernames afterwards (see a021_late_names).
+        transport (dict | None): transport_init() state; gathered payloads are then sent as
+            frames compressed above its size threshold (see a022_transport).
+    """
     ndjson_path = RAW_DATA_FOLDER / NDJSON_FILE_NAME_TO_LOAD
     ndjson_line_num = NDJSON_TOTAL_LINE_NUM
 
     # Step 1: Each process reads its portion and calculates scores simultaneously
     # IMPORTANT: Assumes mpi_v3_subprocess now returns hour_score, id_score, failure_records
-    hour_score, id_score, failure_records = mpi_v3_subprocess(
-        input_ndjson_path=ndjson_path,
-        ndjson_line_num=ndjson_line_num,
-        process_num=SIZE,
-        r=RANK,
-        use_filter=False,
-    )
+    sample_info, dedup_stats = None, None
+    aggregation = aggregation or aggregation_init()
+    approx_capacity, memory_budget = aggregation["approx_capacity"], aggregation["memory_budget"]
+    time_cube, aggregators = aggregation["time_cube"], aggregation["aggregators"]
+    with profile_section(profile):
+        if sample_fraction is not None:
+            # The same byte-range partition as --checkpoint and --input, one stratum per rank
+            hour_score, id_score, failure_records, sample_info = sampled_subprocess(
+                get_v3_byte_ranges(input_paths)[RANK],
+                sample_fraction,
+                seed=sample_seed,
+                aggregation=aggregation,
+            )
+        elif dedup_fp_rate is not None:
+            hour_score, id_score, failure_records, dedup_stats = dedup_subprocess(
+                get_v3_byte_ranges(input_paths)[RANK],
+                dedup_fp_rate,
+                bloom_budget=dedup_budget,
+                aggregation=aggregation,
+            )
+        elif root_scatter_bytes is not None:
+            hour_score, id_score, failure_records = root_scatter_subprocess(
+                ndjson_path, root_scatter_bytes, aggregation=aggregation,
+            )
+        elif mpiio_block_bytes is not None:
+            hour_score, id_score, failure_records = mpiio_subprocess(
+                ndjson_path,
+                block_bytes=mpiio_block_bytes,
+                hints=mpiio_hints,
+                aggregation=aggregation,
+            )
+        elif node_reader_bytes is not None:
+            hour_score, id_score, failure_records = node_reader_subprocess(
+                input_paths or [ndjson_path],
+                block_bytes=node_reader_bytes,
+                aggregation=aggregation,
+            )
+        elif checkpoint_dir is None and input_paths is not None:
+            hour_score, id_score, failure_records = dataset_subprocess(input_paths, aggregation=aggregation)
+        elif checkpoint_dir is None:
+            hour_score, id_score, failure_records = mpi_v3_subprocess(
+                input_ndjson_path=ndjson_path,
+                ndjson_line_num=ndjson_line_num,
+                process_num=SIZE,
+                r=RANK,
+                aggregation=aggregation,
+            )
+        else:
+            # --metrics and --memory-budget are not combined with --checkpoint, see get_args()
+            initial_ranges = [item for ranges in get_v3_byte_ranges(input_paths) for item in ranges]
+            hour_score, id_score, failure_records = checkpointed_subprocess(
+                checkpoint_dir=checkpoint_dir,
+                initial_ranges=initial_ranges,
+                id_score_merger=get_id_score_merger(approx_capacity),
+                aggregation=aggregation,
+            )
+
     print(f"Rank={RANK}, Node finished reading and statistics")
+    if aggregation["line_filter"] is not None:
+        print(f"Rank={RANK}, {format_line_filter_stats(aggregation['line_filter'])}")
 
     # Step 2: Gather results from all processes to Rank 0
-    all_hour_score = COMM.gather(hour_score, root=0)
-    print(f"Rank={RANK}, Gather hour scores finished")
-    all_id_scores = COMM.gather(id_score, root=0)
-    print(f"Rank={RANK}, Gather ID scores finished")
-    all_failure_records = COMM.gather(failure_records, root=0)
-    print(f"Rank={RANK}, Gather failure records finished")
+    all_hour_score, all_id_scores, all_failure_records, all_time_cubes, all_aggregators = gather_results(
+        hour_score, id_score, failure_records, time_cube,
+        aggregators=aggregators,
+        hierarchical=hierarchical,
+        late_names=late_names,
+        transport=transport,
+        approx_capacity=approx_capacity,
+        memory_budget=memory_budget,
+    )
+
+    all_sample_infos = COMM.gather(sample_info, root=0) if sample_info is not None else None
+    all_dedup_stats = COMM.gather(dedup_stats, root=0) if dedup_stats is not None else None
 
     # Step 3: Rank 0 merges results and saves
     if RANK == 0:
-        merge_and_write_results(
+        filename_suffix = "v3" if sample_info is None else "v3_sample"
+        merged_hour_score, merged_id_score = merge_and_write_results(
             all_hour_score,
             all_id_scores,
             all_failure_records,
-            "v3"
+            filename_suffix,
+            approx_capacity=approx_capacity,
+            list_of_time_cubes=all_time_cubes,
+            list_of_aggregators=all_aggregators,
+            late_names=late_names,
+            memory_budget=memory_budget,
         )
         print(f"Rank=0: Saving failures to disk finished")
-
-
-def mpi_v4():
+        if all_dedup_stats is not None:
+            report_dedup(all_dedup_stats)
+        if all_sample_infos is not None:
+            write_sample_intervals(merged_hour_score, merged_id_score, all_sample_infos, filename_suffix)
+        if checkpoint_dir is not None:
+            clear_checkpoint(checkpoint_dir)
+
+
+def mpi_v4(
+        hierarchical=False,
+        aggregation=None,
+        checkpoint_dir=None,
+        input_paths=None,
+        profile=None,
+        dedup_fp_rate=None,
+        dedup_budget=None,
+        node_reader_bytes=None,
+        late_names=False,
+        transport=None,
+        stage_dir=None,
+):
     """
     Uses pre-split NDJSON files. Each process calculates scores using mpi_v4_subprocess.
     If SIZE == 1, runs sequentially mimicking the parallel aggregation pattern.
     If SIZE > 1, runs in parallel with results gathered and merged on rank 0.
+
+    Args:
+        hierarchical (bool): With SIZE > 1, gather through node leaders (see mpi_v3).
+        aggregation (dict | None): aggregation_init() state shared by whichever read backend runs (see mpi_v3).
+        checkpoint_dir (str | Path | None): If set, every piece becomes a resumable work unit shared
+            out over however many ranks there are, with progress committed there (see mpi_v3).
+        input_paths (list[Path] | None): If set, these files are the pieces, bin-packed whole onto
+            ranks by size, whatever SIZE is (see a012_dataset).
+        profile (dict | None): Profile every read-and-aggregate call (see mpi_v3).
+        dedup_fp_rate (float | None): Count every post id once over all pieces, whatever SIZE is (see mpi_v3).
+        dedup_budget (int | None): Most bytes of each rank's Bloom filter (see mpi_v3).
+        node_reader_bytes (int | None): Bin-pack the pieces onto nodes instead of ranks, each node
+            reading its pieces once into a shared ring buffer, whatever SIZE is (see mpi_v3).
+        late_names (bool): With SIZE > 1, gather usernames only for the top users (see mpi_v3).
+        transport (dict | None): With SIZE > 1, send gathered payloads as compressed frames (see mpi_v3).
+        stage_dir (str | None): If set, every node first copies the pieces its ranks read to this
+            node-local folder, reusing copies left there by earlier runs, and ranks read the copies
+            (see a024_staging).
     """
-    if SIZE == 1:
+    aggregation = aggregation or aggregation_init()
+    approx_capacity, memory_budget = aggregation["approx_capacity"], aggregation["memory_budget"]
+    time_cube, aggregators = aggregation["time_cube"], aggregation["aggregators"]
+    line_filter = aggregation["line_filter"]
+    if checkpoint_dir is not None:
+        # Checkpointed runs treat every piece as a resumable byte range, whatever SIZE is
+        if input_paths is None:
+            piece_paths = [path for path in get_v4_piece_paths() if path.is_file()]
+        else:
+            piece_paths = input_paths
+        # --metrics and --memory-budget are not combined with --checkpoint, see get_args()
+        with profile_section(profile):
+            hour_score, id_score, failed_records = checkpointed_subprocess(
+                checkpoint_dir=checkpoint_dir,
+                initial_ranges=[(path, 0, path.stat().st_size) for path in piece_paths],
+                id_score_merger=get_id_score_merger(approx_capacity),
+                aggregation=aggregation,
+            )
+        all_hour_scores, all_id_scores, all_failed_records, all_time_cubes, all_aggregators = gather_results(
+            hour_score, id_score, failed_records, time_cube,
+            aggregators=aggregators,
+            hierarchical=hierarchical,
+            late_names=late_names,
+            transport=transport,
+            approx_capacity=approx_capacity,
+        )
+        if RANK == 0:
+            merge_and_write_results(
+                list_of_hour_scores=all_hour_scores,
+                list_of_id_scores=all_id_scores,
+                list_of_failed_records=all_failed_records,
+                filename_suffix="v4",
+                approx_capacity=approx_capacity,
+                list_of_time_cubes=all_time_cubes,
+                list_of_aggregators=all_aggregators,
+                late_names=late_names,
+            )
+            clear_checkpoint(checkpoint_dir)
+
+    elif dedup_fp_rate is not None:
+        # Duplicates may sit in different pieces, so all ranks check ids together, whatever SIZE is
+        if input_paths is None:
+            piece_paths = [path for path in get_v4_piece_paths() if path.is_file()]
+        else:
+            piece_paths = input_paths
+        with profile_section(profile):
+            hour_score, id_score, failed_records, dedup_stats = dedup_subprocess(
+                assign_files_by_size([(path, path.stat().st_size) for path in piece_paths], SIZE)[RANK],
+                dedup_fp_rate,
+                bloom_budget=dedup_budget,
+                aggregation=aggregation,
+            )
+        all_hour_scores, all_id_scores, all_failed_records, all_time_cubes, all_aggregators = gather_results(
+            hour_score, id_score, failed_records, time_cube,
+            aggregators=aggregators,
+            hierarchical=hierarchical,
+            late_names=late_names,
+            transport=transport,
+            approx_capacity=approx_capacity,
+            memory_budget=memory_budget,
+        )
+        all_dedup_stats = COMM.gather(dedup_stats, root=0)
+        if RANK == 0:
+            merge_and_write_results(
+                list_of_hour_scores=all_hour_scores,
+                list_of_id_scores=all_id_scores,
+                list_of_failed_records=all_failed_records,
+                filename_suffix="v4",
+                approx_capacity=approx_capacity,
+                list_of_time_cubes=all_time_cubes,
+                list_of_aggregators=all_aggregators,
+                late_names=late_names,
+                memory_budget=memory_budget,
+            )
+            report_dedup(all_dedup_stats)
+
+    elif input_paths is not None or node_reader_bytes is not None:
+        with profile_section(profile):
+            if node_reader_bytes is not None:
+                hour_score, id_score, failed_records = node_reader_subprocess(
+                    input_paths or [path for path in get_v4_piece_paths() if path.is_file()],
+                    whole_files=True,
+                    block_bytes=node_reader_bytes,
+                    aggregation=aggregation,
+                )
+            else:
+                hour_score, id_score, failed_records = dataset_subprocess(
+                    input_paths,
+                    whole_files=True,
+                    aggregation=aggregation,
+                    stage_dir=stage_dir,
+                )
+        all_hour_scores, all_id_scores, all_failed_records, all_time_cubes, all_aggregators = gather_results(
+            hour_score, id_score, failed_records, time_cube,
+            aggregators=aggregators,
+            hierarchical=hierarchical,
+            late_names=late_names,
+            transport=transport,
+            approx_capacity=approx_capacity,
+            memory_budget=memory_budget,
+        )
+        if RANK == 0:
+            merge_and_write_results(
+                list_of_hour_scores=all_hour_scores,
+                list_of_id_scores=all_id_scores,
+                list_of_failed_records=all_failed_records,
+                filename_suffix="v4",
+                approx_capacity=approx_capacity,
+                list_of_time_cubes=all_time_cubes,
+                list_of_aggregators=all_aggregators,
+                late_names=late_names,
+                memory_budget=memory_budget,
+            )
+
+    elif SIZE == 1:
         # ---Serial execution path (mimicking parallel aggregation)---
         print(f"--- Starting Serial Processing (Mimicking MPI Gather) of {FILE_PIECES_FOR_MPI_V4} Split Files ---")
         serial_start_time = time.time()
@@ -167,9 +612,16 @@ def mpi_v4():
             base_name = NDJSON_FILE_NAME_TO_LOAD
             extension_with_dot = ""
 
+        staged_paths = {}
+        if stage_dir is not None:
+            piece_paths = [path for path in get_v4_piece_paths() if path.is_file()]
+            staged_ranges = stage_ranges([(str(path), 0, 0) for path in piece_paths], stage_dir)
+            staged_paths = {path: Path(staged) for path, (staged, _, _) in zip(piece_paths, staged_ranges)}
+
         for i in range(FILE_PIECES_FOR_MPI_V4):
             split_file_name = f"{base_name}_piece_{i}{extension_with_dot}"
             split_file_path = PIECES_DATA_FOLDER / split_file_name
+            split_file_path = staged_paths.get(split_file_path, split_file_path)
 
             if not split_file_path.is_file():
                 # Handle missing file
@@ -177,10 +629,14 @@ def mpi_v4():
                 continue
 
             print(f"  Processing piece {i}: {split_file_path}...")
-            hour_score_piece, id_score_piece, failed_records_piece = mpi_v4_subprocess(
-                file_path=split_file_path,
-                use_filter=False,
-            )
+            with profile_section(profile):
+                hour_score_piece, id_score_piece, failed_records_piece = mpi_v4_subprocess(
+                    file_path=split_file_path,
+                    aggregation=aggregation,
+                )
+            if memory_budget is not None:
+                # Keep only one piece's user table in memory at a time
+                user_spill_flush(id_score_piece)
 
             # Store results rather than merging immediately
             all_hour_scores_serial.append(hour_score_piece)
@@ -190,13 +646,20 @@ def mpi_v4():
             print(f"  Finished processing piece {i}.")
 
         print("Completed processing all pieces sequentially.")
+        if line_filter is not None:
+            print(f"Serial run: {format_line_filter_stats(line_filter)}")
 
         # Call the refactored merge and write function
         merge_and_write_results(
             list_of_hour_scores=all_hour_scores_serial,
             list_of_id_scores=all_id_scores_serial,
             list_of_failed_records=all_failed_records_serial,
-            filename_suffix="v4_serial_mimic"  # suffix for the serial run
+            filename_suffix="v4_serial_mimic",  # suffix for the serial run
+            approx_capacity=approx_capacity,
+            # All pieces filled the same time cube and metric states
+            list_of_time_cubes=[time_cube] if time_cube is not None else None,
+            list_of_aggregators=[aggregators] if aggregators is not None else None,
+            memory_budget=memory_budget,
         )
 
         # Print total time for serial run
@@ -216,23 +679,41 @@ def mpi_v4():
         except IndexError:
             split_file_name = f"{NDJSON_FILE_NAME_TO_LOAD}_piece_{RANK}"
         split_file_path = PIECES_DATA_FOLDER / split_file_name
+        if stage_dir is not None:
+            split_file_path = Path(stage_ranges([(str(split_file_path), 0, 0)], stage_dir)[0][0])
 
         # Call mpi_v4_subprocess
-        hour_score, id_score, failed_records = mpi_v4_subprocess(
-            file_path=split_file_path,
-            use_filter=False,
-        )
+        with profile_section(profile):
+            hour_score, id_score, failed_records = mpi_v4_subprocess(
+                file_path=split_file_path,
+                aggregation=aggregation,
+            )
 
         # Print processing info
+        if approx_capacity is not None:
+            id_score_info = "sketched"
+        elif memory_budget is not None:
+            id_score_info = "spilled"
+        else:
+            id_score_info = len(id_score)
         print(
             f"Rank={RANK}: "
             f"Processed file {split_file_name}. Found {len(hour_score)} hour scores, "
-            f"{len(id_score)} ID scores. {len(failed_records)} failures."
+            f"{id_score_info} ID scores. "
+            f"{len(failed_records)} failures."
+        )
+        if line_filter is not None:
+            print(f"Rank={RANK}: {format_line_filter_stats(line_filter)}")
+
+        all_hour_scores, all_id_scores, all_failed_records, all_time_cubes, all_aggregators = gather_results(
+            hour_score, id_score, failed_records, time_cube,
+            aggregators=aggregators,
+            hierarchical=hierarchical,
+            late_names=late_names,
+            transport=transport,
+            approx_capacity=approx_capacity,
+            memory_budget=memory_budget,
         )
-
-        all_hour_scores = COMM.gather(hour_score, root=0)
-        all_id_scores = COMM.gather(id_score, root=0)
-        all_failed_records = COMM.gather(failed_records, root=0)
         print(f"Rank={RANK}: Gather finished.")
 
         if RANK == 0:
@@ -242,14 +723,46 @@ def mpi_v4():
                 list_of_id_scores=all_id_scores,
                 list_of_failed_records=all_failed_records,
                 filename_suffix="v4",
+                approx_capacity=approx_capacity,
+                list_of_time_cubes=all_time_cubes,
+                list_of_aggregators=all_aggregators,
+                late_names=late_names,
+                memory_budget=memory_budget,
             )
 
 
+def mpi_auto(plan, **kwargs):
+    """Runs the strategy chosen by the --auto planner on NDJSON_FILE_NAME_TO_LOAD (see a018_planner).
+
+    Byte-range and root-scatter plans run as v3, pre-split plans as v4 on plan["pieces"] pieces
+    that rank 0 first writes if they do not exist yet.
+
+    Args:
+        plan (dict): From make_plan().
+        **kwargs: Options of mpi_v3() and mpi_v4() other than input_paths.
+    """
+    ndjson_path = RAW_DATA_FOLDER / NDJSON_FILE_NAME_TO_LOAD
+    if plan["strategy"] == "byte-range":
+        mpi_v3(input_paths=[ndjson_path], **kwargs)
+    elif plan["strategy"] == "root-scatter":
+        mpi_v3(root_scatter_bytes=plan["block_bytes"], **kwargs)
+    else:
+        piece_paths = ensure_plan_pieces(
+            plan, ndjson_path, NDJSON_TOTAL_LINE_NUM, line_filter=kwargs["aggregation"]["line_filter"],
+        )
+        mpi_v4(input_paths=piece_paths, **kwargs)
+
+
 def merge_and_write_results(
         list_of_hour_scores: list,
         list_of_id_scores: list,
         list_of_failed_records: list,  # list of lists
-        filename_suffix: str
+        filename_suffix: str,
+        approx_capacity: int | None = None,
+        list_of_time_cubes: list | None = None,
+        memory_budget: int | None = None,
+        list_of_aggregators: list | None = None,
+        late_names: bool = False,
 ):
     """
 Combines aggregated results collected from each part/process and writes the final merged data to the output file.
@@ -259,6 +772,24 @@ Args:
     list_of_id_scores: A list of id_score dictionaries from each part or process.
     list_of_failed_records: A list of lists containing failed records from each part or process.
     filename_suffix: A string suffix appended to the base output file name (e.g. "", "_serial_mimic").
+    approx_capacity: If set, list_of_id_scores holds user sketches of this capacity. They are merged
+        and only the approximate top-k users are written, to merged_id_topk_approx_<suffix>.ndjson.
+    list_of_time_cubes: Optional time cubes from each part or process, merged and written to
+        time_cube_<suffix>.bin for later queries with a007_time_cube.
+    memory_budget: Set when list_of_id_scores holds spill states. Their runs are merged externally
+        and streamed to the output files, so the merged user table is never held in memory.
+    list_of_aggregators: Optional aggregators_init() states from each part or process, merged
+        metric by metric and written to metric_<name>_<suffix>.ndjson.
+    late_names: Set when list_of_id_scores holds the single id_score of gather_id_score_late_names(),
+        whose usernames are only known for the top users. Scores are written without usernames to
+        merged_id_score_nonames_<suffix>.ndjson, the top users to merged_id_topk_<suffix>.ndjson,
+        and the result store gets no users.
+
+Returns:
+    tuple[dict, object]: The merged hour_score and id_score (a drained spill state with memory_budget).
+
+The merged scores are also written to result_store_<suffix>.bin, an indexed binary store
+queried with a008_result_store.
     """
     caller_prefix = "Rank=0" if RANK == 0 and SIZE > 1 else "Serial merge"
 
@@ -273,12 +804,17 @@ Args:
     print(f"{caller_prefix}: Hourly score merge finished ({len(merged_hour_score)} keys)")
 
     # 2. Merge ID scores
-    merged_id_score: dict = join_dict_pieces_hour_score(
-        list_of_id_scores,
-        value_type="list",
-        mode="sum",
-    )
-    print(f"{caller_prefix}: ID score merge finished ({len(merged_id_score)} keys)")
+    if late_names:
+        merged_id_score = list_of_id_scores[0]
+    else:
+        merged_id_score = get_id_score_merger(approx_capacity, memory_budget)(list_of_id_scores)
+    if memory_budget is not None:
+        print(f"{caller_prefix}: ID score runs collected ({len(merged_id_score['runs'])} runs), "
+              f"merging while writing")
+    elif approx_capacity is None:
+        print(f"{caller_prefix}: ID score merge finished ({len(merged_id_score)} keys)")
+    else:
+        print(f"{caller_prefix}: User sketch merge finished (capacity {approx_capacity})")
 
     # 3. Collect all failure records (flatten list of lists)
     merged_failures: list = []
@@ -303,28 +839,205 @@ Args:
         target_path=output_hour_path,
         if_dict_is_single_dict=False,
     )
-    write_data_to_ndjson(
-        records=merged_id_score,
-        target_path=output_id_path,
-        if_dict_is_single_dict=False,
-    )
+    if memory_budget is not None:
+        pass  # Streamed to output_id_path together with the result store below
+    elif late_names:
+        write_data_to_ndjson(
+            records={k: v[0] for k, v in merged_id_score.items()},
+            target_path=TEST_DATA_FOLDER / f"merged_id_score_nonames_{filename_suffix}.ndjson",
+            if_dict_is_single_dict=False,
+        )
+        print_and_write_late_names_top_k(
+            merged_id_score,
+            target_path=TEST_DATA_FOLDER / f"merged_id_topk_{filename_suffix}.ndjson",
+        )
+    elif approx_capacity is None:
+        write_data_to_ndjson(
+            records=merged_id_score,
+            target_path=output_id_path,
+            if_dict_is_single_dict=False,
+        )
+    else:
+        print_and_write_approx_user_top_k(
+            merged_id_score,
+            target_path=TEST_DATA_FOLDER / f"merged_id_topk_approx_{filename_suffix}.ndjson",
+        )
     write_data_to_ndjson(
         records=merged_failures,
         target_path=output_failures_path,
         if_dict_is_single_dict=None,
     )
 
+    if memory_budget is not None:
+        store_users = iter_and_write_ndjson(user_spill_iter_sorted(merged_id_score), output_id_path)
+    elif late_names:
+        print(f"{caller_prefix}: Usernames outside the top users were not gathered, "
+              f"the result store only holds hours")
+        store_users = {}
+    elif approx_capacity is None:
+        store_users = merged_id_score
+    else:
+        store_users = {}
+    write_result_store(
+        merged_hour_score,
+        store_users,
+        TEST_DATA_FOLDER / f"result_store_{filename_suffix}.bin",
+    )
+    print(f"{caller_prefix}: Result store written")
+    if memory_budget is not None:
+        print(f"{caller_prefix}: All ranks {format_spill_stats(merged_id_score)}")
+
+    if list_of_time_cubes is not None:
+        merged_time_cube = time_cube_merge(list_of_time_cubes)
+        write_time_cube(merged_time_cube, TEST_DATA_FOLDER / f"time_cube_{filename_suffix}.bin")
+        print(f"{caller_prefix}: Time cube written ({len(merged_time_cube['cells'])} cells)")
+
+    if list_of_aggregators:
+        for name, state in aggregators_merge(list_of_aggregators).items():
+            records = AGGREGATORS[name]["to_records"](state)
+            write_data_to_ndjson(
+                records=records,
+                target_path=TEST_DATA_FOLDER / f"metric_{name}_{filename_suffix}.ndjson",
+                if_dict_is_single_dict=None,
+            )
+            print(f"{caller_prefix}: Metric '{name}' written ({len(records)} records)")
+
     print(f"{caller_prefix}: Writing complete to {TEST_DATA_FOLDER}")
+    return merged_hour_score, merged_id_score
+
+
+def gather_results(
+        hour_score,
+        id_score,
+        failed_records,
+        time_cube,
+        hierarchical=False,
+        approx_capacity=None,
+        memory_budget=None,
+        aggregators=None,
+        late_names=False,
+        transport=None,
+):
+    """Gathers every rank's partial results to rank 0.
+
+    Args:
+        hour_score (dict): This rank's hour_score.
+        id_score (dict): This rank's id_score, or user sketches with approx_capacity.
+        failed_records (list): This rank's failed records.
+        time_cube (dict | None): This rank's time cube, if one is built.
+        hierarchical (bool): Reduce per node through shared memory first (see a004_hierarchical).
+        approx_capacity (int | None): Set when id_score holds user sketches.
+        memory_budget (int | None): Set when id_score is a spill state. Its table is spilled
+            before gathering, so only the list of runs travels.
+        aggregators (dict | None): This rank's aggregators_init() state, if metrics are computed.
+        late_names (bool): Gather the exact id_score without usernames and resolve only the top
+            users' ones (see a021_late_names); rank 0 then gets a single merged id_score.
+        transport (dict | None): transport_init() state; every gathered object then travels as
+            a frame, compressed above the transport's size threshold (see a022_transport).
+
+    Returns:
+        tuple[list, list, list, list | None, list | None]: On rank 0, the lists of hour_score,
+        id_score, failed-record, time-cube and aggregator parts (the last two None if not built).
+        None values elsewhere.
+    """
+    if memory_budget is not None:
+        user_spill_flush(id_score)
+        print(f"Rank={RANK}, {format_spill_stats(id_score)}")
 
+    if transport is None:
+        gather = functools.partial(COMM.gather, root=0)
+    else:
+        gather = functools.partial(transport_gather, transport=transport)
+
+    if late_names:
+        all_hour_scores = gather(hour_score)
+        print(f"Rank={RANK}, Gather hour scores finished")
+        merged_id_score = gather_id_score_late_names(id_score)
+        all_id_scores = [merged_id_score] if RANK == 0 else None
+        print(f"Rank={RANK}, Gather ID scores without usernames finished")
+        all_failed_records = gather(failed_records)
+        print(f"Rank={RANK}, Gather failure records finished")
+    elif hierarchical:
+        all_hour_scores, all_id_scores, all_failed_records = hierarchical_gather(
+            hour_score, id_score, failed_records,
+            id_score_merger=get_id_score_merger(approx_capacity, memory_budget),
+            transport=transport,
+        )
+        print(f"Rank={RANK}, Hierarchical gather finished")
+    else:
+        all_hour_scores = gather(hour_score)
+        print(f"Rank={RANK}, Gather hour scores finished")
+        all_id_scores = gather(id_score)
+        print(f"Rank={RANK}, Gather ID scores finished")
+        all_failed_records = gather(failed_records)
+        print(f"Rank={RANK}, Gather failure records finished")
+    all_time_cubes = gather(time_cube) if time_cube is not None else None
+    if aggregators is not None:
+        aggregators_reduce(aggregators)
+    all_aggregators = gather(aggregators) if aggregators is not None else None
+    return all_hour_scores, all_id_scores, all_failed_records, all_time_cubes, all_aggregators
+
+
+def get_v3_byte_ranges(input_paths=None):
+    """Returns the byte-range partition of the v3 input, one list of ranges per rank.
+
+    Args:
+        input_paths (list[Path] | None): Files of a multi-file dataset (see a012_dataset), or
+            None for NDJSON_FILE_NAME_TO_LOAD.
+
+    Returns:
+        list: One list of (file_path, start, end) ranges per rank.
+    """
+    if input_paths is None:
+        ndjson_path = RAW_DATA_FOLDER / NDJSON_FILE_NAME_TO_LOAD
+        return [
+            [(ndjson_path, start, end)]
+            for start, end in compute_byte_ranges(ndjson_path.stat().st_size, SIZE)
+        ]
+    return assign_byte_ranges_by_size([(path, path.stat().st_size) for path in input_paths], SIZE)
+
+
+def get_v4_piece_paths():
+    """Returns the paths of the FILE_PIECES_FOR_MPI_V4 pieces written by split_file()."""
+    original = Path(NDJSON_FILE_NAME_TO_LOAD)
+    return [
+        PIECES_DATA_FOLDER / f"{original.stem}_piece_{i}{original.suffix}"
+        for i in range(FILE_PIECES_FOR_MPI_V4)
+    ]
+
+
+def get_id_score_merger(approx_capacity, memory_budget=None):
+    """Returns the function merging a list of per-rank id_score objects.
+
+    Args:
+        approx_capacity (int | None): Sketch capacity of the --approx mode, None for exact scores.
+        memory_budget (int | None): Set in the --memory-budget mode, where id_score objects are
+            spill states and merging only collects their runs.
+
+    Returns:
+        callable: list -> merged id_score.
+    """
+    if memory_budget is not None:
+        return user_spill_merge
+    if approx_capacity is None:
+        return functools.partial(join_dict_pieces_hour_score, value_type="list", mode="sum")
+    return functools.partial(user_sketches_merge, capacity=approx_capacity)
 
-def measure_mpi(func):
-    """Decorator or wrapper to measure execution time for MPI functions, executed by rank 0."""
+
+def measure_mpi(func, **kwargs):
+    """Decorator or wrapper to measure execution time for MPI functions, executed by rank 0.
+
+    Keyword arguments are forwarded to func.
+
+    Returns:
+        float | None: The elapsed seconds on rank 0, None elsewhere.
+    """
     start_time = 0.0
     if RANK == 0:
         print(f"Starting measurement for {func.__name__}...")
         start_time = time.time()
 
-    func()
+    func(**kwargs)
 
     COMM.Barrier()
 
@@ -333,15 +1046,24 @@ def measure_mpi(func):
         elapsed_time = end_time - start_time
         print(f"Function '{func.__name__}' execution finished.")
         print(f"Total time consumption: {elapsed_time:.5f} seconds")
+        return elapsed_time
+    return None
 
 
-def try_split_file_by_rank0():
-    """Function to call the file splitting utility (intended for Rank 0 execution)."""
+def try_split_file_by_rank0(line_filter=None):
+    """Function to call the file splitting utility (intended for Rank 0 execution).
+
+    Args:
+        line_filter (dict | None): Optional build_line_filter() state applied while splitting.
+            Existing pieces are only reused if their manifest records the same filter, otherwise
+            they are split again.
+    """
     if RANK == 0:
         if not check_split_files_exist(
                 original_file_path=RAW_DATA_FOLDER / NDJSON_FILE_NAME_TO_LOAD,
                 to_pieces_num=FILE_PIECES_FOR_MPI_V4,
                 output_folder=PIECES_DATA_FOLDER,
+                line_filter=line_filter,
         ):
             print("Rank=0: Starting file splitting...")
             split_file(
@@ -350,8 +1072,13 @@ def try_split_file_by_rank0():
                 to_pieces_num=FILE_PIECES_FOR_MPI_V4,
                 output_folder=PIECES_DATA_FOLDER,
                 use_filter=True,
+                line_filter=line_filter,
             )
             print("Rank=0: File splitting finished.")
+            if line_filter is not None:
+                print(f"Rank=0: Splitting {format_line_filter_stats(line_filter)}")
+                # Rank 0 reads its own piece with the same state next
+                reset_line_filter_stats(line_filter)
         else:
             print("Rank=0: File splitting skipped, because the pieces already exist.")
     COMM.Barrier()
@@ -364,29 +1091,356 @@ def get_args():
     parser.add_argument(
         '-v', '--version',
         type=int,
-        choices=[3, 4],
-        required=True,
-        help='Specify the MPI version to run (3 or 4)'
+        choices=[1, 2, 3, 4],
+        default=None,
+        help='Specify the MPI version to run (1 to 4)'
+    )
+    parser.add_argument(
+        '--auto',
+        action='store_true',
+        help='Instead of -v, let a cost model pick root-scatter, byte-range or pre-split pieces '
+             'and the piece count and block size (calibrate it with a006_benchmark.py calibrate)'
+    )
+    parser.add_argument(
+        '--root-reader',
+        action='store_true',
+        help='v1 only: scatter raw newline-aligned byte blocks read by rank 0 instead of parsed records'
+    )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help=f'v1/v2: read and aggregate lazily, in rounds of {STREAM_BATCH_RECORDS} records per rank for v1, '
+             f'instead of loading every record first'
+    )
+    parser.add_argument(
+        '--hierarchical',
+        action='store_true',
+        help='v3/v4: reduce results per node in shared memory, then only across node leaders'
+    )
+    parser.add_argument(
+        '--approx',
+        type=int,
+        nargs='?',
+        const=APPROX_SKETCH_CAPACITY,
+        default=None,
+        metavar='CAPACITY',
+        help=f'v3/v4: find top users with fixed-memory sketches (default capacity {APPROX_SKETCH_CAPACITY})'
+    )
+    parser.add_argument(
+        '--time-cube',
+        type=int,
+        nargs='?',
+        const=1,
+        default=None,
+        metavar='USER_BUCKETS',
+        help='v3/v4: also persist an epoch-hour cube of sum/count/min/max, optionally per user bucket'
+    )
+    parser.add_argument(
+        '--checkpoint',
+        default=None,
+        metavar='DIR',
+        help='v3/v4: commit progress to DIR and resume from it if a previous run was interrupted'
+    )
+    parser.add_argument(
+        '--input',
+        default=None,
+        metavar='PATH',
+        help='v3/v4: read a file, a directory of *.ndjson files or a glob as one dataset'
+    )
+    parser.add_argument(
+        '--metrics',
+        nargs='+',
+        choices=sorted(AGGREGATORS),
+        default=None,
+        metavar='METRIC',
+        help=f'v3/v4: extra metrics computed in the same pass, from {", ".join(sorted(AGGREGATORS))}'
+    )
+    parser.add_argument(
+        '--sample',
+        type=float,
+        default=None,
+        metavar='FRACTION',
+        help='v3 only: estimate from this share of random byte blocks per rank, with confidence intervals'
+    )
+    parser.add_argument('--sample-seed', type=int, default=None, help='Seed of --sample (default: random)')
+    parser.add_argument(
+        '--dedup',
+        action='store_true',
+        help='v3/v4: count every post id (doc.id) once, checked by its owner rank in a Bloom filter'
+    )
+    parser.add_argument(
+        '--dedup-fp-rate',
+        type=float,
+        default=DEDUP_FALSE_POSITIVE_RATE,
+        metavar='RATE',
+        help=f'Target false-positive rate of --dedup, i.e. share of unique posts dropped '
+             f'(default {DEDUP_FALSE_POSITIVE_RATE})'
+    )
+    parser.add_argument(
+        '--dedup-memory',
+        type=float,
+        default=None,
+        metavar='MIB',
+        help='Per-rank MiB cap of the --dedup Bloom filter; a smaller filter raises the reported rate'
     )
-    return parser.parse_args()
+    parser.add_argument(
+        '--mpiio',
+        type=float,
+        nargs='?',
+        const=MPIIO_BLOCK_BYTES / (1 << 20),
+        default=None,
+        metavar='MIB',
+        help=f'v3 only: read with collective MPI-IO calls of MIB per rank '
+             f'(default {MPIIO_BLOCK_BYTES >> 20}) instead of Python open()'
+    )
+    parser.add_argument(
+        '--mpiio-hint',
+        action='append',
+        default=None,
+        metavar='KEY=VALUE',
+        help='MPI-IO hint for --mpiio, e.g. cb_nodes=4; an empty VALUE drops a default hint (repeatable)'
+    )
+    parser.add_argument(
+        '--node-reader',
+        type=float,
+        nargs='?',
+        const=NODE_READER_BLOCK_BYTES / (1 << 20),
+        default=None,
+        metavar='MIB',
+        help=f'v3/v4: read every byte once per node, one rank streaming blocks of MIB '
+             f'(default {NODE_READER_BLOCK_BYTES >> 20}) into shared memory the node\'s other ranks parse'
+    )
+    parser.add_argument(
+        '--late-names',
+        action='store_true',
+        help=f'v3/v4: gather user scores without usernames and look up only the top {LATE_NAMES_TOP_K} '
+             f'users\' ones; all scores are written without usernames'
+    )
+    parser.add_argument(
+        '--compress-transport',
+        action='store_true',
+        help='v3/v4: send gathered results as zlib-compressed frames when the measured link makes it pay off'
+    )
+    parser.add_argument(
+        '--compress-threshold',
+        type=float,
+        default=None,
+        metavar='MIB',
+        help='With --compress-transport, compress payloads from MIB on instead of measuring (0: always)'
+    )
+    parser.add_argument(
+        '--stage',
+        nargs='?',
+        const='',
+        default=None,
+        metavar='DIR',
+        help=f'v4: copy each node\'s pieces to node-local DIR (default ${STAGE_DIR_ENV}/{STAGE_SUBFOLDER}) '
+             f'and read them there; later runs reuse copies whose source is unchanged'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='v3/v4: run each rank\'s read-and-aggregate step under cProfile, merge the stats on rank 0'
+    )
+    parser.add_argument(
+        '--profile-memory',
+        action='store_true',
+        help='With --profile, also report each rank\'s peak Python allocations (tracemalloc, slow)'
+    )
+    parser.add_argument(
+        '--memory-budget',
+        type=float,
+        default=None,
+        metavar='MIB',
+        help=f'v3/v4: per-rank MiB for the exact user table; beyond it, sorted runs spill to {SPILL_DATA_FOLDER}'
+    )
+    filter_group = parser.add_argument_group(
+        'line filter',
+        'v3/v4: predicates checked on raw lines before JSON parsing (also applied when splitting pieces for v4)'
+    )
+    filter_group.add_argument(
+        '--require-field',
+        action='append',
+        default=None,
+        metavar='FIELD',
+        help='Only keep records whose doc has FIELD, e.g. sentiment (repeatable)'
+    )
+    filter_group.add_argument('--created-from', default=None, help="Inclusive createdAt prefix, e.g. 2024-03-01")
+    filter_group.add_argument('--created-to', default=None, help="Exclusive createdAt prefix, e.g. 2024-04-01")
+    filter_group.add_argument(
+        '--account-ids',
+        default=None,
+        help='Comma-separated account IDs, or a file with one ID per line'
+    )
+    args = parser.parse_args()
+    if (args.version is None) == (not args.auto):
+        parser.error("choose exactly one of -v/--version and --auto")
+    if args.auto and (args.root_reader or args.input or args.checkpoint or args.sample is not None or args.dedup):
+        parser.error("--auto cannot be combined with --root-reader, --input, --checkpoint, --sample or --dedup")
+    if args.mpiio is not None and (
+            args.version != 3 or args.input or args.checkpoint or args.sample is not None or args.dedup
+    ):
+        parser.error("--mpiio only runs with -v 3 and without --input, --checkpoint, --sample or --dedup")
+    if args.mpiio_hint and args.mpiio is None:
+        parser.error("--mpiio-hint requires --mpiio")
+    try:
+        parse_mpiio_hints(args.mpiio_hint)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.node_reader is not None and (
+            args.version not in [3, 4] or args.checkpoint or args.sample is not None or args.dedup
+            or args.mpiio is not None
+    ):
+        parser.error("--node-reader only runs with -v 3 or 4 and without --checkpoint, --sample, --dedup or --mpiio")
+    if args.late_names and (
+            args.version not in [3, 4] or args.hierarchical or args.approx is not None
+            or args.memory_budget is not None or args.sample is not None
+    ):
+        parser.error("--late-names only runs with -v 3 or 4 and without --hierarchical, --approx, "
+                     "--memory-budget or --sample")
+    if args.stage is not None and (args.version != 4 or args.checkpoint or args.dedup or args.node_reader is not None):
+        parser.error("--stage only runs with -v 4 and without --checkpoint, --dedup or --node-reader")
+    if args.root_reader and args.version != 1:
+        parser.error("--root-reader only runs with -v 1")
+    if args.stream and (args.version not in [1, 2] or args.root_reader):
+        parser.error("--stream only runs with -v 1 or 2 and without --root-reader")
+    if args.hierarchical and args.version in [1, 2]:
+        parser.error("--hierarchical only runs with -v 3, -v 4 or --auto")
+    if args.approx is not None and args.version in [1, 2]:
+        parser.error("--approx only runs with -v 3, -v 4 or --auto")
+    if args.time_cube is not None and args.version in [1, 2]:
+        parser.error("--time-cube only runs with -v 3, -v 4 or --auto")
+    if args.checkpoint is not None and args.version in [1, 2]:
+        parser.error("--checkpoint only runs with -v 3 or 4")
+    if (args.require_field or args.created_from or args.created_to or args.account_ids) and args.version in [1, 2]:
+        parser.error("--require-field, --created-from, --created-to and --account-ids only run with -v 3, -v 4 "
+                     "or --auto")
+    if (args.profile or args.profile_memory) and args.version in [1, 2]:
+        parser.error("--profile/--profile-memory only run with -v 3, -v 4 or --auto")
+    if args.memory_budget is not None and args.version in [1, 2]:
+        parser.error("--memory-budget only runs with -v 3, -v 4 or --auto")
+    if args.metrics and args.version in [1, 2]:
+        parser.error("--metrics only runs with -v 3, -v 4 or --auto")
+    if args.compress_transport and args.version in [1, 2]:
+        parser.error("--compress-transport only runs with -v 3, -v 4 or --auto")
+    if args.compress_threshold is not None and not args.compress_transport:
+        parser.error("--compress-threshold requires --compress-transport")
+    if args.memory_budget is not None and (args.approx is not None or args.checkpoint is not None):
+        parser.error("--memory-budget cannot be combined with --approx or --checkpoint")
+    if args.metrics and args.checkpoint is not None:
+        parser.error("--metrics cannot be combined with --checkpoint")
+    if args.sample is not None:
+        if not 0 < args.sample <= 1:
+            parser.error("--sample must be in (0, 1]")
+        if args.version != 3 or any(
+                option is not None for option in [args.approx, args.checkpoint, args.memory_budget, args.time_cube]
+        ) or args.metrics:
+            parser.error("--sample only runs with -v 3 and without --approx, --checkpoint, "
+                         "--memory-budget, --time-cube or --metrics")
+    if args.dedup:
+        if args.version not in [3, 4] or args.checkpoint is not None or args.sample is not None:
+            parser.error("--dedup only runs with -v 3 or 4 and without --checkpoint or --sample")
+        if not 0 < args.dedup_fp_rate < 1:
+            parser.error("--dedup-fp-rate must be in (0, 1)")
+    return args
 
 
 def start_main():
     args = get_args()
     selected_version = args.version
+    line_filter = build_line_filter(
+        require_fields=args.require_field,
+        created_from=args.created_from,
+        created_to=args.created_to,
+        account_ids=load_account_ids(args.account_ids) if args.account_ids else None,
+    )
+    # One aggregation state per rank, whichever version and read backend runs
+    aggregation = aggregation_init(
+        approx_capacity=args.approx,
+        cube_bucket_num=args.time_cube,
+        line_filter=line_filter,
+        memory_budget=int(args.memory_budget * (1 << 20)) if args.memory_budget is not None else None,
+        metrics=args.metrics,
+    )
+    input_paths = resolve_input_paths(args.input) if args.input else None
+    profile = profile_init(trace_memory=args.profile_memory) if args.profile or args.profile_memory else None
+    dedup_fp_rate = args.dedup_fp_rate if args.dedup else None
+    dedup_budget = int(args.dedup_memory * (1 << 20)) if args.dedup_memory is not None else None
+    mpiio_block_bytes = int(args.mpiio * (1 << 20)) if args.mpiio is not None else None
+    mpiio_hints = parse_mpiio_hints(args.mpiio_hint)
+    node_reader_bytes = int(args.node_reader * (1 << 20)) if args.node_reader is not None else None
+    stage_dir = str(get_stage_dir(args.stage)) if args.stage is not None else None
+    transport = None
+    if args.compress_transport:
+        transport = transport_init(
+            threshold_bytes=int(args.compress_threshold * (1 << 20)) if args.compress_threshold is not None else None,
+        )
 
     # Execute based on the selected version
-    if selected_version == 3:
+    if args.auto:
+        plan = make_plan(RAW_DATA_FOLDER / NDJSON_FILE_NAME_TO_LOAD, line_filter=line_filter)
+        selected_version = 4 if plan["strategy"] == "pre-split" else 3
+        if RANK == 0:
+            print(f"--- Auto-planned {plan['strategy']} (MPI v{selected_version}) ---")
+        elapsed_time = measure_mpi(
+            mpi_auto,
+            plan=plan,
+            hierarchical=args.hierarchical,
+            aggregation=aggregation,
+            profile=profile,
+            transport=transport,
+        )
+        if RANK == 0:
+            log_plan_result(plan, elapsed_time)
+    elif selected_version == 1:
+        if RANK == 0:
+            print("--- Selected MPI v1 ---")
+        measure_mpi(mpi_v1, root_reader=args.root_reader, stream=args.stream)
+    elif selected_version == 2:
+        if RANK == 0:
+            print("--- Selected MPI v2 ---")
+        measure_mpi(mpi_v2, stream=args.stream)
+    elif selected_version == 3:
         if RANK == 0:
             print("--- Selected MPI v3 ---")
-        measure_mpi(mpi_v3)
+        measure_mpi(
+            mpi_v3,
+            hierarchical=args.hierarchical,
+            aggregation=aggregation,
+            checkpoint_dir=args.checkpoint,
+            input_paths=input_paths,
+            profile=profile,
+            sample_fraction=args.sample,
+            sample_seed=args.sample_seed,
+            dedup_fp_rate=dedup_fp_rate,
+            dedup_budget=dedup_budget,
+            mpiio_block_bytes=mpiio_block_bytes,
+            mpiio_hints=mpiio_hints,
+            node_reader_bytes=node_reader_bytes,
+            late_names=args.late_names,
+            transport=transport,
+        )
     elif selected_version == 4:
         if RANK == 0:
             print("--- Selected MPI v4 ---")
-        try_split_file_by_rank0()
-        measure_mpi(mpi_v4)
+        if input_paths is None:
+            try_split_file_by_rank0(line_filter=line_filter)
+        measure_mpi(
+            mpi_v4,
+            hierarchical=args.hierarchical,
+            aggregation=aggregation,
+            checkpoint_dir=args.checkpoint,
+            input_paths=input_paths,
+            profile=profile,
+            dedup_fp_rate=dedup_fp_rate,
+            dedup_budget=dedup_budget,
+            node_reader_bytes=node_reader_bytes,
+            late_names=args.late_names,
+            transport=transport,
+            stage_dir=stage_dir,
+        )
     else:
-        # This branch theoretically won't run because choices=[3, 4] with required=True
+        # This branch theoretically won't run because choices=[1, 2, 3, 4] with required=True
         if RANK == 0:
             print(f"Error: Invalid version '{selected_version}' selected.")
             import sys
@@ -396,9 +1450,23 @@ def start_main():
     time.sleep(0.1)
     COMM.Barrier()  # Ensure all MPI tasks complete
 
-    if RANK == 0:
+    if profile is not None:
+        gather_and_write_profiles(profile, f"v{selected_version}")
+    if transport is not None:
+        report_transport(transport)
+    if selected_version not in [1, 2]:
+        # v1 and v2 aggregate hours straight from the records, without the record extractor
+        report_extract_failures(RECORD_EXTRACTOR)
+
+    if RANK == 0 and selected_version in [1, 2]:
+        # v1 and v2 only write gathered_v{1,2}.ndjson, there is no id_score to sort
+        print(f"Rank=0: MPI processing (v{selected_version}) finished.")
+    elif RANK == 0 and args.sample is not None:
+        # The estimates were already ranked with their intervals by write_sample_intervals()
+        print(f"Rank=0: MPI processing (v{selected_version} sample) finished.")
+    elif RANK == 0:
         print(f"Rank=0: MPI processing (v{selected_version}) finished. Starting result sorting...")
-        high_level_api_sort_result()
+        high_level_api_sort_result(sort_id_score=args.approx is None and not args.late_names)
         print("Rank=0: Main script execution finished.")
 
 
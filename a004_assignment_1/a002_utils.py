@@ -2,13 +2,24 @@ import copy
 import functools
 import json
 import pprint
+import re
 import traceback
-from datetime import datetime
+from array import array
+from datetime import date, datetime
 from math import ceil
 from pathlib import Path
 
 from mpi4py import MPI
 
+from a004_assignment_1.a000_CFG import COMM, PIECE_FORMAT_VERSION, RANK, SIZE, SPILL_DATA_FOLDER
+
+from a004_assignment_1.a005_sketch import user_sketches_init, user_sketches_update
+from a004_assignment_1.a007_time_cube import time_cube_init, time_cube_update
+from a004_assignment_1.a010_pushdown import line_passes_filter, record_passes_filter
+from a004_assignment_1.a011_spill import user_spill_init, user_spill_update
+from a004_assignment_1.a014_aggregators import aggregators_init, aggregators_update
+from a004_assignment_1.a025_extract import EXTRACT_OK, describe_extract_error, extractor_init
+
 
 def load_ndjson_file_multi_lines_to_list(
         ndjson_path_for_loading: str | Path,
@@ -23,12 +34,14 @@ def load_ndjson_file_multi_lines_to_list(
         Returns:
             list: A list of records read from the file.
     """
-    records: list = []
+    return list(iter_ndjson_file_multi_lines(ndjson_path_for_loading, use_filter=use_filter))
+
+
+def iter_ndjson_file_multi_lines(ndjson_path_for_loading, use_filter=False):
+    """Yields the records of an NDJSON file one by one, the lazy form of load_ndjson_file_multi_lines_to_list()."""
     with open(ndjson_path_for_loading, "r", encoding="utf-8") as f:
         for line in f:
-            record = parse_one_line(line, use_filter=use_filter)
-            records.append(record)
-    return records
+            yield parse_one_line(line, use_filter=use_filter)
 
 
 def parse_one_line(line, use_filter):
@@ -61,6 +74,7 @@ def filter_a_record(record: dict):
     account = doc.get("account", {})
     return {
         "doc": {
+            "id": doc.get("id"),  # Post id, see a017_dedup
             "createdAt": doc.get("createdAt"),
             "sentiment": doc.get("sentiment"),
             "account": {
@@ -68,7 +82,7 @@ def filter_a_record(record: dict):
                 for key in (
                     "id",
                     "username",
-                    # "acct",
+                    "acct",  # Instance domain, see a014_aggregators
                     # "uri",
                     # "url",
                     # "displayName",
@@ -131,6 +145,41 @@ def high_level_api_to_convert_raw_time_to_preferred_str(t):
     )
 
 
+# Timestamps whose date and hour can be cut out as they are: every form here parses with
+# datetime.fromisoformat() once a valid date is checked, and the hour string keeps the
+# timestamp's own date and hour whatever its UTC offset
+CANONICAL_TIME_PATTERN = re.compile(
+    r"(\d{4}-\d{2}-\d{2})T([01]\d|2[0-3]):[0-5]\d(?::[0-5]\d(?:\.(?:\d{6}|\d{3}))?)?"
+    r"(?:Z|[+-](?:[01]\d|2[0-3]):[0-5]\d)?"
+)
+# Whether each 'YYYY-MM-DD' seen by raw_time_to_hour_str() is a valid date
+_VALID_DAYS = {}
+
+
+def raw_time_to_hour_str(t):
+    """Returns the same as high_level_api_to_convert_raw_time_to_preferred_str(), faster.
+
+    Canonical timestamps, e.g. '2024-03-19T02:16:00.000Z', are sliced instead of going through
+    datetime; the date check is cached per day. Anything else, or an invalid date, takes the
+    datetime path and raises as it does.
+    """
+    match = CANONICAL_TIME_PATTERN.fullmatch(t) if type(t) is str else None
+    if match is None:
+        return high_level_api_to_convert_raw_time_to_preferred_str(t)
+    day = match.group(1)
+    valid = _VALID_DAYS.get(day)
+    if valid is None:
+        try:
+            date.fromisoformat(day)
+            valid = True
+        except ValueError:
+            valid = False
+        _VALID_DAYS[day] = valid
+    if not valid:
+        return high_level_api_to_convert_raw_time_to_preferred_str(t)
+    return f"{day} {match.group(2)}:00"
+
+
 def raw_time_to_py_datetime(t):
     """Converts an ISO format time string to a Python datetime object.
 
@@ -171,17 +220,20 @@ def iso_format_time_to_str(t):
     return t.strftime("%Y-%m-%d %H:%M")
 
 
-def aggregate_score_by_hour(records: list) -> dict:
+def aggregate_score_by_hour(records, time_s_score: dict | None = None) -> dict:
     """Aggregates sentiment scores by the hour.
 
     Args:
-        records (list): A list of records containing time and sentiment scores.
+        records (iterable): Records containing time and sentiment scores, a list or a generator
+            consumed one record at a time.
+        time_s_score (dict | None): Running totals to add to in place, e.g. over several chunks.
 
     Returns:
         dict: A dictionary where keys are hours (string format 'YYYY-MM-DD HH:00')
               and values are the total sentiment scores for that hour.
     """
-    time_s_score: dict = {}
+    if time_s_score is None:
+        time_s_score = {}
     for record in records:
         # Extract and format the creation time to the nearest hour
         created_hour: str = high_level_api_to_convert_raw_time_to_preferred_str(
@@ -272,13 +324,23 @@ def load_ndjson_file_by_process(
         use_filter=False,
 ):
     """Loads a specific chunk of an NDJSON file based on process rank."""
+    return list(iter_ndjson_file_by_process(ndjson_path_for_loading, ndjson_line_num, process_num, r, use_filter))
+
+
+def iter_ndjson_file_by_process(
+        ndjson_path_for_loading,
+        ndjson_line_num,
+        process_num,
+        r,
+        use_filter=False,
+):
+    """Yields the records of this process's chunk one by one, the lazy form of load_ndjson_file_by_process()."""
     num_line_per_process = ceil(ndjson_line_num / process_num)
     # Calculate the line range [start, end) for this process (1-based indexing for lines)
     start_line = r * num_line_per_process + 1
     # The end line index is exclusive
     end_line = min(start_line + num_line_per_process, ndjson_line_num + 1)
 
-    records = []
     with open(ndjson_path_for_loading, "r", encoding="utf-8") as f0:
         # Skip lines before the start line
         for _ in range(start_line - 1):
@@ -290,13 +352,11 @@ def load_ndjson_file_by_process(
         for _ in range(start_line, end_line):
             try:
                 line = next(f0)
-                record: dict = parse_one_line(line, use_filter=use_filter)
-                if record is not None:  # Check if parsing was successful
-                    records.append(record)
             except StopIteration:  # Reached end of file prematurely
                 break
-
-    return records
+            record: dict = parse_one_line(line, use_filter=use_filter)
+            if record is not None:  # Check if parsing was successful
+                yield record
 
 
 def mpi_v3_subprocess(
@@ -304,7 +364,7 @@ def mpi_v3_subprocess(
         ndjson_line_num,
         process_num,
         r,  # Assuming 'r' is the rank of the current process (0-based)
-        use_filter=False,
+        aggregation=None,
 ):
     """
     Processes a chunk of an NDJSON file (assigned by rank) to aggregate scores
@@ -315,7 +375,8 @@ def mpi_v3_subprocess(
         ndjson_line_num (int): Total number of lines in the file.
         process_num (int): Total number of MPI processes.
         r (int): Rank of the current process.
-        use_filter (bool): Whether to apply filtering during line parsing.
+        aggregation (dict | None): aggregation_init() state: parsing filters, the kind of id_score
+            kept, and the time cube and metrics filled in place. None aggregates plainly.
 
     Returns:
         Tuple[dict, dict, list]:
@@ -323,6 +384,8 @@ def mpi_v3_subprocess(
               { 'YYYY-MM-DD HH:00': float_total_score, ... }
             - id_score (dict): Aggregated scores per user ID.
               { 'user_id_str': [float_total_score, str_username], ... }
+              With aggregation["approx_capacity"], the state from user_sketches_init() instead,
+              and with aggregation["memory_budget"], the state from user_spill_init().
             - failed_records (list): List of records that failed processing.
               [ record_dict_1, record_dict_2, ... ]
     """
@@ -332,8 +395,10 @@ def mpi_v3_subprocess(
     # The end line index is exclusive
     end_line = min(start_line + num_line_per_process, ndjson_line_num + 1)
 
+    aggregation = aggregation or aggregation_init()
+    line_filter = aggregation["line_filter"]
     hour_score: dict = {}
-    id_score: dict = {}  # <<< Initialize id_score dictionary
+    id_score: dict = init_id_score(aggregation["approx_capacity"], aggregation["memory_budget"])
     failed_records = []
 
     with open(input_ndjson_path, "r", encoding="utf-8") as f0:
@@ -353,36 +418,31 @@ def mpi_v3_subprocess(
         for _ in range(start_line, end_line):
             try:
                 line = next(f0)
-                record = parse_one_line(line, use_filter=use_filter)
+                if line_filter is not None and not line_passes_filter(line_filter, line):
+                    current_line_num += 1
+                    continue
+                record = parse_one_line(line, use_filter=aggregation["use_filter"])
 
                 if record is None:  # Skip if parsing failed (e.g., empty line)
                     # print(f"Rank {r}: Warning - Skipped null record at line approx {current_line_num}")
                     current_line_num += 1
                     continue
+                if line_filter is not None and not record_passes_filter(line_filter, record):
+                    current_line_num += 1
+                    continue
 
                 # --- Direct processing ---
-                # Extract time, score, id, and username
-                # Note: If any of these retrievals fail, the Exception block handles it.
-                created_hour, sentiment_score = retrieve_time_and_score_from_a_record(
-                    record=record,
-                )
-                id_0, username_0, _ = retrieve_id_name_score_from_a_record(  # We need id and username
-                    record=record,
-                )
+                # Extract time, score, id, and username in one pass
+                code, fields = RECORD_EXTRACTOR["extract"](record)
+                if code != EXTRACT_OK:
+                    print(f"Rank {r}: Error processing line {current_line_num}: "
+                          f"{describe_extract_error(RECORD_EXTRACTOR, code)}")
+                    failed_records.append(record)
+                    current_line_num += 1
+                    continue
 
                 # --- Aggregate scores ---
-                # Aggregate score by hour
-                if created_hour not in hour_score:
-                    hour_score[created_hour] = 0.0
-                hour_score[created_hour] += sentiment_score
-
-                # Aggregate score by user ID <<< Add id_score aggregation logic
-                if id_0 not in id_score:
-                    # Store score and username
-                    id_score[id_0] = [sentiment_score, username_0]
-                else:
-                    # Add to existing score
-                    id_score[id_0][0] += sentiment_score
+                accumulate_scores(hour_score, id_score, *fields, aggregation, record=record)
 
             except StopIteration:  # Reached end of file within the processing loop
                 print(
@@ -403,14 +463,18 @@ def mpi_v3_subprocess(
     return hour_score, id_score, failed_records
 
 
-def mpi_v4_subprocess(file_path, use_filter=False):
+def mpi_v4_subprocess(
+        file_path,
+        aggregation=None,
+):
     """
     Processes a single NDJSON file (presumably a piece from a larger dataset)
     to aggregate scores by hour and by user ID.
 
     Args:
         file_path (str | Path): Path to the NDJSON file piece.
-        use_filter (bool): Whether to apply filtering during line parsing.
+        aggregation (dict | None): aggregation_init() state: parsing filters, the kind of id_score
+            kept, and the time cube and metrics filled in place. None aggregates plainly.
 
     Returns:
         Tuple[dict, dict, list]:
@@ -418,55 +482,416 @@ def mpi_v4_subprocess(file_path, use_filter=False):
               { 'YYYY-MM-DD HH:00': float_total_score, ... }
             - id_score (dict): Aggregated scores per user ID.
               { 'user_id_str': [float_total_score, str_username], ... }
+              With aggregation["approx_capacity"], the state from user_sketches_init() instead,
+              and with aggregation["memory_budget"], the state from user_spill_init().
             - failed_records (list): List of records that failed processing.
               [ record_dict_1, record_dict_2, ... ]
     """
+    aggregation = aggregation or aggregation_init()
+    line_filter = aggregation["line_filter"]
     hour_score = {}
-    id_score = {}
+    id_score = init_id_score(aggregation["approx_capacity"], aggregation["memory_budget"])
     failed_records = []
 
     with open(file_path, "r", encoding="utf-8") as f:
         for idx, line in enumerate(f, start=1):
+            # Skip lines that the raw-byte predicate already rules out
+            if line_filter is not None and not line_passes_filter(line_filter, line):
+                continue
             # Parse a single line
-            record = parse_one_line(line, use_filter=use_filter)
+            record = parse_one_line(line, use_filter=aggregation["use_filter"])
             # If parse_one_line() returns None, likely an empty line or parsing error, skip it.
             if not record:
                 continue
+            if line_filter is not None and not record_passes_filter(line_filter, record):
+                continue
 
-            # Try to extract required fields
-            try:
-                created_hour, sentiment_score = retrieve_time_and_score_from_a_record(
-                    record=record,
-                )
-                # Assuming retrieve_id_name_score_from_a_record also exists and works similarly
-                id_0, username_0, _ = retrieve_id_name_score_from_a_record(  # We only need id and username here
-                    record=record,
-                )
-            except Exception as e:
-                # If the record is missing key fields or another error occurs, add it to the failed list.
-                print(f"[{file_path}] Error processing line {idx}: {e}")
-                traceback.print_exc()
+            # Extract the required fields
+            code, fields = RECORD_EXTRACTOR["extract"](record)
+            if code != EXTRACT_OK:
+                # If the record is missing key fields or one cannot be converted, add it to the failed list.
+                print(f"[{file_path}] Error processing line {idx}: {describe_extract_error(RECORD_EXTRACTOR, code)}")
                 pprint.pprint(record)
                 failed_records.append(record)
                 continue  # Skip to the next line
-            else:
-                # Aggregate score by hour
-                if created_hour not in hour_score:
-                    hour_score[created_hour] = sentiment_score
-                else:
-                    hour_score[created_hour] += sentiment_score
+            accumulate_scores(hour_score, id_score, *fields, aggregation, record=record)
 
-                # Aggregate score by user ID, storing the username as well
-                if id_0 not in id_score:
-                    # Store score and username (username only needs to be stored once)
-                    id_score[id_0] = [sentiment_score, username_0]
-                else:
-                    # Add to existing score
-                    id_score[id_0][0] += sentiment_score
+    return hour_score, id_score, failed_records
+
+
+def root_scatter_subprocess(
+        file_path,
+        block_bytes,
+        aggregation=None,
+):
+    """Aggregates the blocks rank 0 reads and scatters (iter_root_scattered_blocks()). Collective.
+
+    Args:
+        file_path (str | Path): The NDJSON file, read by rank 0 only.
+        block_bytes (int): Bytes per rank and round.
+        Other arguments: See mpi_v4_subprocess().
 
+    Returns:
+        Tuple[dict, dict, list]: hour_score, id_score and failed_records, as returned by
+        mpi_v4_subprocess().
+    """
+    aggregation = aggregation or aggregation_init()
+    hour_score = {}
+    id_score = init_id_score(aggregation["approx_capacity"], aggregation["memory_budget"])
+    failed_records = []
+    received_bytes, rounds = 0, 0
+    for block_offset, block in iter_root_scattered_blocks(file_path, block_bytes):
+        aggregate_lines(
+            file_path, block_offset, iter_lines_in_block(block, block_offset),
+            hour_score, id_score, failed_records, aggregation,
+        )
+        received_bytes += len(block)
+        rounds += 1
+    print(f"Rank={RANK}: Aggregated {received_bytes} scattered bytes from {rounds} round(s)")
     return hour_score, id_score, failed_records
 
 
+def aggregation_init(
+        use_filter=False,
+        approx_capacity=None,
+        cube_bucket_num=None,
+        line_filter=None,
+        memory_budget=None,
+        metrics=None,
+):
+    """Creates the aggregation options and states one rank hands to whichever read backend it runs.
+
+    The time cube and the metric states are created once here and filled in place by every
+    accumulate_scores() call, so backends only pass this one object along.
+
+    Args:
+        use_filter (bool): Whether to apply filtering during line parsing.
+        approx_capacity (int | None): If set, keep bounded-memory user sketches of this
+            capacity (see a005_sketch) instead of an exact id_score.
+        cube_bucket_num (int | None): If set, also fill a time cube with this many user buckets
+            (see a007_time_cube).
+        line_filter (dict | None): Optional build_line_filter() state. Lines failing its raw check
+            are skipped before parsing (see a010_pushdown).
+        memory_budget (int | None): If set, keep the exact id_score within this many bytes by
+            spilling sorted runs to disk (see a011_spill).
+        metrics (list[str] | None): Registered aggregators fed every aggregated record (see a014_aggregators).
+
+    Returns:
+        dict: { "use_filter": bool, "approx_capacity": int | None, "memory_budget": int | None,
+        "line_filter": dict | None, "time_cube": dict | None, "aggregators": dict | None }
+    """
+    return {
+        "use_filter": use_filter,
+        "approx_capacity": approx_capacity,
+        "memory_budget": memory_budget,
+        "line_filter": line_filter,
+        "time_cube": time_cube_init(cube_bucket_num) if cube_bucket_num else None,
+        "aggregators": aggregators_init(metrics) if metrics else None,
+    }
+
+
+def init_id_score(approx_capacity=None, memory_budget=None):
+    """Returns an empty id_score: a dict, user sketches (approx_capacity) or a spill state (memory_budget)."""
+    if approx_capacity is not None:
+        return user_sketches_init(approx_capacity)
+    if memory_budget is not None:
+        return user_spill_init(SPILL_DATA_FOLDER, memory_budget)
+    return {}
+
+
+def accumulate_scores(
+        hour_score,
+        id_score,
+        created_hour,
+        sentiment_score,
+        id_0,
+        username_0,
+        aggregation=None,
+        record=None,
+):
+    """Adds the fields retrieved from one record to the running aggregates, in place.
+
+    Args:
+        hour_score (dict): { 'YYYY-MM-DD HH:00': float_total_score, ... }
+        id_score (dict): { 'user_id_str': [float_total_score, str_username], ... },
+            or the state init_id_score() returns for the aggregation.
+        created_hour (str): 'YYYY-MM-DD HH:00' string.
+        sentiment_score (float): The record's sentiment score.
+        id_0 (str): The user ID.
+        username_0 (str): The username.
+        aggregation (dict | None): aggregation_init() state; its time cube and metrics are
+            updated too. None only aggregates hour_score and an exact id_score.
+        record (dict | None): The parsed record the fields came from, for aggregators.
+    """
+    # Aggregate score by hour
+    if created_hour not in hour_score:
+        hour_score[created_hour] = sentiment_score
+    else:
+        hour_score[created_hour] += sentiment_score
+
+    # Aggregate score by user ID, storing the username as well
+    if aggregation is None:
+        approx_capacity, memory_budget, time_cube, aggregators = None, None, None, None
+    else:
+        approx_capacity, memory_budget = aggregation["approx_capacity"], aggregation["memory_budget"]
+        time_cube, aggregators = aggregation["time_cube"], aggregation["aggregators"]
+    if approx_capacity is not None:
+        user_sketches_update(id_score, id_0, username_0, sentiment_score)
+    elif memory_budget is not None:
+        user_spill_update(id_score, id_0, username_0, sentiment_score)
+    elif id_0 not in id_score:
+        # Store score and username (username only needs to be stored once)
+        id_score[id_0] = [sentiment_score, username_0]
+    else:
+        # Add to existing score
+        id_score[id_0][0] += sentiment_score
+
+    if time_cube is not None:
+        time_cube_update(time_cube, created_hour, sentiment_score, id_0)
+
+    if aggregators:
+        aggregators_update(aggregators, record, created_hour, sentiment_score, id_0, username_0)
+
+
+def compute_byte_ranges(file_size, pieces_num):
+    """Splits [0, file_size) into pieces_num contiguous byte ranges of nearly equal size.
+
+    The ranges are not newline-aligned; iter_lines_in_byte_range() resolves the boundaries.
+
+    Args:
+        file_size (int): Size of the file in bytes.
+        pieces_num (int): Number of ranges.
+
+    Returns:
+        list: [(start, end), ...]
+    """
+    return [
+        (file_size * i // pieces_num, file_size * (i + 1) // pieces_num)
+        for i in range(pieces_num)
+    ]
+
+
+def iter_lines_in_byte_range(file_path, start, end):
+    """Yields every line that starts inside the byte range [start, end) of a file.
+
+    A line crossing `end` belongs to this range, and a line crossing `start` belongs to the
+    previous one, so adjacent ranges cover every line exactly once.
+
+    Args:
+        file_path (str | Path): Path to the NDJSON file.
+        start (int): First byte of the range.
+        end (int): One past the last byte of the range.
+
+    Yields:
+        tuple[int, bytes]: The offset just past the line, and the raw line.
+    """
+    with open(file_path, "rb") as f:
+        if start > 0:
+            # Skip the tail of the line owned by the previous range (just b"\n" if aligned)
+            f.seek(start - 1)
+            f.readline()
+        offset = f.tell()
+        while offset < end:
+            line = f.readline()
+            if not line:
+                break
+            offset += len(line)
+            yield offset, line
+
+
+def iter_lines_in_block(block, block_offset):
+    """Yields the lines of a newline-aligned block read from a file at block_offset.
+
+    Yields:
+        tuple[int, bytes]: The file offset just past the line, and the raw line, like
+        iter_lines_in_byte_range().
+    """
+    offset = block_offset
+    for line in bytes(block).splitlines(keepends=True):
+        offset += len(line)
+        yield offset, line
+
+
+def iter_root_scattered_blocks(file_path, block_bytes):
+    """Rank 0 reads a file in rounds and scatters newline-aligned raw blocks; yields this rank's. Collective.
+
+    Each round rank 0 reads about SIZE * block_bytes, cuts them into SIZE newline-aligned blocks,
+    broadcasts the block sizes and scatters the bytes with a buffer-based Scatterv, so memory on
+    rank 0 stays bounded by one round. Every rank must consume the generator to the end.
+
+    Args:
+        file_path (str | Path): The file, read by rank 0 only.
+        block_bytes (int): Bytes per rank and round.
+
+    Yields:
+        tuple[int, bytearray]: The file offset of this rank's block, and the block (possibly empty).
+    """
+    f = open(file_path, "rb") if RANK == 0 else None
+    leftover = b""
+    round_offset = 0  # File offset of the current round's first byte
+    try:
+        while True:
+            # Header: SIZE block sizes, then 1 if this is the last round
+            header = array("q", [0] * (SIZE + 1))
+            data = b""
+            displacements = None
+            if RANK == 0:
+                data, leftover, eof = read_whole_lines(f, SIZE * block_bytes, leftover)
+                counts, displacements = split_newline_aligned(data, SIZE)
+                header = array("q", counts + [int(eof)])
+            COMM.Bcast([header, MPI.INT64_T], root=0)
+            counts = list(header[:SIZE])
+
+            received = bytearray(counts[RANK])
+            if RANK == 0:
+                COMM.Scatterv([data, counts, displacements, MPI.BYTE], [received, MPI.BYTE], root=0)
+            else:
+                COMM.Scatterv(None, [received, MPI.BYTE], root=0)
+            yield round_offset + sum(counts[:RANK]), received
+            round_offset += sum(counts)
+            if header[SIZE]:
+                break
+    finally:
+        if f is not None:
+            f.close()
+
+
+def read_whole_lines(f, size_hint, leftover=b""):
+    """Reads roughly size_hint bytes from a binary file, cut after the last complete line.
+
+    Args:
+        f: A file opened in binary mode.
+        size_hint (int): Number of bytes to read (more if one line is longer than that).
+        leftover (bytes): The incomplete tail returned by the previous call.
+
+    Returns:
+        tuple[bytes, bytes, bool]: The whole lines, the incomplete tail to pass to the next call,
+        and whether the end of the file was reached (the tail is then empty).
+    """
+    data = leftover + f.read(size_hint)
+    while True:
+        cut = data.rfind(b"\n") + 1
+        if cut > 0:
+            break
+        more = f.read(size_hint)
+        if not more:
+            return data, b"", True
+        data += more
+    if cut == len(data):
+        # Peek so that the caller learns about EOF in the same call
+        more = f.read(1)
+        if not more:
+            return data, b"", True
+        return data, more, False
+    return data[:cut], data[cut:], False
+
+
+def split_newline_aligned(data, pieces_num):
+    """Cuts a buffer of whole lines into pieces_num newline-aligned blocks of nearly equal size.
+
+    Args:
+        data (bytes): Whole lines, ending with a newline unless it is the end of the file.
+        pieces_num (int): Number of blocks; blocks may be empty.
+
+    Returns:
+        tuple[list, list]: (counts, displacements) in bytes, as expected by Scatterv.
+    """
+    bounds = [0]
+    for i in range(1, pieces_num):
+        target = max(len(data) * i // pieces_num, bounds[-1])
+        newline = data.find(b"\n", target)
+        bounds.append(len(data) if newline == -1 else newline + 1)
+    bounds.append(len(data))
+    counts = [bounds[i + 1] - bounds[i] for i in range(pieces_num)]
+    return counts, bounds[:-1]
+
+
+def aggregate_byte_range(
+        file_path,
+        start,
+        end,
+        hour_score,
+        id_score,
+        failed_records,
+        aggregation=None,
+        progress_callback=None,
+        progress_every_lines=10000,
+):
+    """Aggregates the lines starting inside [start, end) of a file into existing aggregates.
+
+    Works like mpi_v4_subprocess() on a byte range, updating the given containers in place so
+    that a caller can resume from a committed offset.
+
+    Args:
+        file_path (str | Path): Path to the NDJSON file.
+        start (int): First byte of the range.
+        end (int): One past the last byte of the range.
+        hour_score (dict): Running hour aggregates (see accumulate_scores()).
+        id_score (dict): Running user aggregates (see accumulate_scores()).
+        failed_records (list): Receives records that failed processing.
+        aggregation (dict | None): aggregation_init() state (see mpi_v4_subprocess()).
+        progress_callback (callable | None): Called as progress_callback(offset) every
+            progress_every_lines lines, where offset is the first byte not yet aggregated.
+        progress_every_lines (int): Lines between progress callbacks.
+
+    Returns:
+        int: The offset just past the last line aggregated.
+    """
+    return aggregate_lines(
+        file_path, start, iter_lines_in_byte_range(file_path, start, end),
+        hour_score, id_score, failed_records, aggregation,
+        progress_callback=progress_callback,
+        progress_every_lines=progress_every_lines,
+    )
+
+
+def aggregate_lines(
+        file_path,
+        start,
+        lines,
+        hour_score,
+        id_score,
+        failed_records,
+        aggregation=None,
+        progress_callback=None,
+        progress_every_lines=10000,
+):
+    """Aggregates (offset, line) pairs of a file into existing aggregates, see aggregate_byte_range().
+
+    Args:
+        file_path (str | Path): The file the lines come from, for error messages.
+        start (int): Offset of the first line, returned if there are no lines.
+        lines (iterable): (offset just past the line, raw line) pairs, e.g. from
+            iter_lines_in_byte_range() or iter_lines_in_block().
+
+    Returns:
+        int: The offset just past the last line aggregated.
+    """
+    aggregation = aggregation or aggregation_init()
+    line_filter = aggregation["line_filter"]
+    offset = start
+    for idx, (offset, line) in enumerate(lines, start=1):
+        record = None
+        try:
+            if line_filter is None or line_passes_filter(line_filter, line):
+                record = parse_one_line(line, use_filter=aggregation["use_filter"])
+            if record and (line_filter is None or record_passes_filter(line_filter, record)):
+                code, fields = RECORD_EXTRACTOR["extract"](record)
+                if code != EXTRACT_OK:
+                    print(f"[{file_path}] Error processing line ending at byte {offset}: "
+                          f"{describe_extract_error(RECORD_EXTRACTOR, code)}")
+                    failed_records.append(record)
+                else:
+                    accumulate_scores(hour_score, id_score, *fields, aggregation, record=record)
+        except Exception as e:
+            print(f"[{file_path}] Error processing line ending at byte {offset}: {e}")
+            # Keep the raw line if it could not even be parsed
+            failed_records.append(record if record is not None else {"line": line.decode("utf-8", "replace")})
+        if progress_callback is not None and idx % progress_every_lines == 0:
+            progress_callback(offset)
+    return offset
+
+
 def retrieve_time_and_score_from_a_record(record):
     """
     Extracts creation time (formatted to the hour) and sentiment score from a record.
@@ -578,6 +1003,18 @@ def retrieve_id_name_score_from_a_record(record):
     return id_0, username_0, sentiment_0
 
 
+# Fields every read-and-aggregate path takes from a record, in the order accumulate_scores()
+# takes them; the extractor compiled from it replaces the two retrieve_*() helpers above
+RECORD_SCHEMA = (
+    ("created_hour", "doc.createdAt", raw_time_to_hour_str),
+    ("sentiment_score", "doc.sentiment", float),
+    ("id_0", "doc.account.id", str),
+    ("username_0", "doc.account.username", str),
+)
+# This process's extractor; its failure counts add up over all records it aggregates
+RECORD_EXTRACTOR = extractor_init(RECORD_SCHEMA)
+
+
 def measure_time(func):
     """A decorator to measure the execution time of a function using MPI.Wtime()."""
 
@@ -598,7 +1035,8 @@ def split_file(
         total_line_num,
         to_pieces_num,
         output_folder,
-        use_filter=False
+        use_filter=False,
+        line_filter=None,
 ):
     """Splits a large NDJSON file into smaller pieces.
 
@@ -608,12 +1046,20 @@ def split_file(
         to_pieces_num (int): The number of pieces to split the file into.
         output_folder (str | Path): Path to the folder where output pieces will be saved.
         use_filter (bool): Whether to apply filtering while reading lines.
+        line_filter (dict | None): Optional build_line_filter() state; only matching lines are
+            written to the pieces, and the rest are skipped before parsing.
+
+    Once every piece is written, a manifest next to them records PIECE_FORMAT_VERSION, the
+    piece count and the filter spec, for check_split_files_exist() to compare against.
     """
     if not isinstance(file_path, Path):
         file_path = Path(file_path)
     if not isinstance(output_folder, Path):
         output_folder = Path(output_folder)
     output_folder.mkdir(parents=True, exist_ok=True)  # Ensure output directory exists
+    manifest_path = get_split_manifest_path(file_path, output_folder)
+    # Pieces being rewritten are not valid until the new manifest is written
+    manifest_path.unlink(missing_ok=True)
 
     lines_per_file = ceil(total_line_num / to_pieces_num)
     print(
@@ -637,7 +1083,12 @@ def split_file(
                         try:
                             line = next(f0)
                             current_line_global_idx += 1
+                            if line_filter is not None and not line_passes_filter(line_filter, line):
+                                continue
                             record = parse_one_line(line, use_filter=use_filter)
+                            if line_filter is not None and record is not None \
+                                    and not record_passes_filter(line_filter, record):
+                                continue
                             if record is not None:  # Only write if parsing succeeds
                                 write_line = dict_to_a_line(record)
                                 f1.write(write_line)
@@ -650,6 +1101,8 @@ def split_file(
                             # Optionally write the problematic line/record to an error file
                             continue  # Skip this line and continue with the piece
                 print(f"  Finished piece {i}.")
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(make_split_manifest(to_pieces_num, line_filter), f)
         print("File splitting completed.")
     except FileNotFoundError:
         print(f"Error: Input file not found at {file_path}")
@@ -658,17 +1111,42 @@ def split_file(
         traceback.print_exc()
 
 
+def get_split_manifest_path(original_file_path, output_folder):
+    """Returns the path of the manifest split_file() writes next to the pieces of original_file_path."""
+    original_file_path = Path(original_file_path)
+    return Path(output_folder) / f"{original_file_path.stem}_pieces.json"
+
+
+def make_split_manifest(to_pieces_num, line_filter=None):
+    """Returns the manifest describing pieces written with the given count and filter.
+
+    Returns:
+        dict: { "format_version": int, "pieces": int, "line_filter": dict | None }, the filter
+        being the spec of build_line_filter().
+    """
+    return {
+        "format_version": PIECE_FORMAT_VERSION,
+        "pieces": to_pieces_num,
+        "line_filter": line_filter["spec"] if line_filter is not None else None,
+    }
+
+
 def check_split_files_exist(
         original_file_path,
         to_pieces_num,
-        output_folder
+        output_folder,
+        line_filter=None,
 ) -> bool:
-    """Checks if all expected split files generated by split_file exist.
+    """Checks if all expected split files generated by split_file exist and can be reused.
+
+    The pieces are only reusable if their manifest matches make_split_manifest() for the same
+    format version, count and filter. Pieces without a manifest predate it and are treated as missing.
 
     Args:
         original_file_path (str | Path): Path to the *original* input file that was split.
         to_pieces_num (int): The number of pieces the file was supposed to be split into.
         output_folder (str | Path): Path to the folder where output pieces should be located.
+        line_filter (dict | None): The build_line_filter() state the pieces must have been written with.
 
     Returns:
         bool: True if all expected split files exist, False otherwise.
@@ -687,6 +1165,16 @@ def check_split_files_exist(
         # print("Info: Number of pieces is non-positive. Checking for 0 files (always true).")
         return True  # If 0 pieces were expected, then the condition is met.
 
+    manifest_path = get_split_manifest_path(original_file_path, output_folder)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if manifest != make_split_manifest(to_pieces_num, line_filter):
+        print(f"Info: Pieces in '{output_folder}' were written with {manifest}, they have to be split again.")
+        return False
+
     all_exist = True
     for i in range(to_pieces_num):
         # Construct the expected filename based on the logic in split_file
@@ -1,9 +1,14 @@
+import functools
 import heapq
 import os
 import pprint
+import zlib
+from datetime import date
 
-from a004_assignment_1.a000_CFG import TEST_DATA_FOLDER
-from a004_assignment_1.a002_utils import parse_one_line
+from a004_assignment_1.a000_CFG import COMM, SIZE, TEST_DATA_FOLDER, GROUP_TOP_K
+from a004_assignment_1.a002_utils import parse_one_line, write_data_to_ndjson
+from a004_assignment_1.a005_sketch import user_sketches_top_k
+from a004_assignment_1.a014_aggregators import register_aggregator
 
 
 def find_the_top_k_v2(tuple_gnr, top_k, get_max=True):
@@ -100,12 +105,18 @@ def get_value_type(file_name):
         raise NotImplementedError("Cannot infer value type from file name.")
 
 
-def high_level_api_sort_result():
-    """High-level sort runner for top-k on hour/id scores."""
-    merged_hour_score_path = next(filter_file(TEST_DATA_FOLDER.glob("merged_hour_score_v?.ndjson")))
-    merged_id_score_path = next(filter_file(TEST_DATA_FOLDER.glob("merged_id_score_v?.ndjson")))
+def high_level_api_sort_result(sort_id_score=True):
+    """High-level sort runner for top-k on hour/id scores.
 
-    for path in [merged_hour_score_path, merged_id_score_path]:
+    Args:
+        sort_id_score (bool): Also sort the merged id_score file. The --approx mode writes no
+            such file and reports its users through print_and_write_approx_user_top_k() instead.
+    """
+    paths = [next(filter_file(TEST_DATA_FOLDER.glob("merged_hour_score_v?.ndjson")))]
+    if sort_id_score:
+        paths.append(next(filter_file(TEST_DATA_FOLDER.glob("merged_id_score_v?.ndjson"))))
+
+    for path in paths:
         basename = path.stem
         value_type = get_value_type(basename)
         for get_max in [True, False]:
@@ -118,6 +129,183 @@ def high_level_api_sort_result():
             )
 
 
+def print_and_write_approx_user_top_k(user_sketches, target_path, top_k=5):
+    """Prints the approximate happiest and saddest users from merged sketches and saves them.
+
+    Args:
+        user_sketches (dict): Merged state from user_sketches_merge().
+        target_path (str | Path): NDJSON file receiving one
+            { 'user_id_str': [float_estimate, str_username, [float_lower, float_upper]] } per line,
+            happiest users first.
+        top_k (int): Number of users per direction.
+    """
+    records = []
+    for get_max in [True, False]:
+        rst = user_sketches_top_k(user_sketches, top_k=top_k, get_max=get_max)
+        records.extend(rst)
+        print_info = f"Happiest {top_k} " if get_max else f"Saddest {top_k} "
+        print(print_info + "users (approximate, [estimate, username, [lower, upper]]):")
+        pprint.pprint(rst)
+        print()
+    write_data_to_ndjson(
+        records=records,
+        target_path=target_path,
+        if_dict_is_single_dict=None,
+    )
+
+
 def filter_file(lst):
     """Filter out non-file items from a Path list."""
     return filter(lambda x: x.is_file(), lst)
+
+
+def group_top_k_init(top_k):
+    """Returns empty bounded heaps of the top_k largest and smallest scores of every group."""
+    return {"top_k": top_k, "largest": {}, "smallest": {}}
+
+
+def group_top_k_push(state, group, key, score, value):
+    """Offers the final score of a key to its group's heaps, keeping at most top_k entries each.
+
+    Args:
+        state (dict): From group_top_k_init().
+        group: Group of the key, e.g. a day.
+        key: Unique within the group, e.g. a user id; ties on score are broken by key.
+        score (float): The key's complete score within the group.
+        value: Reported for the key, e.g. score or [score, username].
+    """
+    _heap_push_bounded(state["largest"].setdefault(group, []), state["top_k"], (score, key, value))
+    _heap_push_bounded(state["smallest"].setdefault(group, []), state["top_k"], (-score, key, value))
+
+
+def _heap_push_bounded(heap, top_k, entry):
+    # A min-heap of the top_k largest (sort score, key) entries; values are never compared
+    if len(heap) < top_k:
+        heapq.heappush(heap, entry)
+    elif entry[:2] > heap[0][:2]:
+        heapq.heapreplace(heap, entry)
+
+
+def group_top_k_merge(states):
+    """Merges group_top_k_init() states of disjoint keys, keeping top_k entries per group."""
+    merged = group_top_k_init(states[0]["top_k"])
+    for state in states:
+        for direction in ["largest", "smallest"]:
+            for group, heap in state[direction].items():
+                merged_heap = merged[direction].setdefault(group, [])
+                for entry in heap:
+                    _heap_push_bounded(merged_heap, merged["top_k"], entry)
+    return merged
+
+
+def group_top_k_lists(state, group, get_max=True):
+    """Returns a group's top entries as [{key: value}, ...], best first."""
+    heap = state["largest" if get_max else "smallest"].get(group, [])
+    return [{key: value} for _, key, value in sorted(heap, key=lambda entry: entry[:2], reverse=True)]
+
+
+def _group_key_owner(group, key):
+    """Rank owning a (group, key) score; stable across processes, unlike hash()."""
+    return zlib.crc32(f"{group}\x00{key}".encode("utf-8")) % SIZE
+
+
+def _sum_partials(list_of_partials):
+    """Sums { (group, key): score or [score, username] } dicts, keeping the first username."""
+    merged = {}
+    for partials in list_of_partials:
+        for group_key, value in partials.items():
+            if group_key not in merged:
+                merged[group_key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                merged[group_key][0] += value[0]
+            else:
+                merged[group_key] += value
+    return merged
+
+
+def _push_partials(top, partials):
+    for (group, key), value in partials.items():
+        group_top_k_push(top, group, key, value[0] if isinstance(value, list) else value, value)
+
+
+def group_scores_init():
+    """Aggregator state of a group-wise top-k metric: partial (group, key) sums, then heaps."""
+    return {"partial": {}, "top": None}
+
+
+def group_scores_reduce(state):
+    """Turns every rank's partial sums into bounded heaps of complete scores. Collective over COMM.
+
+    A key's score is only complete once all ranks' parts are summed, so the partial sums are
+    first sent to the rank owning each (group, key); every owner then keeps GROUP_TOP_K entries
+    per group and direction, and only those heaps are gathered and merged on rank 0.
+    """
+    outgoing = [{} for _ in range(SIZE)]
+    for (group, key), value in state["partial"].items():
+        outgoing[_group_key_owner(group, key)][(group, key)] = value
+    top = group_top_k_init(GROUP_TOP_K)
+    _push_partials(top, _sum_partials(COMM.alltoall(outgoing)))
+    return {"partial": {}, "top": top}
+
+
+def group_scores_merge(states):
+    """Merges reduced states by their heaps; states of a serial run still hold partial sums."""
+    top = group_top_k_init(GROUP_TOP_K)
+    _push_partials(top, _sum_partials([state["partial"] for state in states]))
+    return group_top_k_merge([top] + [state["top"] for state in states if state["top"] is not None])
+
+
+def group_scores_to_records(top):
+    """One { "group", "happiest", "saddest" } record per group, in group order."""
+    return [
+        {
+            "group": group,
+            "happiest": group_top_k_lists(top, group, get_max=True),
+            "saddest": group_top_k_lists(top, group, get_max=False),
+        }
+        for group in sorted(top["largest"])
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def weekday_of(day):
+    """Weekday name of a 'YYYY-MM-DD' day."""
+    return date.fromisoformat(day).strftime("%A")
+
+
+def _user_day_update(state, record, created_hour, sentiment_score, id_0, username_0):
+    group_key = (created_hour[:10], id_0)
+    entry = state["partial"].get(group_key)
+    if entry is None:
+        state["partial"][group_key] = [sentiment_score, username_0]
+    else:
+        entry[0] += sentiment_score
+
+
+def _hour_weekday_update(state, record, created_hour, sentiment_score, id_0, username_0):
+    group_key = (weekday_of(created_hour[:10]), created_hour)
+    state["partial"][group_key] = state["partial"].get(group_key, 0.0) + sentiment_score
+
+
+def register_group_top_k_aggregators():
+    """Registers the top_users_per_day and top_hours_per_weekday aggregators (see a014_aggregators).
+
+    a014_aggregators cannot import this module, which depends on it through a002_utils, so
+    callers offering --metrics register these explicitly before reading AGGREGATORS.
+    """
+    register_aggregator(
+        "top_users_per_day",
+        init=group_scores_init,
+        update=_user_day_update,
+        merge=group_scores_merge,
+        to_records=group_scores_to_records,
+        reduce=group_scores_reduce,
+    )
+    register_aggregator(
+        "top_hours_per_weekday",
+        init=group_scores_init,
+        update=_hour_weekday_update,
+        merge=group_scores_merge,
+        to_records=group_scores_to_records,
+        reduce=group_scores_reduce,
+    )
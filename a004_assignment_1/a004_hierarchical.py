@@ -0,0 +1,162 @@
+import functools
+import pickle
+
+from mpi4py import MPI
+
+from a004_assignment_1.a000_CFG import COMM
+from a004_assignment_1.a002_utils import join_dict_pieces_hour_score
+from a004_assignment_1.a022_transport import encode_frame, decode_frame
+
+
+def split_comm_by_node(comm=COMM):
+    """Splits a communicator into a node-local communicator and a communicator of node leaders.
+
+    The node leader is the lowest world rank on each node, so world rank 0 is always a leader
+    and always rank 0 of the leader communicator.
+
+    Args:
+        comm (MPI.Comm): The communicator to split. Defaults to COMM_WORLD.
+
+    Returns:
+        tuple[MPI.Comm, MPI.Comm]:
+            - node_comm: Ranks that share memory with this rank.
+            - leader_comm: Node leaders only; MPI.COMM_NULL on non-leader ranks.
+    """
+    world_rank = comm.Get_rank()
+    node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED, key=world_rank)
+    is_leader = node_comm.Get_rank() == 0
+    leader_comm = comm.Split(0 if is_leader else MPI.UNDEFINED, key=world_rank)
+    return node_comm, leader_comm
+
+
+def gather_to_node_leader_via_shared_memory(obj, node_comm):
+    """Collects one object from every rank of a node into the node leader through a shared window.
+
+    Every rank pickles its object and writes the bytes at its own offset of an
+    `MPI.Win.Allocate_shared` buffer owned by the node leader, so nothing crosses the interconnect.
+
+    Args:
+        obj: Any picklable object.
+        node_comm (MPI.Comm): Node-local communicator from split_comm_by_node().
+
+    Returns:
+        tuple[list | None, int]:
+            - The list of objects ordered by node rank on the leader, None elsewhere.
+            - The number of bytes this rank wrote into shared memory.
+    """
+    payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    sizes = node_comm.allgather(len(payload))
+    node_rank = node_comm.Get_rank()
+    offset = sum(sizes[:node_rank])
+
+    win = MPI.Win.Allocate_shared(sum(sizes) if node_rank == 0 else 0, 1, comm=node_comm)
+    buf, _ = win.Shared_query(0)
+    shared = memoryview(buf)
+
+    win.Fence()
+    shared[offset:offset + len(payload)] = payload
+    win.Fence()
+
+    objs = None
+    if node_rank == 0:
+        objs = []
+        start = 0
+        for size in sizes:
+            objs.append(pickle.loads(shared[start:start + size]))
+            start += size
+    win.Fence()
+
+    shared.release()
+    win.Free()
+    return objs, len(payload)
+
+
+def hierarchical_gather(hour_score, id_score, failed_records, comm=COMM, id_score_merger=None, transport=None):
+    """Two-level gather of per-rank results: reduce within each node, then across node leaders.
+
+    Level 1 merges the results of all ranks on a node inside a shared-memory window.
+    Level 2 sends one already merged result per node to rank 0, so inter-node traffic and
+    the number of dicts rank 0 has to merge scale with the node count instead of the rank count.
+
+    Args:
+        hour_score (dict): This rank's { 'YYYY-MM-DD HH:00': float_total_score } dict.
+        id_score (dict): This rank's { 'user_id_str': [float_total_score, str_username] } dict.
+        failed_records (list): This rank's failed records.
+        comm (MPI.Comm): The communicator to gather over. Defaults to COMM_WORLD.
+        id_score_merger (callable | None): Merges a list of id_score objects into one. Defaults to
+            summing exact { 'user_id_str': [score, username] } dicts; pass user_sketches_merge()
+            for the --approx mode.
+        transport (dict | None): transport_init() state; the node results crossing the
+            interconnect are then sent as compressed frames (see a022_transport).
+
+    Returns:
+        tuple[list, list, list] | tuple[None, None, None]:
+            On rank 0, one hour_score dict, one id_score dict and one failed-record list per node,
+            ready for merge_and_write_results(). None on every other rank.
+    """
+    if id_score_merger is None:
+        id_score_merger = functools.partial(join_dict_pieces_hour_score, value_type="list", mode="sum")
+    node_comm, leader_comm = split_comm_by_node(comm)
+
+    # Level 1: intra-node reduction through shared memory
+    node_parts, intra_bytes = gather_to_node_leader_via_shared_memory(
+        (hour_score, id_score, failed_records),
+        node_comm,
+    )
+
+    # Level 2: inter-node gather among node leaders only
+    inter_bytes = 0
+    gathered = None
+    if leader_comm != MPI.COMM_NULL:
+        node_hour_score = join_dict_pieces_hour_score(
+            [part[0] for part in node_parts],
+            value_type="scalar",
+            mode="sum",
+        )
+        node_id_score = id_score_merger([part[1] for part in node_parts])
+        node_failed_records = []
+        for part in node_parts:
+            node_failed_records.extend(part[2])
+
+        node_result = (node_hour_score, node_id_score, node_failed_records)
+        if transport is None:
+            payload = pickle.dumps(node_result, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            payload = encode_frame(node_result, transport)
+        inter_bytes = len(payload) if leader_comm.Get_rank() != 0 else 0
+        gathered = leader_comm.gather(payload, root=0)
+        leader_comm.Free()
+    node_comm.Free()
+
+    all_bytes = comm.gather((intra_bytes, inter_bytes), root=0)
+    if comm.Get_rank() != 0:
+        return None, None, None
+
+    print_bytes_per_level(all_bytes, len(gathered))
+    if transport is None:
+        nodes = [pickle.loads(payload) for payload in gathered]
+    else:
+        nodes = [decode_frame(payload, transport) for payload in gathered]
+    return (
+        [node[0] for node in nodes],
+        [node[1] for node in nodes],
+        [node[2] for node in nodes],
+    )
+
+
+def print_bytes_per_level(all_bytes, node_num):
+    """Prints how many bytes each level of hierarchical_gather() moved, next to a flat gather.
+
+    Args:
+        all_bytes (list): (intra_node_bytes, inter_node_bytes) tuples gathered from every rank.
+        node_num (int): Number of nodes (= number of node leaders).
+    """
+    intra_total = sum(intra for intra, _ in all_bytes)
+    inter_total = sum(inter for _, inter in all_bytes)
+    flat_total = sum(intra for intra, _ in all_bytes[1:])  # A flat gather ships every rank but 0 to rank 0
+    print(f"Rank=0: Hierarchical gather over {len(all_bytes)} ranks on {node_num} node(s)")
+    print(f"  Level 1 (intra-node, shared memory): {intra_total} bytes")
+    print(f"  Level 2 (inter-node, leaders -> rank 0): {inter_total} bytes")
+    for r, (intra, inter) in enumerate(all_bytes):
+        print(f"    rank={r}: intra-node={intra} bytes, inter-node={inter} bytes")
+    print(f"  Flat gather to rank 0 would have sent: {flat_total} bytes")
@@ -0,0 +1,180 @@
+import heapq
+
+
+def space_saving_init(capacity):
+    """Creates an empty SpaceSaving heavy-hitter sketch for non-negative weights.
+
+    The sketch keeps at most 2 * capacity counters. Every counter over-estimates the true
+    weight of its key by at most its recorded error, and any key that is not tracked has a
+    true weight of at most `floor`.
+
+    Args:
+        capacity (int): Number of counters kept after each prune.
+
+    Returns:
+        dict: { "capacity": int, "floor": float, "counters": { key: [count, error, username] } }
+    """
+    return {"capacity": capacity, "floor": 0.0, "counters": {}}
+
+
+def space_saving_update(sketch, key, weight, username):
+    """Adds a non-negative weight for a key to a SpaceSaving sketch in amortised O(1).
+
+    Args:
+        sketch (dict): Sketch from space_saving_init().
+        key (str): The tracked key (user ID).
+        weight (float): Non-negative weight to add.
+        username (str): Payload stored alongside the key for reporting.
+    """
+    counters = sketch["counters"]
+    counter = counters.get(key)
+    if counter is not None:
+        counter[0] += weight
+        return
+    floor = sketch["floor"]
+    counters[key] = [floor + weight, floor, username]
+    if len(counters) > 2 * sketch["capacity"]:
+        space_saving_prune(sketch)
+
+
+def space_saving_prune(sketch):
+    """Keeps the `capacity` largest counters and raises the floor to the largest evicted count.
+
+    Args:
+        sketch (dict): Sketch from space_saving_init(), modified in place.
+    """
+    counters = sketch["counters"]
+    capacity = sketch["capacity"]
+    if len(counters) <= capacity:
+        return
+    ranked = sorted(counters.items(), key=lambda item: item[1][0], reverse=True)
+    sketch["floor"] = max(sketch["floor"], ranked[capacity][1][0])
+    sketch["counters"] = dict(ranked[:capacity])
+
+
+def space_saving_merge(sketches, capacity):
+    """Merges SpaceSaving sketches built on disjoint parts of a stream.
+
+    A key missing from one sketch may still have up to that sketch's floor of weight there,
+    so the floor is added to both its count and its error.
+
+    Args:
+        sketches (list): Sketches from space_saving_init().
+        capacity (int): Capacity of the merged sketch.
+
+    Returns:
+        dict: The merged sketch.
+    """
+    merged = space_saving_init(capacity)
+    merged["floor"] = sum(sketch["floor"] for sketch in sketches)
+    counters = merged["counters"]
+    for i, sketch in enumerate(sketches):
+        for key, (count, error, username) in sketch["counters"].items():
+            if key in counters:
+                continue
+            total_count, total_error = count, error
+            for j, other in enumerate(sketches):
+                if j == i:
+                    continue
+                other_counter = other["counters"].get(key)
+                if other_counter is None:
+                    total_count += other["floor"]
+                    total_error += other["floor"]
+                else:
+                    total_count += other_counter[0]
+                    total_error += other_counter[1]
+            counters[key] = [total_count, total_error, username]
+    space_saving_prune(merged)
+    return merged
+
+
+def space_saving_bounds(sketch, key):
+    """Returns (lower, upper) bounds on the true weight of a key.
+
+    Args:
+        sketch (dict): Sketch from space_saving_init().
+        key (str): The key to look up.
+
+    Returns:
+        tuple[float, float]: Bounds on the true weight.
+    """
+    counter = sketch["counters"].get(key)
+    if counter is None:
+        return 0.0, sketch["floor"]
+    return counter[0] - counter[1], counter[0]
+
+
+def user_sketches_init(capacity):
+    """Creates the bounded-memory replacement for id_score used by the --approx mode.
+
+    Positive and negative sentiment mass are tracked in two separate sketches, because
+    SpaceSaving only supports non-negative weights.
+
+    Args:
+        capacity (int): Capacity of each sketch.
+
+    Returns:
+        dict: { "pos": sketch, "neg": sketch }
+    """
+    return {"pos": space_saving_init(capacity), "neg": space_saving_init(capacity)}
+
+
+def user_sketches_update(user_sketches, id_0, username_0, sentiment_score):
+    """Adds one record's sentiment to the user sketches.
+
+    Args:
+        user_sketches (dict): State from user_sketches_init().
+        id_0 (str): The user ID.
+        username_0 (str): The username.
+        sentiment_score (float): The record's sentiment score.
+    """
+    if sentiment_score > 0:
+        space_saving_update(user_sketches["pos"], id_0, sentiment_score, username_0)
+    elif sentiment_score < 0:
+        space_saving_update(user_sketches["neg"], id_0, -sentiment_score, username_0)
+
+
+def user_sketches_merge(list_of_user_sketches, capacity):
+    """Merges user sketches from several ranks or pieces.
+
+    Args:
+        list_of_user_sketches (list): States from user_sketches_init().
+        capacity (int): Capacity of each merged sketch.
+
+    Returns:
+        dict: The merged { "pos": sketch, "neg": sketch } state.
+    """
+    return {
+        sign: space_saving_merge([sketches[sign] for sketches in list_of_user_sketches], capacity)
+        for sign in ("pos", "neg")
+    }
+
+
+def user_sketches_top_k(user_sketches, top_k, get_max=True):
+    """Finds the approximate happiest or saddest users with bounds on their net score.
+
+    Candidates come from the positive sketch for the happiest users and from the negative
+    sketch for the saddest ones. The net score of a user is positive mass minus negative mass,
+    bounded by combining the bounds of both sketches.
+
+    Args:
+        user_sketches (dict): State from user_sketches_init() or user_sketches_merge().
+        top_k (int): Number of users to return.
+        get_max (bool): True for the happiest users, False for the saddest.
+
+    Returns:
+        list: [ { 'user_id_str': [float_estimate, str_username, [float_lower, float_upper]] }, ... ]
+    """
+    candidates = user_sketches["pos" if get_max else "neg"]["counters"]
+    scored = []
+    for key, (_, _, username) in candidates.items():
+        pos_lower, pos_upper = space_saving_bounds(user_sketches["pos"], key)
+        neg_lower, neg_upper = space_saving_bounds(user_sketches["neg"], key)
+        lower = pos_lower - neg_upper
+        upper = pos_upper - neg_lower
+        scored.append(((lower + upper) / 2, {key: [(lower + upper) / 2, username, [lower, upper]]}))
+    if get_max:
+        top = heapq.nlargest(top_k, scored, key=lambda x: x[0])
+    else:
+        top = heapq.nsmallest(top_k, scored, key=lambda x: x[0])
+    return [item for _, item in top]
@@ -0,0 +1,417 @@
+import argparse
+import json
+import os
+import pickle
+import resource
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+from mpi4py import MPI
+
+from a004_assignment_1.a000_CFG import (
+    COMM,
+    RANK,
+    SIZE,
+    RAW_DATA_FOLDER,
+    NDJSON_FILE_NAME_TO_LOAD,
+    PLANNER_COST_MODEL_PATH,
+    PLANNER_DEFAULT_COST_MODEL,
+    MPIIO_BLOCK_BYTES,
+    NDJSON_TOTAL_LINE_NUM,
+)
+from a004_assignment_1.a002_utils import (
+    aggregate_score_by_hour,
+    load_ndjson_file_by_process,
+    iter_ndjson_file_by_process,
+    load_ndjson_file_multi_lines_to_list,
+    iter_ndjson_file_multi_lines,
+    measure_time,
+    mpi_v4_subprocess,
+    aggregation_init,
+    aggregate_byte_range,
+    iter_lines_in_byte_range,
+    parse_one_line,
+    dict_to_a_line,
+    retrieve_time_and_score_from_a_record,
+    retrieve_id_name_score_from_a_record,
+    RECORD_SCHEMA,
+)
+from a004_assignment_1.a003_top_k import find_the_top_k_v2
+from a004_assignment_1.a005_sketch import user_sketches_top_k
+from a004_assignment_1.a010_pushdown import build_line_filter, format_line_filter_stats
+from a004_assignment_1.a018_planner import detect_topology
+from a004_assignment_1.a019_mpiio import benchmark_read_bandwidth, parse_mpiio_hints
+from a004_assignment_1.a025_extract import EXTRACT_OK, extractor_init, format_extract_failures
+
+
+def benchmark_approx_top_k(file_path, capacities, top_k=5):
+    """Compares the --approx user sketches against the exact id_score on one NDJSON file.
+
+    For every capacity, prints the recall of the exact top-k users, the largest absolute error
+    of the reported estimates, whether every exact score fell inside its reported bounds, and
+    the memory held (counters and pickled bytes) next to the exact dict.
+
+    Args:
+        file_path (str | Path): NDJSON file to benchmark on.
+        capacities (list[int]): Sketch capacities to try.
+        top_k (int): Number of users per direction.
+    """
+    (_, id_score, _), running_info = measure_time(mpi_v4_subprocess)(file_path=file_path)
+    print(f"Exact: {running_info}, {len(id_score)} users, "
+          f"{len(pickle.dumps(id_score))} pickled bytes")
+
+    for capacity in capacities:
+        (_, user_sketches, _), running_info = measure_time(mpi_v4_subprocess)(
+            file_path=file_path,
+            aggregation=aggregation_init(approx_capacity=capacity),
+        )
+        counters = len(user_sketches["pos"]["counters"]) + len(user_sketches["neg"]["counters"])
+        print(f"Approx capacity={capacity}: {running_info}, {counters} counters, "
+              f"{len(pickle.dumps(user_sketches))} pickled bytes")
+
+        for get_max in [True, False]:
+            exact_top = find_the_top_k_v2(
+                ((v[0], k) for k, v in id_score.items()),
+                top_k=top_k,
+                get_max=get_max,
+            )
+            approx_top = user_sketches_top_k(user_sketches, top_k=top_k, get_max=get_max)
+            exact_ids = {k for _, k in exact_top}
+            approx_ids = {list(item)[0] for item in approx_top}
+
+            max_error = 0.0
+            all_within_bounds = True
+            for item in approx_top:
+                key = list(item)[0]
+                estimate, _, (lower, upper) = item[key]
+                max_error = max(max_error, abs(estimate - id_score[key][0]))
+                all_within_bounds &= lower - 1e-9 <= id_score[key][0] <= upper + 1e-9
+
+            direction = "happiest" if get_max else "saddest"
+            print(f"  {direction}: recall@{top_k}={len(exact_ids & approx_ids) / top_k:.2f}, "
+                  f"max abs error={max_error:.5f}, exact within bounds={all_within_bounds}")
+
+
+def benchmark_pushdown(file_path, require_fields, created_from, created_to):
+    """Times mpi_v4_subprocess() on one file with and without the raw-line filter.
+
+    The first run parses every line; the second skips the lines the predicates rule out
+    before parsing them. Skip counts are printed next to the timings.
+
+    Args:
+        file_path (str | Path): NDJSON file to benchmark on.
+        require_fields (list[str]): Fields the doc must have.
+        created_from (str | None): Inclusive createdAt prefix.
+        created_to (str | None): Exclusive createdAt prefix.
+    """
+    line_filter = build_line_filter(require_fields, created_from, created_to)
+    _, running_info = measure_time(mpi_v4_subprocess)(file_path=file_path)
+    print(f"No filter: {running_info}")
+    _, running_info = measure_time(mpi_v4_subprocess)(
+        file_path=file_path,
+        aggregation=aggregation_init(line_filter=line_filter),
+    )
+    print(f"Pushdown filter: {running_info}, {format_line_filter_stats(line_filter)}")
+
+
+def _timed_read(file_path, start, end, chunk_bytes=8 << 20):
+    """Reads [start, end) of a file in chunks and returns the seconds it took."""
+    start_time = MPI.Wtime()
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            data = f.read(min(chunk_bytes, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+    return MPI.Wtime() - start_time
+
+
+def benchmark_calibrate(file_path, sample_bytes, target_path=PLANNER_COST_MODEL_PATH):
+    """Measures the coefficients of the --auto cost model and writes them to target_path. Collective over COMM.
+
+    Run it under mpirun with the rank layout of the real jobs: every rank reads and aggregates
+    up to sample_bytes at the start of its share of the file. With one rank, the scatter and
+    gather coefficients keep their defaults. Reads go through the page cache, so measure on a
+    file larger than the nodes' memory (or drop caches first) to get cold-read bandwidths.
+
+    Args:
+        file_path (str | Path): NDJSON file to calibrate on.
+        sample_bytes (int): Bytes per rank.
+        target_path (str | Path): JSON file read by load_cost_model().
+    """
+    file_size = Path(file_path).stat().st_size
+    topology = detect_topology()
+    cost_model = dict(PLANNER_DEFAULT_COST_MODEL)
+    start = file_size * RANK // SIZE
+    end = min(start + sample_bytes, file_size * (RANK + 1) // SIZE)
+
+    # One reader alone, then all readers at once
+    if RANK == 0:
+        cost_model["read_bytes_per_second"] = (end - start) / _timed_read(file_path, start, end)
+    COMM.Barrier()
+    seconds = COMM.reduce(_timed_read(file_path, start, end), op=MPI.MAX, root=0)
+    read_bytes = COMM.reduce(end - start, op=MPI.SUM, root=0)
+    if RANK == 0:
+        cost_model["node_read_bytes_per_second"] = read_bytes / seconds / topology["nodes"]
+
+    # Parse and aggregate, averaged over ranks
+    hour_score, id_score, failed_records = {}, {}, []
+    start_time = MPI.Wtime()
+    aggregate_byte_range(file_path, start, end, hour_score, id_score, failed_records)
+    seconds_per_byte = COMM.reduce((MPI.Wtime() - start_time) / max(end - start, 1), op=MPI.SUM, root=0)
+    if RANK == 0:
+        cost_model["parse_seconds_per_byte"] = seconds_per_byte / SIZE
+
+    if SIZE > 1:
+        COMM.Barrier()
+        start_time = MPI.Wtime()
+        COMM.gather((hour_score, id_score), root=0)
+        if RANK == 0:
+            cost_model["gather_seconds_per_rank"] = (MPI.Wtime() - start_time) / SIZE
+
+        block_bytes = min(sample_bytes, 16 << 20)
+        received = bytearray(block_bytes)
+        data = bytearray(SIZE * block_bytes) if RANK == 0 else None
+        COMM.Barrier()
+        start_time = MPI.Wtime()
+        COMM.Scatter([data, MPI.BYTE] if RANK == 0 else None, [received, MPI.BYTE], root=0)
+        if RANK == 0:
+            cost_model["scatter_bytes_per_second"] = block_bytes * (SIZE - 1) / (MPI.Wtime() - start_time)
+
+    if RANK != 0:
+        return
+    # Write rank 0's sample as a filtered piece, like split_file(), and aggregate the piece
+    with tempfile.TemporaryDirectory() as folder:
+        piece_path = Path(folder) / "piece.ndjson"
+        start_time = MPI.Wtime()
+        with open(piece_path, "w", encoding="utf-8") as f:
+            for _, line in iter_lines_in_byte_range(file_path, start, end):
+                try:
+                    record = parse_one_line(line, use_filter=True)
+                except ValueError:
+                    continue
+                if record is not None:
+                    f.write(dict_to_a_line(record))
+        cost_model["split_seconds_per_byte"] = (MPI.Wtime() - start_time) / max(end - start, 1)
+        piece_bytes = piece_path.stat().st_size
+        cost_model["piece_bytes_ratio"] = piece_bytes / max(end - start, 1)
+        start_time = MPI.Wtime()
+        aggregate_byte_range(piece_path, 0, piece_bytes, {}, {}, [])
+        cost_model["piece_parse_seconds_per_byte"] = (MPI.Wtime() - start_time) / max(piece_bytes, 1)
+
+    target_path = Path(target_path)
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(target_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "cost_model": cost_model,
+            "calibrated_with": dict(topology, file=str(file_path), sample_bytes=sample_bytes),
+        }, f, indent=2)
+    for name, value in cost_model.items():
+        print(f"{name:>30}: {value:.4g}")
+    print(f"Rank=0: Cost model written to {target_path}")
+
+
+def _run_in_child(func, **kwargs):
+    """Runs func(**kwargs) in a forked child process, which must not use MPI.
+
+    Returns:
+        tuple: The result, the child's peak resident set size in bytes, and its run time in seconds.
+    """
+    read_fd, write_fd = os.pipe()
+    with warnings.catch_warnings():
+        # MPI runs helper threads; the child only reads and parses, without MPI or locks they hold
+        warnings.simplefilter("ignore", DeprecationWarning)
+        pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        start_time = time.perf_counter()
+        result = func(**kwargs)
+        seconds = time.perf_counter() - start_time
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # KiB on Linux
+        with os.fdopen(write_fd, "wb") as f:
+            pickle.dump((result, peak_rss, seconds), f)
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd, "rb") as f:
+        result, peak_rss, seconds = pickle.load(f)
+    os.waitpid(pid, 0)
+    return result, peak_rss, seconds
+
+
+def benchmark_stream_memory(file_path, line_num, process_num):
+    """Compares the peak RSS of the list-based and the streaming read-aggregate of mpi_v1 and mpi_v2.
+
+    Each variant runs one rank's share (rank 0 of process_num for v2, the whole file as rank 0
+    reads it for v1) in a forked child, so every peak is measured from the same starting point.
+    An idle child gives the baseline.
+
+    Args:
+        file_path (str | Path): NDJSON file to benchmark on.
+        line_num (int): Lines in the file, as NDJSON_TOTAL_LINE_NUM.
+        process_num (int): Ranks the v2 chunk is computed for.
+    """
+    chunk = {"ndjson_path_for_loading": file_path, "ndjson_line_num": line_num, "process_num": process_num, "r": 0}
+
+    def v1_list():
+        return aggregate_score_by_hour(load_ndjson_file_multi_lines_to_list(file_path, use_filter=True))
+
+    def v1_stream():
+        return aggregate_score_by_hour(iter_ndjson_file_multi_lines(file_path, use_filter=True))
+
+    def v2_list():
+        return aggregate_score_by_hour(load_ndjson_file_by_process(**chunk, use_filter=True))
+
+    def v2_stream():
+        return aggregate_score_by_hour(iter_ndjson_file_by_process(**chunk, use_filter=True))
+
+    variants = [("v1 list", v1_list), ("v1 stream", v1_stream), ("v2 list", v2_list), ("v2 stream", v2_stream)]
+    _, baseline, _ = _run_in_child(dict)
+    print(f"Baseline peak RSS: {baseline / (1 << 20):.1f} MiB")
+    results = {}
+    for name, func in variants:
+        hour_score, peak_rss, seconds = _run_in_child(func)
+        results[name] = hour_score
+        print(f"{name:>9}: peak RSS {peak_rss / (1 << 20):.1f} MiB (+{(peak_rss - baseline) / (1 << 20):.1f} MiB), "
+              f"{seconds:.3f} s, {len(hour_score)} hours")
+    for version in ["v1", "v2"]:
+        same = results[f"{version} list"] == results[f"{version} stream"]
+        print(f"{version}: streaming result {'identical' if same else 'DIFFERS'}")
+
+
+def benchmark_extract(file_path, record_num, repeats):
+    """Compares the per-record cost of the compiled RECORD_SCHEMA extractor and the retrieve_*() helpers.
+
+    The first record_num lines are parsed once up front, so only field extraction is timed;
+    each variant's best of repeats passes is reported. Both must extract the same fields from
+    the same records.
+
+    Args:
+        file_path (str | Path): NDJSON file to benchmark on.
+        record_num (int): Records to extract from.
+        repeats (int): Timed passes per variant.
+    """
+    records = []
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = parse_one_line(line, use_filter=False)
+            if record:
+                records.append(record)
+            if len(records) == record_num:
+                break
+
+    def helpers():
+        results = []
+        for record in records:
+            try:
+                created_hour, sentiment_score = retrieve_time_and_score_from_a_record(record=record)
+                id_0, username_0, _ = retrieve_id_name_score_from_a_record(record=record)
+                results.append((created_hour, sentiment_score, id_0, username_0))
+            except Exception:
+                results.append(None)
+        return results
+
+    extractor = extractor_init(RECORD_SCHEMA)
+
+    def compiled():
+        extract = extractor["extract"]
+        results = []
+        for record in records:
+            code, fields = extract(record)
+            results.append(fields if code == EXTRACT_OK else None)
+        return results
+
+    outputs = {}
+    for name, func in [("retrieve_*() helpers", helpers), ("compiled extractor", compiled)]:
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            outputs[name] = func()
+            best = min(best, time.perf_counter() - start)
+        print(f"{name:>20}: {best * 1e9 / max(len(records), 1):.0f} ns per record over {len(records)} records")
+    failed = sum(fields is None for fields in outputs["compiled extractor"])
+    same = outputs["retrieve_*() helpers"] == outputs["compiled extractor"]
+    print(f"{failed} failed records, by field over all passes: {format_extract_failures(extractor)}")
+    print(f"Extracted fields {'identical' if same else 'DIFFER'}")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for the MPI processing pipeline."
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    approx_parser = subparsers.add_parser("approx", help="Approximate vs exact top-k users")
+    approx_parser.add_argument(
+        '--file',
+        default=RAW_DATA_FOLDER / NDJSON_FILE_NAME_TO_LOAD,
+        help='NDJSON file to benchmark on'
+    )
+    approx_parser.add_argument(
+        '--capacity',
+        type=int,
+        nargs='+',
+        default=[64, 256, 1024, 4096],
+        help='Sketch capacities to compare'
+    )
+    approx_parser.add_argument('--top-k', type=int, default=5)
+
+    pushdown_parser = subparsers.add_parser("pushdown", help="Raw-line filter vs parsing every line")
+    pushdown_parser.add_argument('--file', default=RAW_DATA_FOLDER / NDJSON_FILE_NAME_TO_LOAD)
+    pushdown_parser.add_argument('--require-field', action='append', default=["sentiment"])
+    pushdown_parser.add_argument('--created-from', default=None)
+    pushdown_parser.add_argument('--created-to', default=None)
+
+    calibrate_parser = subparsers.add_parser(
+        "calibrate", help="Measure the --auto cost model (run under mpirun like the real jobs)"
+    )
+    calibrate_parser.add_argument('--file', default=RAW_DATA_FOLDER / NDJSON_FILE_NAME_TO_LOAD)
+    calibrate_parser.add_argument('--sample-mib', type=float, default=64, help='MiB read per rank')
+    calibrate_parser.add_argument('--output', default=PLANNER_COST_MODEL_PATH)
+
+    mpiio_parser = subparsers.add_parser(
+        "mpiio", help="Aggregate read bandwidth of POSIX vs MPI-IO reads (run under mpirun)"
+    )
+    mpiio_parser.add_argument('--file', default=RAW_DATA_FOLDER / NDJSON_FILE_NAME_TO_LOAD)
+    mpiio_parser.add_argument('--block-mib', type=float, default=MPIIO_BLOCK_BYTES / (1 << 20))
+    mpiio_parser.add_argument('--limit-mib', type=float, default=None, help='Read only the first MiB of the file')
+    mpiio_parser.add_argument('--hint', action='append', default=None, metavar='KEY=VALUE')
+
+    stream_parser = subparsers.add_parser("stream", help="Peak RSS of list-based vs streaming v1/v2 aggregation")
+    stream_parser.add_argument('--file', default=RAW_DATA_FOLDER / NDJSON_FILE_NAME_TO_LOAD)
+    stream_parser.add_argument('--lines', type=int, default=NDJSON_TOTAL_LINE_NUM, help='Lines in the file')
+    stream_parser.add_argument('--processes', type=int, default=1, help='Ranks the v2 chunk is computed for')
+
+    extract_parser = subparsers.add_parser("extract", help="Compiled record extractor vs the retrieve_*() helpers")
+    extract_parser.add_argument('--file', default=RAW_DATA_FOLDER / NDJSON_FILE_NAME_TO_LOAD)
+    extract_parser.add_argument('--records', type=int, default=20000, help='Records to extract from')
+    extract_parser.add_argument('--repeats', type=int, default=5, help='Timed passes per variant')
+    return parser.parse_args()
+
+
+def start_benchmark():
+    args = get_args()
+    if args.benchmark == "approx":
+        benchmark_approx_top_k(args.file, capacities=args.capacity, top_k=args.top_k)
+    elif args.benchmark == "pushdown":
+        benchmark_pushdown(args.file, args.require_field, args.created_from, args.created_to)
+    elif args.benchmark == "calibrate":
+        benchmark_calibrate(args.file, int(args.sample_mib * (1 << 20)), target_path=args.output)
+    elif args.benchmark == "mpiio":
+        benchmark_read_bandwidth(
+            args.file,
+            block_bytes=int(args.block_mib * (1 << 20)),
+            hints=parse_mpiio_hints(args.hint),
+            limit_bytes=int(args.limit_mib * (1 << 20)) if args.limit_mib is not None else None,
+        )
+    elif args.benchmark == "stream":
+        benchmark_stream_memory(args.file, args.lines, args.processes)
+    elif args.benchmark == "extract":
+        benchmark_extract(args.file, args.records, args.repeats)
+
+
+if __name__ == "__main__":
+    start_benchmark()
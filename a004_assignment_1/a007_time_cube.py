@@ -0,0 +1,356 @@
+import argparse
+import bisect
+import functools
+import pprint
+import struct
+import time
+import zlib
+from array import array
+from collections import deque
+from datetime import datetime, timezone
+
+from a004_assignment_1.a000_CFG import TEST_DATA_FOLDER
+
+TIME_CUBE_MAGIC = b"TCUBE001"
+TIME_CUBE_HEADER = struct.Struct("<8sqq")  # magic, cell count, bucket count
+WEEKDAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+@functools.lru_cache(maxsize=65536)
+def hour_str_to_epoch_hour(created_hour):
+    """Converts a 'YYYY-MM-DD HH:00' string (UTC) to hours since the Unix epoch.
+
+    Cached, because a run only ever sees a few thousand distinct hours.
+
+    Args:
+        created_hour (str): Hour string as produced by high_level_api_to_convert_raw_time_to_preferred_str().
+
+    Returns:
+        int: The epoch hour.
+    """
+    t = datetime.strptime(created_hour, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
+    return int(t.timestamp()) // 3600
+
+
+def epoch_hour_to_datetime(epoch_hour):
+    """Converts an epoch hour back to a UTC datetime."""
+    return datetime.fromtimestamp(epoch_hour * 3600, tz=timezone.utc)
+
+
+def epoch_hour_to_hour_str(epoch_hour):
+    """Converts an epoch hour back to the 'YYYY-MM-DD HH:00' string used by hour_score."""
+    return epoch_hour_to_datetime(epoch_hour).strftime("%Y-%m-%d %H:%M")
+
+
+def user_bucket(id_0, bucket_num):
+    """Maps a user ID to a stable bucket in [0, bucket_num), identical on every rank.
+
+    Args:
+        id_0 (str): The user ID.
+        bucket_num (int): Number of user buckets.
+
+    Returns:
+        int: The bucket index.
+    """
+    if bucket_num == 1:
+        return 0
+    return zlib.crc32(id_0.encode("utf-8")) % bucket_num
+
+
+def time_cube_init(bucket_num=1):
+    """Creates an empty time cube.
+
+    Args:
+        bucket_num (int): Number of user buckets; 1 keeps no per-user breakdown.
+
+    Returns:
+        dict: { "bucket_num": int, "cells": { (epoch_hour, bucket): [sum, count, min, max] } }
+    """
+    return {"bucket_num": bucket_num, "cells": {}}
+
+
+def time_cube_update(cube, created_hour, sentiment_score, id_0):
+    """Adds one record to the time cube.
+
+    Args:
+        cube (dict): State from time_cube_init().
+        created_hour (str): 'YYYY-MM-DD HH:00' string.
+        sentiment_score (float): The record's sentiment score.
+        id_0 (str): The user ID, used for the user bucket.
+    """
+    key = (hour_str_to_epoch_hour(created_hour), user_bucket(id_0, cube["bucket_num"]))
+    cell = cube["cells"].get(key)
+    if cell is None:
+        cube["cells"][key] = [sentiment_score, 1, sentiment_score, sentiment_score]
+    else:
+        cell[0] += sentiment_score
+        cell[1] += 1
+        if sentiment_score < cell[2]:
+            cell[2] = sentiment_score
+        if sentiment_score > cell[3]:
+            cell[3] = sentiment_score
+
+
+def time_cube_merge(cubes):
+    """Merges time cubes built on disjoint parts of the data.
+
+    Args:
+        cubes (list): States from time_cube_init() with the same bucket_num.
+
+    Returns:
+        dict: The merged time cube.
+
+    Raises:
+        ValueError: If the cubes use different bucket counts.
+    """
+    bucket_nums = {cube["bucket_num"] for cube in cubes}
+    if len(bucket_nums) > 1:
+        raise ValueError(f"Cannot merge time cubes with different bucket counts: {bucket_nums}")
+    merged = time_cube_init(bucket_nums.pop() if bucket_nums else 1)
+    cells = merged["cells"]
+    for cube in cubes:
+        for key, (s, c, mn, mx) in cube["cells"].items():
+            cell = cells.get(key)
+            if cell is None:
+                cells[key] = [s, c, mn, mx]
+            else:
+                cell[0] += s
+                cell[1] += c
+                cell[2] = min(cell[2], mn)
+                cell[3] = max(cell[3], mx)
+    return merged
+
+
+def write_time_cube(cube, target_path):
+    """Persists a time cube as a compact columnar binary file sorted by (epoch_hour, bucket).
+
+    Layout: header (magic, cell count, bucket count), then the columns epoch_hour (int64),
+    bucket (int64), sum (float64), count (int64), min (float64) and max (float64).
+
+    Args:
+        cube (dict): State from time_cube_init() or time_cube_merge().
+        target_path (str | Path): The target file path.
+    """
+    keys = sorted(cube["cells"])
+    cells = cube["cells"]
+    columns = [
+        array("q", [k[0] for k in keys]),
+        array("q", [k[1] for k in keys]),
+        array("d", [cells[k][0] for k in keys]),
+        array("q", [cells[k][1] for k in keys]),
+        array("d", [cells[k][2] for k in keys]),
+        array("d", [cells[k][3] for k in keys]),
+    ]
+    with open(target_path, "wb") as f:
+        f.write(TIME_CUBE_HEADER.pack(TIME_CUBE_MAGIC, len(keys), cube["bucket_num"]))
+        for column in columns:
+            column.tofile(f)
+
+
+def load_time_cube(cube_path):
+    """Loads a file written by write_time_cube().
+
+    Args:
+        cube_path (str | Path): Path to the cube file.
+
+    Returns:
+        dict: { "bucket_num": int, "hours", "buckets", "sum", "count", "min", "max": array }
+
+    Raises:
+        ValueError: If the file is not a time cube.
+    """
+    with open(cube_path, "rb") as f:
+        magic, cell_num, bucket_num = TIME_CUBE_HEADER.unpack(f.read(TIME_CUBE_HEADER.size))
+        if magic != TIME_CUBE_MAGIC:
+            raise ValueError(f"{cube_path} is not a time cube file")
+        loaded = {"bucket_num": bucket_num}
+        for name, typecode in [("hours", "q"), ("buckets", "q"), ("sum", "d"),
+                               ("count", "q"), ("min", "d"), ("max", "d")]:
+            column = array(typecode)
+            column.fromfile(f, cell_num)
+            loaded[name] = column
+    return loaded
+
+
+def _empty_stats():
+    return {"sum": 0.0, "count": 0, "min": float("inf"), "max": float("-inf")}
+
+
+def _add_cell(stats, cube, i):
+    stats["sum"] += cube["sum"][i]
+    stats["count"] += cube["count"][i]
+    stats["min"] = min(stats["min"], cube["min"][i])
+    stats["max"] = max(stats["max"], cube["max"][i])
+
+
+def _finish_stats(stats):
+    stats["mean"] = stats["sum"] / stats["count"] if stats["count"] else None
+    if not stats["count"]:
+        stats["min"] = stats["max"] = None
+    return stats
+
+
+def query_range(cube, start_hour, end_hour, bucket=None):
+    """Aggregates all cells with start_hour <= hour < end_hour.
+
+    Args:
+        cube (dict): Cube from load_time_cube().
+        start_hour (str): Inclusive 'YYYY-MM-DD HH:00' start.
+        end_hour (str): Exclusive 'YYYY-MM-DD HH:00' end.
+        bucket (int | None): Restrict to one user bucket.
+
+    Returns:
+        dict: { "sum", "count", "min", "max", "mean" }
+    """
+    lo = bisect.bisect_left(cube["hours"], hour_str_to_epoch_hour(start_hour))
+    hi = bisect.bisect_left(cube["hours"], hour_str_to_epoch_hour(end_hour))
+    stats = _empty_stats()
+    for i in range(lo, hi):
+        if bucket is None or cube["buckets"][i] == bucket:
+            _add_cell(stats, cube, i)
+    return _finish_stats(stats)
+
+
+ROLLUP_KEYS = {
+    "hour": epoch_hour_to_hour_str,
+    "day": lambda h: epoch_hour_to_datetime(h).strftime("%Y-%m-%d"),
+    "weekday": lambda h: WEEKDAY_NAMES[epoch_hour_to_datetime(h).weekday()],
+    "hour_of_day": lambda h: epoch_hour_to_datetime(h).strftime("%H:00"),
+    "weekday_hour": lambda h: epoch_hour_to_datetime(h).strftime("%a %H:00"),
+}
+
+
+def query_rollup(cube, by, bucket=None):
+    """Groups all cells by a calendar unit, or by user bucket.
+
+    Args:
+        cube (dict): Cube from load_time_cube().
+        by (str): One of ROLLUP_KEYS ("hour", "day", "weekday", "hour_of_day", "weekday_hour")
+            or "bucket".
+        bucket (int | None): Restrict to one user bucket.
+
+    Returns:
+        dict: { group: { "sum", "count", "min", "max", "mean" } } in group order.
+
+    Raises:
+        NotImplementedError: If `by` is not supported.
+    """
+    if by != "bucket" and by not in ROLLUP_KEYS:
+        raise NotImplementedError(f"Rollup by '{by}' is not supported")
+    group_of_hour = {}
+    groups = {}
+    for i, h in enumerate(cube["hours"]):
+        if bucket is not None and cube["buckets"][i] != bucket:
+            continue
+        if by == "bucket":
+            group = cube["buckets"][i]
+        else:
+            group = group_of_hour.get(h)
+            if group is None:
+                group = group_of_hour[h] = ROLLUP_KEYS[by](h)
+        if group not in groups:
+            groups[group] = _empty_stats()
+        _add_cell(groups[group], cube, i)
+    return {group: _finish_stats(groups[group]) for group in sorted(groups)}
+
+
+def query_rolling(cube, window_hours=24, bucket=None):
+    """Computes trailing windows of window_hours ending at every hour of the cube's time span.
+
+    Sums and counts use prefix sums and min/max use monotonic deques, so the cost is linear
+    in the number of hours whatever the window length.
+
+    Args:
+        cube (dict): Cube from load_time_cube().
+        window_hours (int): Window length in hours.
+        bucket (int | None): Restrict to one user bucket.
+
+    Returns:
+        dict: { 'YYYY-MM-DD HH:00' (last hour of the window): { "sum", "count", "min", "max", "mean" } }
+    """
+    per_hour = {}
+    for i, h in enumerate(cube["hours"]):
+        if bucket is not None and cube["buckets"][i] != bucket:
+            continue
+        if h not in per_hour:
+            per_hour[h] = _empty_stats()
+        _add_cell(per_hour[h], cube, i)
+    if not per_hour:
+        return {}
+
+    first, last = min(per_hour), max(per_hour)
+    result = {}
+    window_sum, window_count = 0.0, 0
+    min_deque, max_deque = deque(), deque()  # (hour, value), kept monotonic
+    for h in range(first, last + 1):
+        stats = per_hour.get(h)
+        if stats is not None:
+            window_sum += stats["sum"]
+            window_count += stats["count"]
+            while min_deque and min_deque[-1][1] >= stats["min"]:
+                min_deque.pop()
+            min_deque.append((h, stats["min"]))
+            while max_deque and max_deque[-1][1] <= stats["max"]:
+                max_deque.pop()
+            max_deque.append((h, stats["max"]))
+        leaving = per_hour.get(h - window_hours)
+        if leaving is not None:
+            window_sum -= leaving["sum"]
+            window_count -= leaving["count"]
+        while min_deque and min_deque[0][0] <= h - window_hours:
+            min_deque.popleft()
+        while max_deque and max_deque[0][0] <= h - window_hours:
+            max_deque.popleft()
+        result[epoch_hour_to_hour_str(h)] = _finish_stats({
+            "sum": window_sum,
+            "count": window_count,
+            "min": min_deque[0][1] if min_deque else float("inf"),
+            "max": max_deque[0][1] if max_deque else float("-inf"),
+        })
+    return result
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Query a time cube written by a run with --time-cube."
+    )
+    parser.add_argument(
+        '--cube',
+        default=None,
+        help='Path to the cube file (default: the first time_cube_v*.bin in the test data folder)'
+    )
+    parser.add_argument('--bucket', type=int, default=None, help='Restrict to one user bucket')
+    subparsers = parser.add_subparsers(dest="query", required=True)
+
+    range_parser = subparsers.add_parser("range", help="Aggregate over [start, end)")
+    range_parser.add_argument('--start', required=True, help="'YYYY-MM-DD HH:00'")
+    range_parser.add_argument('--end', required=True, help="'YYYY-MM-DD HH:00'")
+
+    rollup_parser = subparsers.add_parser("rollup", help="Group by a calendar unit or user bucket")
+    rollup_parser.add_argument('--by', choices=[*ROLLUP_KEYS, "bucket"], default="day")
+
+    rolling_parser = subparsers.add_parser("rolling", help="Trailing windows")
+    rolling_parser.add_argument('--window', type=int, default=24, help='Window length in hours')
+    return parser.parse_args()
+
+
+def start_query():
+    args = get_args()
+    cube_path = args.cube or next(iter(sorted(TEST_DATA_FOLDER.glob("time_cube_v*.bin"))))
+    cube = load_time_cube(cube_path)
+
+    start_time = time.time()
+    if args.query == "range":
+        rst = query_range(cube, args.start, args.end, bucket=args.bucket)
+    elif args.query == "rollup":
+        rst = query_rollup(cube, args.by, bucket=args.bucket)
+    else:
+        rst = query_rolling(cube, window_hours=args.window, bucket=args.bucket)
+    elapsed_ms = (time.time() - start_time) * 1000
+
+    pprint.pprint(rst, sort_dicts=False)
+    print(f"Query '{args.query}' on {cube_path} ({len(cube['hours'])} cells) answered in {elapsed_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    start_query()
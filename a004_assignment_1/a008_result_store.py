@@ -0,0 +1,343 @@
+import argparse
+import bisect
+import contextlib
+import heapq
+import mmap
+import os
+import pprint
+import shutil
+import struct
+import tempfile
+import time
+from array import array
+from pathlib import Path
+
+from a004_assignment_1.a000_CFG import (
+    TEST_DATA_FOLDER, RESULT_STORE_RANK_RUN_USERS, SPILL_RUN_CHUNK_USERS, SPILL_MERGE_FAN_IN,
+)
+from a004_assignment_1.a007_time_cube import hour_str_to_epoch_hour, epoch_hour_to_hour_str
+from a004_assignment_1.a011_spill import iter_spill_run, write_spill_run
+
+RESULT_STORE_MAGIC = b"RSTORE01"
+RESULT_STORE_HEADER = struct.Struct("<8sq")  # magic, section count
+RESULT_STORE_SECTION = struct.Struct("<24sqq")  # name, offset, length in bytes
+RESULT_STORE_SECTIONS = {
+    # name: typecode of the memoryview the section is cast to ("B" = raw bytes)
+    "hour_keys": "q",  # epoch hours, ascending
+    "hour_scores": "d",  # aligned with hour_keys
+    "hour_rank": "q",  # indices into hour_keys, ascending by score
+    "user_key_offsets": "q",  # len(users) + 1 offsets into user_key_blob
+    "user_key_blob": "B",  # UTF-8 user IDs, ascending by bytes
+    "user_scores": "d",  # aligned with user keys
+    "user_name_offsets": "q",  # len(users) + 1 offsets into user_name_blob
+    "user_name_blob": "B",  # UTF-8 usernames, aligned with user keys
+    "user_rank": "q",  # indices into user keys, ascending by score
+}
+
+
+def _flush_columns(files, columns):
+    """Appends the buffered user columns to their files and empties the buffers."""
+    for name, column in columns.items():
+        files[name].write(column if isinstance(column, bytearray) else column.tobytes())
+        del column[:]
+
+
+def _write_user_columns(user_items, files):
+    """Streams users in ascending ID order into the user_* column files, SPILL_RUN_CHUNK_USERS at a time.
+
+    Returns:
+        int: The number of users written.
+    """
+    columns = {
+        "user_key_offsets": array("q", [0]),
+        "user_key_blob": bytearray(),
+        "user_scores": array("d"),
+        "user_name_offsets": array("q", [0]),
+        "user_name_blob": bytearray(),
+    }
+    key_end = name_end = user_num = 0
+    for k, v in user_items:
+        key, name = k.encode("utf-8"), v[1].encode("utf-8")
+        columns["user_scores"].append(v[0])
+        columns["user_key_blob"] += key
+        key_end += len(key)
+        columns["user_key_offsets"].append(key_end)
+        columns["user_name_blob"] += name
+        name_end += len(name)
+        columns["user_name_offsets"].append(name_end)
+        user_num += 1
+        if len(columns["user_scores"]) >= SPILL_RUN_CHUNK_USERS:
+            _flush_columns(files, columns)
+    _flush_columns(files, columns)
+    return user_num
+
+
+def _iter_score_chunks(scores_path, chunk_users):
+    """Yields the score column in arrays of at most chunk_users scores, with the index of each first score."""
+    start = 0
+    with open(scores_path, "rb") as f:
+        while True:
+            chunk = array("d")
+            chunk.frombytes(f.read(chunk_users * chunk.itemsize))
+            if not chunk:
+                return
+            yield start, chunk
+            start += len(chunk)
+
+
+def _write_user_rank(scores_path, rank_file, run_dir):
+    """Writes the indices of the score column in ascending score order, in bounded memory.
+
+    Chunks of RESULT_STORE_RANK_RUN_USERS scores are sorted into (score, index) runs and the
+    runs are k-way merged, at most SPILL_MERGE_FAN_IN at once, as user_spill_iter_sorted() does.
+    Ties keep index order, as a stable sort would.
+    """
+    runs = []
+    for start, chunk in _iter_score_chunks(scores_path, RESULT_STORE_RANK_RUN_USERS):
+        items = sorted(zip(chunk, range(start, start + len(chunk))))
+        if not runs and len(chunk) < RESULT_STORE_RANK_RUN_USERS:
+            # The whole column fitted in one chunk, so no run is needed
+            rank_file.write(array("q", [i for _, i in items]).tobytes())
+            return
+        runs.append(write_spill_run(run_dir, items)[0])
+    while len(runs) > SPILL_MERGE_FAN_IN:
+        runs = [
+            write_spill_run(run_dir, heapq.merge(*(iter_spill_run(path) for path in runs[i:i + SPILL_MERGE_FAN_IN])))[0]
+            for i in range(0, len(runs), SPILL_MERGE_FAN_IN)
+        ]
+    indices = array("q")
+    for _, i in heapq.merge(*(iter_spill_run(path) for path in runs)):
+        indices.append(i)
+        if len(indices) >= SPILL_RUN_CHUNK_USERS:
+            rank_file.write(indices.tobytes())
+            del indices[:]
+    rank_file.write(indices.tobytes())
+
+
+def write_result_store(hour_score, id_score, target_path):
+    """Writes merged results into a memory-mappable binary store with sorted indexes.
+
+    Hours are stored sorted by time and users sorted by ID, so point and range lookups are
+    binary searches, and a rank permutation sorted by score answers top-k for any k.
+
+    Users are streamed into per-section column files in a temporary folder next to target_path,
+    and their rank permutation is built by an external sort of the score column, so an iterable
+    id_score is never held in memory. The sections are then concatenated into the store.
+
+    Args:
+        hour_score (dict): { 'YYYY-MM-DD HH:00': float_total_score }
+        id_score (dict | iterable): { 'user_id_str': [float_total_score, str_username] }, or an
+            iterable of ('user_id_str', [float_total_score, str_username]) pairs already in
+            ascending user ID order, which is consumed in one pass without building a dict.
+        target_path (str | Path): The target file path.
+    """
+    target_path = Path(target_path)
+    hour_items = sorted((hour_str_to_epoch_hour(k), v) for k, v in hour_score.items())
+    hour_scores = array("d", [v for _, v in hour_items])
+    sections = {
+        "hour_keys": array("q", [h for h, _ in hour_items]).tobytes(),
+        "hour_scores": hour_scores.tobytes(),
+        "hour_rank": array("q", sorted(range(len(hour_scores)), key=hour_scores.__getitem__)).tobytes(),
+    }
+    # Code point order of str equals byte order of their UTF-8 encoding
+    user_items = sorted(id_score.items()) if isinstance(id_score, dict) else id_score
+
+    with tempfile.TemporaryDirectory(dir=target_path.parent, prefix=f".{target_path.name}.") as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        user_sections = [name for name in RESULT_STORE_SECTIONS if name.startswith("user_")]
+        for name in user_sections:
+            sections[name] = tmp_dir / f"{name}.bin"
+        with contextlib.ExitStack() as stack:
+            files = {name: stack.enter_context(open(sections[name], "wb")) for name in user_sections}
+            _write_user_columns(user_items, files)
+            files["user_scores"].flush()
+            _write_user_rank(sections["user_scores"], files["user_rank"], tmp_dir)
+
+        # Lay sections out after the header and section table, each aligned to 8 bytes
+        lengths = {
+            name: len(data) if isinstance(data, bytes) else os.path.getsize(data)
+            for name, data in sections.items()
+        }
+        offset = RESULT_STORE_HEADER.size + RESULT_STORE_SECTION.size * len(sections)
+        table = []
+        for name, length in lengths.items():
+            table.append((name, offset, length))
+            offset += length + (-length) % 8
+
+        with open(target_path, "wb") as f:
+            f.write(RESULT_STORE_HEADER.pack(RESULT_STORE_MAGIC, len(sections)))
+            for name, section_offset, length in table:
+                f.write(RESULT_STORE_SECTION.pack(name.encode("ascii"), section_offset, length))
+            for name, data in sections.items():
+                if isinstance(data, bytes):
+                    f.write(data)
+                else:
+                    with open(data, "rb") as section_file:
+                        shutil.copyfileobj(section_file, f)
+                f.write(b"\0" * ((-lengths[name]) % 8))
+
+
+@contextlib.contextmanager
+def open_result_store(store_path):
+    """Memory-maps a store written by write_result_store() without parsing it.
+
+    Args:
+        store_path (str | Path): Path to the store file.
+
+    Yields:
+        dict: { section_name: memoryview cast to the section's type }
+
+    Raises:
+        ValueError: If the file is not a result store.
+    """
+    with open(store_path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    views = {}
+    try:
+        magic, section_num = RESULT_STORE_HEADER.unpack_from(mm, 0)
+        if magic != RESULT_STORE_MAGIC:
+            raise ValueError(f"{store_path} is not a result store file")
+        whole = memoryview(mm)
+        views["_whole"] = whole
+        for i in range(section_num):
+            name, offset, length = RESULT_STORE_SECTION.unpack_from(
+                mm, RESULT_STORE_HEADER.size + i * RESULT_STORE_SECTION.size
+            )
+            name = name.rstrip(b"\0").decode("ascii")
+            views[name] = whole[offset:offset + length].cast(RESULT_STORE_SECTIONS[name])
+        yield views
+    finally:
+        for view in reversed(list(views.values())):
+            view.release()
+        mm.close()
+
+
+def _user_key(store, i):
+    offsets = store["user_key_offsets"]
+    return bytes(store["user_key_blob"][offsets[i]:offsets[i + 1]])
+
+
+def _user_name(store, i):
+    offsets = store["user_name_offsets"]
+    return bytes(store["user_name_blob"][offsets[i]:offsets[i + 1]]).decode("utf-8")
+
+
+def store_user_score(store, id_0):
+    """Looks up one user by binary search over the sorted user IDs.
+
+    Args:
+        store (dict): Views from open_result_store().
+        id_0 (str): The user ID.
+
+    Returns:
+        dict | None: { 'user_id_str': [float_total_score, str_username] }, or None if unknown.
+    """
+    target = id_0.encode("utf-8")
+    lo, hi = 0, len(store["user_scores"])
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _user_key(store, mid) < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    if lo < len(store["user_scores"]) and _user_key(store, lo) == target:
+        return {id_0: [store["user_scores"][lo], _user_name(store, lo)]}
+    return None
+
+
+def store_top_k(store, what, top_k, get_max=True):
+    """Reads the top-k hours or users straight off the score-sorted rank permutation.
+
+    Args:
+        store (dict): Views from open_result_store().
+        what (str): "hours" or "users".
+        top_k (int): Number of results.
+        get_max (bool): True for the happiest, False for the saddest.
+
+    Returns:
+        list: Same shapes as the NDJSON results, i.e. [{ hour: score }] or [{ id: [score, username] }].
+
+    Raises:
+        NotImplementedError: If `what` is neither "hours" nor "users".
+    """
+    if what not in ["hours", "users"]:
+        raise NotImplementedError(f"what must be hours or users, got {what}")
+    rank = store["hour_rank" if what == "hours" else "user_rank"]
+    top_k = min(top_k, len(rank))
+    indices = rank[len(rank) - top_k:][::-1] if get_max else rank[:top_k]
+    if what == "hours":
+        return [
+            {epoch_hour_to_hour_str(store["hour_keys"][i]): store["hour_scores"][i]}
+            for i in indices
+        ]
+    return [
+        {_user_key(store, i).decode("utf-8"): [store["user_scores"][i], _user_name(store, i)]}
+        for i in indices
+    ]
+
+
+def store_hour_range(store, start_hour, end_hour):
+    """Returns the scores of all hours with start_hour <= hour < end_hour.
+
+    Args:
+        store (dict): Views from open_result_store().
+        start_hour (str): Inclusive 'YYYY-MM-DD HH:00' start.
+        end_hour (str): Exclusive 'YYYY-MM-DD HH:00' end.
+
+    Returns:
+        list: [{ 'YYYY-MM-DD HH:00': float_total_score }] in time order.
+    """
+    hour_keys = store["hour_keys"]
+    lo = bisect.bisect_left(hour_keys, hour_str_to_epoch_hour(start_hour))
+    hi = bisect.bisect_left(hour_keys, hour_str_to_epoch_hour(end_hour))
+    return [
+        {epoch_hour_to_hour_str(hour_keys[i]): store["hour_scores"][i]}
+        for i in range(lo, hi)
+    ]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Query the result store written by the merge step."
+    )
+    parser.add_argument(
+        '--store',
+        default=None,
+        help='Path to the store (default: the first result_store_v*.bin in the test data folder)'
+    )
+    subparsers = parser.add_subparsers(dest="query", required=True)
+
+    top_parser = subparsers.add_parser("top", help="Happiest/saddest hours or users")
+    top_parser.add_argument('what', choices=["hours", "users"])
+    top_parser.add_argument('-k', '--top-k', type=int, default=5)
+    top_parser.add_argument('--saddest', action='store_true')
+
+    user_parser = subparsers.add_parser("user", help="Score of one user")
+    user_parser.add_argument('id', help='User ID')
+
+    hours_parser = subparsers.add_parser("hours", help="Scores of an hour range [start, end)")
+    hours_parser.add_argument('--start', required=True, help="'YYYY-MM-DD HH:00'")
+    hours_parser.add_argument('--end', required=True, help="'YYYY-MM-DD HH:00'")
+    return parser.parse_args()
+
+
+def start_query():
+    args = get_args()
+    store_path = args.store or next(iter(sorted(TEST_DATA_FOLDER.glob("result_store_v*.bin"))))
+
+    with open_result_store(store_path) as store:
+        start_time = time.time()
+        if args.query == "top":
+            rst = store_top_k(store, args.what, args.top_k, get_max=not args.saddest)
+        elif args.query == "user":
+            rst = store_user_score(store, args.id)
+        else:
+            rst = store_hour_range(store, args.start, args.end)
+        elapsed_ms = (time.time() - start_time) * 1000
+
+        pprint.pprint(rst)
+        print(f"Query '{args.query}' on {store_path} answered in {elapsed_ms:.3f} ms")
+
+
+if __name__ == "__main__":
+    start_query()
@@ -0,0 +1,228 @@
+import json
+import os
+import pickle
+import shutil
+import time
+from pathlib import Path
+
+from a004_assignment_1.a000_CFG import COMM, RANK, SIZE, CHECKPOINT_INTERVAL_SECONDS, CHECKPOINT_MIN_SPLIT_BYTES
+from a004_assignment_1.a002_utils import aggregate_byte_range, aggregation_init, join_dict_pieces_hour_score
+from a004_assignment_1.a005_sketch import user_sketches_init
+from a004_assignment_1.a007_time_cube import time_cube_init, time_cube_merge
+
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+def atomic_write_bytes(target_path, data):
+    """Writes a file so that readers only ever see the old or the complete new content.
+
+    Args:
+        target_path (Path): The target file path.
+        data (bytes): The new content.
+    """
+    tmp_path = target_path.with_name(f"{target_path.name}.tmp{os.getpid()}")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, target_path)
+
+
+def unit_state_path(checkpoint_dir, unit_id):
+    return Path(checkpoint_dir) / f"unit_{unit_id}.pkl"
+
+
+def commit_unit_state(checkpoint_dir, unit_id, state):
+    """Atomically commits a work unit's offset and partial aggregates.
+
+    The offset is pickled first on its own, so planning can read it without loading the aggregates.
+
+    Args:
+        checkpoint_dir (str | Path): The checkpoint directory.
+        unit_id (int): The work unit ID.
+        state (dict): { "offset", "hour_score", "id_score", "failed_records", "time_cube" }
+    """
+    data = pickle.dumps(state["offset"]) + pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+    atomic_write_bytes(unit_state_path(checkpoint_dir, unit_id), data)
+
+
+def load_unit_offset(checkpoint_dir, unit):
+    """Returns the committed offset of a work unit, or its start if it was never committed."""
+    path = unit_state_path(checkpoint_dir, unit["id"])
+    if not path.is_file():
+        return unit["start"]
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def load_unit_state(checkpoint_dir, unit, approx_capacity=None, cube_bucket_num=None):
+    """Returns the committed state of a work unit, or a fresh state starting at the unit's start."""
+    path = unit_state_path(checkpoint_dir, unit["id"])
+    if path.is_file():
+        with open(path, "rb") as f:
+            pickle.load(f)  # Skip the offset header
+            return pickle.load(f)
+    return {
+        "offset": unit["start"],
+        "hour_score": {},
+        "id_score": {} if approx_capacity is None else user_sketches_init(approx_capacity),
+        "failed_records": [],
+        "time_cube": time_cube_init(cube_bucket_num) if cube_bucket_num else None,
+    }
+
+
+def plan_checkpointed_units(checkpoint_dir, initial_ranges, rank_num, options):
+    """Creates or resumes the checkpoint manifest and assigns work units to ranks (rank 0 only).
+
+    A work unit is a byte range of one file. On resume, units are re-balanced for the current
+    rank count: while there are fewer unfinished units than ranks, the unit with the most bytes
+    left is split in two. Units are then handed out largest-remaining-first to the least loaded rank.
+    Finished units are assigned too, so that their committed aggregates are part of the result.
+
+    Args:
+        checkpoint_dir (str | Path): The checkpoint directory.
+        initial_ranges (list): [(file_path, start, end), ...] for a fresh run.
+        rank_num (int): Number of ranks to assign units to.
+        options (dict): Run options that must match for a checkpoint to be reused.
+
+    Returns:
+        list: One list of unit dicts { "id", "path", "start", "end" } per rank.
+    """
+    checkpoint_dir = Path(checkpoint_dir)
+    manifest_path = checkpoint_dir / MANIFEST_FILE_NAME
+    sources = {str(path): Path(path).stat().st_size for path in {str(p) for p, _, _ in initial_ranges}}
+
+    manifest = None
+    if manifest_path.is_file():
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest["sources"] != sources or manifest["options"] != options:
+            print(f"Rank=0: Checkpoint in {checkpoint_dir} belongs to another input or options, starting over")
+            shutil.rmtree(checkpoint_dir)
+            manifest = None
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+
+    if manifest is None:
+        manifest = {
+            "sources": sources,
+            "options": options,
+            "units": [
+                {"id": i, "path": str(path), "start": start, "end": end}
+                for i, (path, start, end) in enumerate(initial_ranges)
+            ],
+        }
+        remaining = {unit["id"]: unit["end"] - unit["start"] for unit in manifest["units"]}
+    else:
+        remaining = {
+            unit["id"]: max(unit["end"] - load_unit_offset(checkpoint_dir, unit), 0)
+            for unit in manifest["units"]
+        }
+        print(f"Rank=0: Resuming from {checkpoint_dir}, "
+              f"{sum(remaining.values())} of {sum(sources.values())} bytes left")
+
+    # Split the largest unfinished units until every rank can get one
+    units_by_id = {unit["id"]: unit for unit in manifest["units"]}
+    while sum(1 for left in remaining.values() if left > 0) < rank_num:
+        unit_id = max(remaining, key=remaining.get)
+        if remaining[unit_id] < 2 * CHECKPOINT_MIN_SPLIT_BYTES:
+            break
+        unit = units_by_id[unit_id]
+        mid = unit["end"] - remaining[unit_id] // 2
+        new_unit = {"id": max(units_by_id) + 1, "path": unit["path"], "start": mid, "end": unit["end"]}
+        unit["end"] = mid
+        units_by_id[new_unit["id"]] = new_unit
+        manifest["units"].append(new_unit)
+        remaining[new_unit["id"]] = new_unit["end"] - new_unit["start"]
+        remaining[unit_id] -= remaining[new_unit["id"]]
+
+    atomic_write_bytes(manifest_path, json.dumps(manifest, indent=1).encode("utf-8"))
+
+    assignment = [[] for _ in range(rank_num)]
+    load = [0] * rank_num
+    for unit in sorted(manifest["units"], key=lambda u: remaining[u["id"]], reverse=True):
+        r = min(range(rank_num), key=lambda i: (load[i], len(assignment[i])))
+        assignment[r].append(unit)
+        load[r] += remaining[unit["id"]]
+    return assignment
+
+
+def checkpointed_subprocess(
+        checkpoint_dir,
+        initial_ranges,
+        id_score_merger,
+        aggregation=None,
+        interval_seconds=CHECKPOINT_INTERVAL_SECONDS,
+):
+    """Aggregates this rank's share of the work units, committing progress to a checkpoint directory.
+
+    Collective over COMM: rank 0 plans (see plan_checkpointed_units()) and scatters the assignment.
+    Each unit commits its offset and partial aggregates atomically every interval_seconds and when
+    it finishes, so a restarted job, with any rank count, continues from the last commit.
+
+    Args:
+        checkpoint_dir (str | Path): The checkpoint directory, on storage shared by all ranks.
+        initial_ranges (list): [(file_path, start, end), ...] describing the input of a fresh run.
+        id_score_merger (callable): Merges a list of id_score objects into one.
+        aggregation (dict | None): aggregation_init() state without memory_budget or metrics. Every
+            unit keeps its own time cube; they are merged into the aggregation's cube at the end.
+        interval_seconds (float): Minimum time between two commits of a unit.
+
+    Returns:
+        Tuple[dict, dict, list]: This rank's hour_score, id_score and failed_records, merged over its units.
+    """
+    aggregation = aggregation or aggregation_init()
+    approx_capacity, time_cube = aggregation["approx_capacity"], aggregation["time_cube"]
+    cube_bucket_num = time_cube["bucket_num"] if time_cube is not None else None
+    line_filter = aggregation["line_filter"]
+    options = {
+        "use_filter": aggregation["use_filter"],
+        "approx_capacity": approx_capacity,
+        "cube_bucket_num": cube_bucket_num,
+        "line_filter": line_filter["spec"] if line_filter is not None else None,
+    }
+    assignment = None
+    if RANK == 0:
+        assignment = plan_checkpointed_units(checkpoint_dir, initial_ranges, SIZE, options)
+    my_units = COMM.scatter(assignment, root=0)
+
+    states = []
+    for unit in my_units:
+        state = load_unit_state(checkpoint_dir, unit, approx_capacity, cube_bucket_num)
+        if state["offset"] < unit["end"]:
+            last_commit = time.time()
+
+            def commit_if_due(offset):
+                nonlocal last_commit
+                if time.time() - last_commit >= interval_seconds:
+                    state["offset"] = offset
+                    commit_unit_state(checkpoint_dir, unit["id"], state)
+                    last_commit = time.time()
+
+            aggregate_byte_range(
+                unit["path"], state["offset"], unit["end"],
+                state["hour_score"], state["id_score"], state["failed_records"],
+                dict(aggregation, time_cube=state["time_cube"]),
+                progress_callback=commit_if_due,
+            )
+            state["offset"] = unit["end"]
+            commit_unit_state(checkpoint_dir, unit["id"], state)
+        states.append(state)
+    print(f"Rank={RANK}: Finished {len(my_units)} checkpointed work unit(s)")
+
+    hour_score = join_dict_pieces_hour_score(
+        [state["hour_score"] for state in states],
+        value_type="scalar",
+        mode="sum",
+    )
+    id_score = id_score_merger([state["id_score"] for state in states])
+    failed_records = [record for state in states for record in state["failed_records"]]
+    if time_cube is not None:
+        # Merge into the caller's cube, so that a rank without units still holds a valid one
+        time_cube.update(time_cube_merge([time_cube] + [state["time_cube"] for state in states]))
+    return hour_score, id_score, failed_records
+
+
+def clear_checkpoint(checkpoint_dir):
+    """Removes a checkpoint directory once its run has written its final results."""
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    print(f"Rank={RANK}: Checkpoint {checkpoint_dir} cleared")
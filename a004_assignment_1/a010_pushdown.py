@@ -0,0 +1,146 @@
+import re
+from pathlib import Path
+
+CREATED_AT_PATTERN = re.compile(r'"createdAt"\s*:\s*"([^"]*)"')
+CREATED_AT_PATTERN_BYTES = re.compile(rb'"createdAt"\s*:\s*"([^"]*)"')
+ID_PATTERN = re.compile(r'"id"\s*:\s*"?([^",}\s]+)')
+ID_PATTERN_BYTES = re.compile(rb'"id"\s*:\s*"?([^",}\s]+)')
+
+
+def build_line_filter(require_fields=None, created_from=None, created_to=None, account_ids=None):
+    """Builds a predicate that is checked on raw lines before they are parsed.
+
+    The raw check is conservative: a line is only skipped when it certainly fails, e.g. the
+    quoted field name never occurs, no "createdAt" value on the line is inside the window, or no
+    "id" value on the line is in the allow-list. Lines that pass are checked again exactly on the
+    parsed record with record_passes_filter(), so results are the same as filtering after parsing.
+
+    Args:
+        require_fields (list[str] | None): Keys that must be present in record["doc"], e.g. ["sentiment"].
+        created_from (str | None): Inclusive ISO prefix for doc.createdAt, e.g. "2024-03-01".
+        created_to (str | None): Exclusive ISO prefix for doc.createdAt, e.g. "2024-04-01T12".
+        account_ids (list[str] | None): Allow-list of doc.account.id values.
+
+    Returns:
+        dict | None: The filter state, or None if no predicate was given. "spec" holds the
+        JSON-serialisable arguments and "stats" counts lines seen and skipped.
+    """
+    if not (require_fields or created_from or created_to or account_ids):
+        return None
+    require_fields = list(require_fields or [])
+    account_ids = sorted(str(i) for i in account_ids) if account_ids else None
+    return {
+        "spec": {
+            "require_fields": require_fields,
+            "created_from": created_from,
+            "created_to": created_to,
+            "account_ids": account_ids,
+        },
+        "field_tokens": [f'"{field}"' for field in require_fields],
+        "field_tokens_bytes": [f'"{field}"'.encode("utf-8") for field in require_fields],
+        "account_ids": set(account_ids) if account_ids else None,
+        "account_ids_bytes": {i.encode("utf-8") for i in account_ids} if account_ids else None,
+        "stats": {"lines": 0, "skipped_raw": 0, "skipped_parsed": 0},
+    }
+
+
+def created_at_in_window(line_filter, created_at):
+    """Checks an ISO timestamp (str or bytes) against the [created_from, created_to) prefixes."""
+    spec = line_filter["spec"]
+    if isinstance(created_at, bytes):
+        created_at = created_at.decode("ascii", "replace")
+    if spec["created_from"] and created_at[:len(spec["created_from"])] < spec["created_from"]:
+        return False
+    if spec["created_to"] and created_at[:len(spec["created_to"])] >= spec["created_to"]:
+        return False
+    return True
+
+
+def line_passes_filter(line_filter, line):
+    """Cheap check on an unparsed line (str or bytes). False means the line can be skipped.
+
+    Args:
+        line_filter (dict): State from build_line_filter().
+        line (str | bytes): The raw NDJSON line.
+
+    Returns:
+        bool: Whether the line may match and has to be parsed.
+    """
+    stats = line_filter["stats"]
+    stats["lines"] += 1
+    is_bytes = isinstance(line, bytes)
+
+    for token in line_filter["field_tokens_bytes" if is_bytes else "field_tokens"]:
+        if token not in line:
+            stats["skipped_raw"] += 1
+            return False
+
+    spec = line_filter["spec"]
+    if spec["created_from"] or spec["created_to"]:
+        pattern = CREATED_AT_PATTERN_BYTES if is_bytes else CREATED_AT_PATTERN
+        # The account has its own createdAt, so keep the line if any value is inside the window
+        if not any(created_at_in_window(line_filter, m) for m in pattern.findall(line)):
+            stats["skipped_raw"] += 1
+            return False
+
+    allowed = line_filter["account_ids_bytes" if is_bytes else "account_ids"]
+    if allowed is not None:
+        pattern = ID_PATTERN_BYTES if is_bytes else ID_PATTERN
+        if not any(m in allowed for m in pattern.findall(line)):
+            stats["skipped_raw"] += 1
+            return False
+    return True
+
+
+def record_passes_filter(line_filter, record):
+    """Exact check on a parsed record, for lines that passed line_passes_filter().
+
+    Args:
+        line_filter (dict): State from build_line_filter().
+        record (dict): The parsed record.
+
+    Returns:
+        bool: Whether the record matches every predicate.
+    """
+    doc = record.get("doc")
+    passed = isinstance(doc, dict)
+    if passed:
+        spec = line_filter["spec"]
+        passed = all(field in doc for field in spec["require_fields"])
+        if passed and (spec["created_from"] or spec["created_to"]):
+            passed = isinstance(doc.get("createdAt"), str) and created_at_in_window(line_filter, doc["createdAt"])
+        if passed and line_filter["account_ids"] is not None:
+            account = doc.get("account")
+            passed = isinstance(account, dict) and str(account.get("id")) in line_filter["account_ids"]
+    if not passed:
+        line_filter["stats"]["skipped_parsed"] += 1
+    return passed
+
+
+def format_line_filter_stats(line_filter):
+    """Returns a one-line summary of how many lines a filter skipped before and after parsing."""
+    stats = line_filter["stats"]
+    return (
+        f"pushdown checked {stats['lines']} lines, skipped {stats['skipped_raw']} before parsing "
+        f"and {stats['skipped_parsed']} after parsing"
+    )
+
+
+def reset_line_filter_stats(line_filter):
+    """Zeroes the counts of a filter state, e.g. after splitting and before the same rank aggregates with it."""
+    line_filter["stats"] = dict.fromkeys(line_filter["stats"], 0)
+
+
+def load_account_ids(value):
+    """Reads an account allow-list from a comma-separated string or from a file with one ID per line.
+
+    Args:
+        value (str): "id1,id2,..." or a path to a file.
+
+    Returns:
+        list[str]: The account IDs.
+    """
+    if Path(value).is_file():
+        with open(value, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    return [i.strip() for i in value.split(",") if i.strip()]
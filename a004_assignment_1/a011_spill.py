@@ -0,0 +1,213 @@
+import heapq
+import itertools
+import json
+import os
+import pickle
+from pathlib import Path
+
+from a004_assignment_1.a000_CFG import RANK, SPILL_USER_ENTRY_BYTES, SPILL_RUN_CHUNK_USERS, SPILL_MERGE_FAN_IN
+
+_run_counter = itertools.count()
+
+
+def user_spill_init(spill_dir, budget_bytes):
+    """Creates an exact id_score that spills to sorted on-disk runs once it exceeds a memory budget.
+
+    The in-memory table has the usual id_score layout. When its estimated size reaches
+    budget_bytes, it is sorted by user ID, written to spill_dir as a run and cleared. Runs are
+    combined by an external k-way merge at the end (see user_spill_iter_sorted()).
+
+    Args:
+        spill_dir (str | Path): Directory receiving the runs. For multi-rank jobs it must be
+            readable by rank 0, which does the final merge.
+        budget_bytes (int): Memory budget of the in-memory table.
+
+    Returns:
+        dict: { "dir": str, "max_users": int, "table": { 'user_id_str': [float_total_score, str_username] },
+        "runs": [str_path], "stats": { "spills", "spilled_bytes", "spilled_users", "merge_passes" } }
+    """
+    Path(spill_dir).mkdir(parents=True, exist_ok=True)
+    return {
+        "dir": str(spill_dir),
+        "max_users": max(int(budget_bytes // SPILL_USER_ENTRY_BYTES), 1),
+        "table": {},
+        "runs": [],
+        "stats": {"spills": 0, "spilled_bytes": 0, "spilled_users": 0, "merge_passes": 0},
+    }
+
+
+def user_spill_update(state, id_0, username_0, sentiment_score):
+    """Adds one record's score to the table, spilling it first if a new user would exceed the budget.
+
+    Args:
+        state (dict): State from user_spill_init().
+        id_0 (str): The user ID.
+        username_0 (str): The username.
+        sentiment_score (float): The record's sentiment score.
+    """
+    table = state["table"]
+    entry = table.get(id_0)
+    if entry is not None:
+        entry[0] += sentiment_score
+        return
+    if len(table) >= state["max_users"]:
+        user_spill_flush(state)
+        table = state["table"]
+    table[id_0] = [sentiment_score, username_0]
+
+
+def _new_run_path(spill_dir):
+    return Path(spill_dir) / f"run_r{RANK}_p{os.getpid()}_{next(_run_counter)}.pkl"
+
+
+def write_spill_run(spill_dir, sorted_items):
+    """Writes (user_id, score, username) tuples, already sorted by user ID, as one run.
+
+    The run is a sequence of pickled lists of at most SPILL_RUN_CHUNK_USERS tuples, so it can
+    be read back without loading it whole.
+
+    Args:
+        spill_dir (str | Path): Directory receiving the run.
+        sorted_items (iterable): (user_id, score, username) tuples in ascending user ID order.
+
+    Returns:
+        tuple[str, int, int]: The run path, number of users and bytes written.
+    """
+    path = _new_run_path(spill_dir)
+    users = 0
+    with open(path, "wb") as f:
+        chunk = []
+        for item in sorted_items:
+            chunk.append(item)
+            if len(chunk) >= SPILL_RUN_CHUNK_USERS:
+                pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+                users += len(chunk)
+                chunk = []
+        if chunk:
+            pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+            users += len(chunk)
+    return str(path), users, path.stat().st_size
+
+
+def iter_spill_run(path):
+    """Yields the (user_id, score, username) tuples of a run in order."""
+    with open(path, "rb") as f:
+        while True:
+            try:
+                chunk = pickle.load(f)
+            except EOFError:
+                return
+            yield from chunk
+
+
+def user_spill_flush(state):
+    """Sorts the in-memory table, writes it as a run and clears it. Does nothing if it is empty.
+
+    Args:
+        state (dict): State from user_spill_init(), modified in place.
+    """
+    if not state["table"]:
+        return
+    path, users, size = write_spill_run(
+        state["dir"],
+        ((k, v[0], v[1]) for k, v in sorted(state["table"].items())),
+    )
+    state["table"] = {}
+    state["runs"].append(path)
+    stats = state["stats"]
+    stats["spills"] += 1
+    stats["spilled_users"] += users
+    stats["spilled_bytes"] += size
+
+
+def user_spill_merge(states):
+    """Combines spill states from disjoint parts of the data into one, without reading any run.
+
+    Every table is flushed first, so the combined state only lists runs and gathering it is cheap.
+
+    Args:
+        states (list): States from user_spill_init().
+
+    Returns:
+        dict: A state whose runs are all runs of the inputs, in input order.
+    """
+    merged = None
+    for state in states:
+        user_spill_flush(state)
+        if merged is None:
+            merged = {**state, "table": {}, "runs": [], "stats": dict.fromkeys(state["stats"], 0)}
+        merged["runs"].extend(state["runs"])
+        for key, value in state["stats"].items():
+            merged["stats"][key] += value
+    return merged
+
+
+def _merge_runs(paths):
+    """Yields (user_id, score, username) over sorted runs, summing scores of the same user.
+
+    The username of the first run listing a user is kept, as join_dict_pieces_hour_score() does.
+    """
+    merged = heapq.merge(*(iter_spill_run(path) for path in paths), key=lambda item: item[0])
+    for id_0, group in itertools.groupby(merged, key=lambda item: item[0]):
+        _, score, username = next(group)
+        for _, other_score, _ in group:
+            score += other_score
+        yield id_0, score, username
+
+
+def user_spill_iter_sorted(state, fan_in=SPILL_MERGE_FAN_IN):
+    """Yields the exact merged scores of every user in ascending user ID order, in bounded memory.
+
+    While there are more than fan_in runs, groups of fan_in runs are merged into intermediate
+    runs first, so no more than fan_in files are ever open. Runs are deleted once consumed.
+
+    Args:
+        state (dict): State from user_spill_merge() (or user_spill_init()).
+        fan_in (int): Maximum number of runs merged at once.
+
+    Yields:
+        tuple[str, list]: ('user_id_str', [float_total_score, str_username])
+    """
+    user_spill_flush(state)
+    runs = state["runs"]
+    while len(runs) > fan_in:
+        next_runs = []
+        for i in range(0, len(runs), fan_in):
+            group = runs[i:i + fan_in]
+            path, _, _ = write_spill_run(state["dir"], _merge_runs(group))
+            for old in group:
+                os.remove(old)
+            next_runs.append(path)
+        runs = next_runs
+        state["stats"]["merge_passes"] += 1
+    state["runs"] = runs
+    state["stats"]["merge_passes"] += 1
+
+    try:
+        for id_0, score, username in _merge_runs(runs):
+            yield id_0, [score, username]
+    finally:
+        for path in runs:
+            if os.path.exists(path):
+                os.remove(path)
+        state["runs"] = []
+
+
+def iter_and_write_ndjson(items, target_path):
+    """Yields (key, value) pairs unchanged while writing each as a { key: value } NDJSON line.
+
+    Lets one pass over a merged stream both write the NDJSON result and feed another consumer.
+    """
+    with open(target_path, "w", encoding="utf-8") as f:
+        for key, value in items:
+            f.write(json.dumps({key: value}, ensure_ascii=False) + "\n")
+            yield key, value
+
+
+def format_spill_stats(state):
+    """Returns a one-line summary of how much a spill state wrote to disk."""
+    stats = state["stats"]
+    return (
+        f"spilled {stats['spills']} run(s), {stats['spilled_users']} user entries, "
+        f"{stats['spilled_bytes'] / (1 << 20):.2f} MiB, {stats['merge_passes']} merge pass(es)"
+    )
@@ -0,0 +1,124 @@
+import glob
+from pathlib import Path
+
+from a004_assignment_1.a000_CFG import COMM, RANK, SIZE
+from a004_assignment_1.a002_utils import aggregate_byte_range, aggregation_init, init_id_score
+from a004_assignment_1.a024_staging import stage_ranges
+
+
+def resolve_input_paths(spec):
+    """Resolves --input into the NDJSON files of one logical dataset.
+
+    Args:
+        spec (str | Path): A file, a directory (all *.ndjson files in it) or a glob pattern.
+
+    Returns:
+        list[Path]: The files, sorted by path.
+
+    Raises:
+        FileNotFoundError: If nothing matches.
+    """
+    path = Path(spec)
+    if path.is_dir():
+        paths = sorted(path.glob("*.ndjson"))
+    elif path.is_file():
+        paths = [path]
+    else:
+        paths = sorted(Path(p) for p in glob.glob(str(spec)) if Path(p).is_file())
+    if not paths:
+        raise FileNotFoundError(f"No NDJSON input matches {spec}")
+    return paths
+
+
+def assign_byte_ranges_by_size(file_sizes, rank_num):
+    """Cuts the files, taken back to back as one byte stream, into rank_num equal shares.
+
+    Every rank gets the same number of bytes (give or take one), as whole files where the cuts
+    allow and byte ranges of at most two files otherwise, so at most rank_num - 1 files are split.
+
+    Args:
+        file_sizes (list): [(file_path, size_in_bytes), ...]
+        rank_num (int): Number of ranks.
+
+    Returns:
+        list: One list of (file_path, start, end) ranges per rank.
+    """
+    total = sum(size for _, size in file_sizes)
+    assignment = [[] for _ in range(rank_num)]
+    file_start = 0  # Position of the current file in the stream
+    for path, size in file_sizes:
+        file_end = file_start + size
+        for r in range(rank_num):
+            share_start, share_end = total * r // rank_num, total * (r + 1) // rank_num
+            start, end = max(share_start, file_start), min(share_end, file_end)
+            if start < end:
+                assignment[r].append((path, start - file_start, end - file_start))
+        file_start = file_end
+    return assignment
+
+
+def assign_files_by_size(file_sizes, rank_num):
+    """Bin-packs whole files onto ranks, largest first onto the least loaded rank.
+
+    Args:
+        file_sizes (list): [(file_path, size_in_bytes), ...]
+        rank_num (int): Number of ranks.
+
+    Returns:
+        list: One list of (file_path, 0, size) ranges per rank.
+    """
+    assignment = [[] for _ in range(rank_num)]
+    load = [0] * rank_num
+    for path, size in sorted(file_sizes, key=lambda item: item[1], reverse=True):
+        r = min(range(rank_num), key=lambda i: (load[i], len(assignment[i])))
+        assignment[r].append((path, 0, size))
+        load[r] += size
+    return assignment
+
+
+def dataset_subprocess(
+        input_paths,
+        whole_files=False,
+        aggregation=None,
+        stage_dir=None,
+):
+    """Aggregates this rank's share of a multi-file dataset.
+
+    Collective over COMM: rank 0 sizes the files, assigns them with assign_byte_ranges_by_size()
+    (or assign_files_by_size() with whole_files) and scatters the assignment.
+
+    Args:
+        input_paths (list[Path]): Files from resolve_input_paths().
+        whole_files (bool): Never split a file, as v4 treats files as pre-split pieces.
+        aggregation (dict | None): aggregation_init() state, filled in place (see mpi_v4_subprocess()).
+        stage_dir (str | None): With whole_files, first copy each node's files to this node-local
+            folder and read the copies (see a024_staging).
+
+    Returns:
+        Tuple[dict, dict, list]: This rank's hour_score, id_score and failed_records, as returned
+        by mpi_v4_subprocess().
+    """
+    assignment = None
+    if RANK == 0:
+        file_sizes = [(str(path), Path(path).stat().st_size) for path in input_paths]
+        assign = assign_files_by_size if whole_files else assign_byte_ranges_by_size
+        assignment = assign(file_sizes, SIZE)
+        loads = [sum(end - start for _, start, end in ranges) for ranges in assignment]
+        print(f"Rank=0: {len(file_sizes)} input file(s), {sum(loads)} bytes, "
+              f"bytes per rank min={min(loads)} max={max(loads)}")
+    my_ranges = COMM.scatter(assignment, root=0)
+    if stage_dir is not None:
+        my_ranges = stage_ranges(my_ranges, stage_dir)
+
+    hour_score = {}
+    aggregation = aggregation or aggregation_init()
+    id_score = init_id_score(aggregation["approx_capacity"], aggregation["memory_budget"])
+    failed_records = []
+    for path, start, end in my_ranges:
+        aggregate_byte_range(
+            path, start, end,
+            hour_score, id_score, failed_records, aggregation,
+        )
+    print(f"Rank={RANK}: Aggregated {len(my_ranges)} file range(s), "
+          f"{sum(end - start for _, start, end in my_ranges)} bytes")
+    return hour_score, id_score, failed_records
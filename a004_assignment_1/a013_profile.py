@@ -0,0 +1,101 @@
+import contextlib
+import cProfile
+import io
+import marshal
+import pstats
+import time
+import tracemalloc
+
+from mpi4py import MPI
+
+from a004_assignment_1.a000_CFG import COMM, RANK, TEST_DATA_FOLDER
+
+
+def profile_init(trace_memory=False):
+    """Creates this rank's profiling state for --profile.
+
+    Args:
+        trace_memory (bool): Also track the peak of Python allocations with tracemalloc,
+            which slows the profiled code down noticeably.
+
+    Returns:
+        dict: { "profiler": cProfile.Profile, "trace_memory": bool, "peak_bytes": int, "seconds": float }
+    """
+    return {"profiler": cProfile.Profile(), "trace_memory": trace_memory, "peak_bytes": 0, "seconds": 0.0}
+
+
+@contextlib.contextmanager
+def profile_section(profile):
+    """Profiles the enclosed code, adding to what earlier sections recorded. No-op if profile is None.
+
+    Args:
+        profile (dict | None): State from profile_init().
+    """
+    if profile is None:
+        yield
+        return
+    if profile["trace_memory"]:
+        tracemalloc.start()
+    start_time = time.time()
+    profile["profiler"].enable()
+    try:
+        yield
+    finally:
+        profile["profiler"].disable()
+        profile["seconds"] += time.time() - start_time
+        if profile["trace_memory"]:
+            profile["peak_bytes"] = max(profile["peak_bytes"], tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+
+def gather_and_write_profiles(profile, filename_suffix, top_n=20):
+    """Gathers every rank's profile to rank 0 and writes them, merged and per rank. Collective over COMM.
+
+    Rank 0 writes profile_<suffix>_rank<r>.pstats for every rank and profile_<suffix>.pstats with
+    all ranks merged (open them with pstats or snakeviz), then prints the top_n functions of the
+    merged profile by cumulative time and a per-rank table of profiled time and peak memory.
+    Ranks that profiled nothing get no .pstats file and are left out of the merge.
+
+    Args:
+        profile (dict): State from profile_init().
+        filename_suffix (str): Suffix of the output files, e.g. "v3".
+        top_n (int): Number of functions printed.
+    """
+    profile["profiler"].create_stats()
+    all_profiles = COMM.gather(
+        {
+            "rank": RANK,
+            "host": MPI.Get_processor_name(),
+            "stats": marshal.dumps(profile["profiler"].stats) if profile["profiler"].stats else None,
+            "seconds": profile["seconds"],
+            "peak_bytes": profile["peak_bytes"] if profile["trace_memory"] else None,
+        },
+        root=0,
+    )
+    if RANK != 0:
+        return
+
+    TEST_DATA_FOLDER.mkdir(parents=True, exist_ok=True)
+    rank_paths = []
+    for item in all_profiles:
+        if item["stats"] is None:
+            continue
+        path = TEST_DATA_FOLDER / f"profile_{filename_suffix}_rank{item['rank']}.pstats"
+        with open(path, "wb") as f:
+            f.write(item["stats"])
+        rank_paths.append(str(path))
+    if rank_paths:
+        merged_path = TEST_DATA_FOLDER / f"profile_{filename_suffix}.pstats"
+        stream = io.StringIO()
+        merged = pstats.Stats(*rank_paths, stream=stream)
+        merged.dump_stats(merged_path)
+        merged.sort_stats("cumulative").print_stats(top_n)
+        print(f"Rank=0: Merged profile of {len(rank_paths)} rank(s) written to {merged_path}")
+        print(stream.getvalue())
+    else:
+        print("Rank=0: No rank profiled any work, no profile written")
+
+    print(f"{'rank':>4}  {'host':<20} {'profiled s':>10}  {'peak MiB':>9}")
+    for item in all_profiles:
+        peak = "-" if item["peak_bytes"] is None else f"{item['peak_bytes'] / (1 << 20):.2f}"
+        print(f"{item['rank']:>4}  {item['host']:<20} {item['seconds']:>10.3f}  {peak:>9}")
@@ -0,0 +1,194 @@
+from a004_assignment_1.a000_CFG import METRIC_USER_BUCKETS, LOCAL_INSTANCE_DOMAIN, QUANTILE_SKETCH_K, HOUR_QUANTILES
+from a004_assignment_1.a007_time_cube import user_bucket
+from a004_assignment_1.a023_quantile import kll_init, kll_update, kll_merge, kll_quantiles
+
+# name: { "init", "update", "merge", "to_records", "reduce" }, filled by register_aggregator()
+AGGREGATORS = {}
+
+
+def register_aggregator(name, init, update, merge, to_records, reduce=None):
+    """Registers a metric that is computed in the shared read-and-parse pass of v3/v4.
+
+    Args:
+        name (str): Metric name, used on the command line and in the output file name.
+        init (callable): () -> empty state. The state must be picklable to be gathered.
+        update (callable): (state, record, created_hour, sentiment_score, id_0, username_0) -> None,
+            called once per aggregated record with the fields the pipeline already retrieved.
+        merge (callable): list of states from disjoint parts of the data -> merged state.
+        to_records (callable): merged state -> list of dicts written as NDJSON lines.
+        reduce (callable | None): state -> smaller state, called collectively on every rank
+            before the states are gathered (see aggregators_reduce()); merge must accept both.
+    """
+    AGGREGATORS[name] = {
+        "init": init, "update": update, "merge": merge, "to_records": to_records, "reduce": reduce,
+    }
+
+
+def aggregators_init(names):
+    """Returns { name: empty state } for the selected metrics.
+
+    Raises:
+        KeyError: If a name is not registered.
+    """
+    return {name: AGGREGATORS[name]["init"]() for name in names}
+
+
+def aggregators_update(aggregators, record, created_hour, sentiment_score, id_0, username_0):
+    """Feeds one record's retrieved fields to every selected metric, in place."""
+    for name, state in aggregators.items():
+        AGGREGATORS[name]["update"](state, record, created_hour, sentiment_score, id_0, username_0)
+
+
+def aggregators_reduce(aggregators):
+    """Runs the reduce step of every selected metric that has one, in place. Collective over COMM."""
+    for name in sorted(aggregators):
+        reduce = AGGREGATORS[name]["reduce"]
+        if reduce is not None:
+            aggregators[name] = reduce(aggregators[name])
+
+
+def aggregators_merge(list_of_aggregators):
+    """Merges the aggregators_init() states of every part or process, metric by metric."""
+    names = list_of_aggregators[0]
+    return {
+        name: AGGREGATORS[name]["merge"]([aggregators[name] for aggregators in list_of_aggregators])
+        for name in names
+    }
+
+
+def merge_sum(states):
+    """Merges dicts by summing values, which are numbers or equally long lists of numbers."""
+    merged = {}
+    for state in states:
+        for k, v in state.items():
+            if k not in merged:
+                merged[k] = list(v) if isinstance(v, list) else v
+            elif isinstance(v, list):
+                merged[k] = [a + b for a, b in zip(merged[k], v)]
+            else:
+                merged[k] += v
+    return merged
+
+
+def _hour_score_update(state, record, created_hour, sentiment_score, id_0, username_0):
+    state[created_hour] = state.get(created_hour, 0.0) + sentiment_score
+
+
+def _user_score_update(state, record, created_hour, sentiment_score, id_0, username_0):
+    entry = state.get(id_0)
+    if entry is None:
+        state[id_0] = [sentiment_score, username_0]
+    else:
+        entry[0] += sentiment_score
+
+
+def _user_score_merge(states):
+    # Like join_dict_pieces_hour_score(value_type="list"): sum scores, keep the first username
+    merged = {}
+    for state in states:
+        for k, (score, username) in state.items():
+            if k in merged:
+                merged[k][0] += score
+            else:
+                merged[k] = [score, username]
+    return merged
+
+
+def _hour_user_bucket_update(state, record, created_hour, sentiment_score, id_0, username_0):
+    key = (created_hour, user_bucket(id_0, METRIC_USER_BUCKETS))
+    state[key] = state.get(key, 0.0) + sentiment_score
+
+
+def _post_count_hour_update(state, record, created_hour, sentiment_score, id_0, username_0):
+    state[created_hour] = state.get(created_hour, 0) + 1
+
+
+def instance_domain(record):
+    """Returns the instance domain of a record's account from doc.account.acct.
+
+    Local accounts have a bare username as acct and map to LOCAL_INSTANCE_DOMAIN.
+    """
+    acct = record["doc"]["account"].get("acct") or ""
+    _, at, domain = acct.rpartition("@")
+    return domain.lower() if at else LOCAL_INSTANCE_DOMAIN
+
+
+def _instance_domain_update(state, record, created_hour, sentiment_score, id_0, username_0):
+    domain = instance_domain(record)
+    entry = state.get(domain)
+    if entry is None:
+        state[domain] = [1, sentiment_score]
+    else:
+        entry[0] += 1
+        entry[1] += sentiment_score
+
+
+def _hour_quantiles_update(state, record, created_hour, sentiment_score, id_0, username_0):
+    sketch = state.get(created_hour)
+    if sketch is None:
+        sketch = state[created_hour] = kll_init(QUANTILE_SKETCH_K)
+    kll_update(sketch, sentiment_score)
+
+
+def _hour_quantiles_merge(states):
+    hours = {hour for state in states for hour in state}
+    return {hour: kll_merge([state[hour] for state in states if hour in state]) for hour in hours}
+
+
+def _hour_quantiles_to_records(state):
+    records = []
+    for hour, sketch in sorted(state.items()):
+        record = {"hour": hour, "posts": sketch["n"]}
+        for quantile, value in zip(HOUR_QUANTILES, kll_quantiles(sketch, HOUR_QUANTILES)):
+            record[f"p{round(quantile * 100)}"] = value
+        records.append(record)
+    return records
+
+
+register_aggregator(
+    "hour_score",
+    init=dict,
+    update=_hour_score_update,
+    merge=merge_sum,
+    to_records=lambda state: [{k: v} for k, v in sorted(state.items())],
+)
+register_aggregator(
+    "user_score",
+    init=dict,
+    update=_user_score_update,
+    merge=_user_score_merge,
+    to_records=lambda state: [{k: v} for k, v in state.items()],
+)
+register_aggregator(
+    "hour_user_bucket",
+    init=dict,
+    update=_hour_user_bucket_update,
+    merge=merge_sum,
+    to_records=lambda state: [
+        {"hour": hour, "bucket": bucket, "score": v} for (hour, bucket), v in sorted(state.items())
+    ],
+)
+register_aggregator(
+    "post_count_hour",
+    init=dict,
+    update=_post_count_hour_update,
+    merge=merge_sum,
+    to_records=lambda state: [{k: v} for k, v in sorted(state.items())],
+)
+register_aggregator(
+    "hour_quantiles",
+    init=dict,
+    update=_hour_quantiles_update,
+    merge=_hour_quantiles_merge,
+    to_records=_hour_quantiles_to_records,
+)
+register_aggregator(
+    "instance_domain",
+    init=dict,
+    update=_instance_domain_update,
+    merge=merge_sum,
+    to_records=lambda state: [
+        {"domain": domain, "posts": posts, "score": score}
+        for domain, (posts, score) in sorted(state.items(), key=lambda item: item[1][0], reverse=True)
+    ],
+)
@@ -0,0 +1,165 @@
+import math
+import pprint
+import random
+
+from a004_assignment_1.a000_CFG import RANK, TEST_DATA_FOLDER, SAMPLE_BLOCK_BYTES, SAMPLE_CONFIDENCE_Z
+from a004_assignment_1.a002_utils import aggregate_byte_range, write_data_to_ndjson
+from a004_assignment_1.a003_top_k import find_the_top_k_v2
+
+
+def plan_sample_blocks(ranges, fraction, block_bytes, rng):
+    """Cuts a rank's byte ranges into blocks and draws a simple random sample of them.
+
+    Blocks follow the iter_lines_in_byte_range() convention, so every line belongs to exactly
+    one block and the sampled lines are an unbiased sample of the blocks.
+
+    Args:
+        ranges (list): This rank's [(file_path, start, end), ...], i.e. its stratum.
+        fraction (float): Share of blocks to read, in (0, 1]. At least one block is read.
+        block_bytes (int): Block size.
+        rng (random.Random): Random source.
+
+    Returns:
+        tuple[int, list]: The number of blocks in the stratum, and the sampled
+        (file_path, start, end) blocks in file order.
+    """
+    blocks = [
+        (path, block_start, min(block_start + block_bytes, end))
+        for path, start, end in ranges
+        for block_start in range(start, end, block_bytes)
+    ]
+    if not blocks:
+        return 0, []
+    sample_num = min(len(blocks), max(1, round(fraction * len(blocks))))
+    return len(blocks), [blocks[i] for i in sorted(rng.sample(range(len(blocks)), sample_num))]
+
+
+def stratum_total_variance(s1, s2, block_num, sample_num):
+    """Variance of the estimated stratum total N * mean(y) under sampling without replacement.
+
+    Args:
+        s1 (float): Sum of the per-block values over the sampled blocks.
+        s2 (float): Sum of their squares.
+        block_num (int): N, blocks in the stratum.
+        sample_num (int): m, sampled blocks.
+
+    Returns:
+        float | None: The variance, or None if it cannot be estimated (a single block of several).
+    """
+    if sample_num >= block_num:
+        return 0.0
+    if sample_num < 2:
+        return None
+    sample_variance = max(s2 - s1 * s1 / sample_num, 0.0) / (sample_num - 1)
+    return block_num * block_num * (1 - sample_num / block_num) * sample_variance / sample_num
+
+
+def sampled_subprocess(ranges, fraction, block_bytes=SAMPLE_BLOCK_BYTES, seed=None, aggregation=None):
+    """Estimates this rank's hour and user score totals from a random sample of its blocks.
+
+    Each rank's share of the input (the v3 byte-range partition) is one stratum. Scores are
+    aggregated exactly inside every sampled block; per-key block sums give the scaled totals
+    N / m * sum and their variances, so strata combine by adding both.
+
+    Args:
+        ranges (list): This rank's [(file_path, start, end), ...].
+        fraction (float): Share of blocks to read.
+        block_bytes (int): Block size.
+        seed (int | None): Base seed; each rank uses seed + RANK. None draws a random sample.
+        aggregation (dict | None): aggregation_init() state with an exact id_score and neither a time
+            cube nor metrics, i.e. only the parsing filters (see mpi_v4_subprocess()).
+
+    Returns:
+        Tuple[dict, dict, list, dict]: Estimated hour_score and id_score (same layouts as
+        mpi_v3_subprocess()), failed_records of the sampled blocks, and
+        { "hour_var": {hour: var}, "id_var": {id: var}, "blocks", "sampled_blocks", "sampled_bytes" }.
+    """
+    rng = random.Random(None if seed is None else seed + RANK)
+    block_num, sample = plan_sample_blocks(ranges, fraction, block_bytes, rng)
+
+    hour_sums, id_sums = {}, {}  # key: [sum over blocks, sum of squares over blocks]
+    usernames = {}
+    failed_records = []
+    for path, start, end in sample:
+        hour_score, id_score = {}, {}
+        aggregate_byte_range(path, start, end, hour_score, id_score, failed_records, aggregation)
+        for k, v in hour_score.items():
+            sums = hour_sums.setdefault(k, [0.0, 0.0])
+            sums[0] += v
+            sums[1] += v * v
+        for k, (v, username) in id_score.items():
+            sums = id_sums.setdefault(k, [0.0, 0.0])
+            sums[0] += v
+            sums[1] += v * v
+            usernames.setdefault(k, username)
+
+    sample_num = len(sample)
+    scale = block_num / sample_num if sample_num else 0.0
+    info = {
+        "hour_var": {k: stratum_total_variance(s1, s2, block_num, sample_num) for k, (s1, s2) in hour_sums.items()},
+        "id_var": {k: stratum_total_variance(s1, s2, block_num, sample_num) for k, (s1, s2) in id_sums.items()},
+        "blocks": block_num,
+        "sampled_blocks": sample_num,
+        "sampled_bytes": sum(end - start for _, start, end in sample),
+    }
+    print(f"Rank={RANK}: Sampled {sample_num} of {block_num} blocks ({info['sampled_bytes']} bytes)")
+    return (
+        {k: s1 * scale for k, (s1, _) in hour_sums.items()},
+        {k: [s1 * scale, usernames[k]] for k, (s1, _) in id_sums.items()},
+        failed_records,
+        info,
+    )
+
+
+def merge_variances(list_of_vars):
+    """Adds per-key variances of independent strata; a key missing from a stratum adds 0, None wins."""
+    merged = {}
+    for variances in list_of_vars:
+        for k, v in variances.items():
+            if k in merged and merged[k] is None:
+                continue
+            merged[k] = None if v is None else merged.get(k, 0.0) + v
+    return merged
+
+
+def _interval(estimate, variance, z):
+    if variance is None:
+        return [None, None]
+    half_width = z * math.sqrt(variance)
+    return [estimate - half_width, estimate + half_width]
+
+
+def write_sample_intervals(merged_hour_score, merged_id_score, list_of_infos, filename_suffix, top_k=5,
+                           z=SAMPLE_CONFIDENCE_Z):
+    """Writes and prints confidence intervals for the estimates of a --sample run (rank 0 only).
+
+    Writes merged_hour_ci_<suffix>.ndjson with { hour: [estimate, lower, upper] } and
+    merged_id_ci_<suffix>.ndjson with { id: [estimate, username, [lower, upper]] }. Bounds are
+    None where the variance could not be estimated.
+
+    Args:
+        merged_hour_score (dict): Merged hour estimates.
+        merged_id_score (dict): Merged user estimates.
+        list_of_infos (list): The info dicts of every rank from sampled_subprocess().
+        filename_suffix (str): Output suffix, e.g. "v3_sample".
+        top_k (int): Number of hours and users printed per direction.
+        z (float): Normal quantile of the interval, 1.96 for 95%.
+    """
+    hour_var = merge_variances([info["hour_var"] for info in list_of_infos])
+    id_var = merge_variances([info["id_var"] for info in list_of_infos])
+    hour_ci = {k: [v] + _interval(v, hour_var[k], z) for k, v in merged_hour_score.items()}
+    id_ci = {k: [v[0], v[1], _interval(v[0], id_var[k], z)] for k, v in merged_id_score.items()}
+    write_data_to_ndjson(hour_ci, TEST_DATA_FOLDER / f"merged_hour_ci_{filename_suffix}.ndjson", False)
+    write_data_to_ndjson(id_ci, TEST_DATA_FOLDER / f"merged_id_ci_{filename_suffix}.ndjson", False)
+
+    blocks = sum(info["blocks"] for info in list_of_infos)
+    sampled = sum(info["sampled_blocks"] for info in list_of_infos)
+    sampled_bytes = sum(info["sampled_bytes"] for info in list_of_infos)
+    print(f"Rank=0: Sampled {sampled} of {blocks} blocks, {sampled_bytes} bytes; "
+          f"intervals are estimate +- {z} standard errors")
+    for what, ci in [("hours", hour_ci), ("users", id_ci)]:
+        for get_max in [True, False]:
+            top = find_the_top_k_v2(((v[0], {k: v}) for k, v in ci.items()), top_k=top_k, get_max=get_max)
+            print(f"{'Happiest' if get_max else 'Saddest'} {top_k} {what} (estimated):")
+            pprint.pprint([item for _, item in top])
+            print()
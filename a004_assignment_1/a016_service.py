@@ -0,0 +1,328 @@
+import argparse
+import bisect
+import json
+import pprint
+import socket
+import time
+from array import array
+from pathlib import Path
+
+from a004_assignment_1.a000_CFG import (
+    COMM,
+    RANK,
+    SIZE,
+    RAW_DATA_FOLDER,
+    NDJSON_FILE_NAME_TO_LOAD,
+    SERVICE_SOCKET_PATH,
+)
+from a004_assignment_1.a002_utils import (
+    iter_lines_in_byte_range,
+    parse_one_line,
+    RECORD_EXTRACTOR,
+)
+from a004_assignment_1.a003_top_k import find_the_top_k_v2
+from a004_assignment_1.a007_time_cube import hour_str_to_epoch_hour, epoch_hour_to_hour_str
+from a004_assignment_1.a012_dataset import resolve_input_paths, assign_byte_ranges_by_size
+from a004_assignment_1.a025_extract import EXTRACT_OK
+
+
+def load_partition(ranges):
+    """Parses this rank's byte ranges once into compact columns sorted by hour.
+
+    Args:
+        ranges (list): [(file_path, start, end), ...]
+
+    Returns:
+        dict: { "hours": array('q') of epoch hours, ascending, "scores": array('d'),
+        "users": array('l') of indices into "user_ids"/"usernames", "user_ids": [str],
+        "usernames": [str], "failed": int }
+    """
+    hours, scores, users = array("q"), array("d"), array("l")
+    user_index, user_ids, usernames = {}, [], []
+    failed = 0
+    for path, start, end in ranges:
+        for _, line in iter_lines_in_byte_range(path, start, end):
+            try:
+                record = parse_one_line(line, use_filter=False)
+                if not record:
+                    continue
+            except Exception:
+                failed += 1
+                continue
+            code, fields = RECORD_EXTRACTOR["extract"](record)
+            if code != EXTRACT_OK:
+                failed += 1
+                continue
+            created_hour, sentiment_score, id_0, username_0 = fields
+            u = user_index.get(id_0)
+            if u is None:
+                u = user_index[id_0] = len(user_ids)
+                user_ids.append(id_0)
+                usernames.append(username_0)
+            hours.append(hour_str_to_epoch_hour(created_hour))
+            scores.append(sentiment_score)
+            users.append(u)
+
+    # Sort rows by hour so that time windows are two binary searches
+    order = sorted(range(len(hours)), key=hours.__getitem__)
+    return {
+        "hours": array("q", (hours[i] for i in order)),
+        "scores": array("d", (scores[i] for i in order)),
+        "users": array("l", (users[i] for i in order)),
+        "user_ids": user_ids,
+        "usernames": usernames,
+        "failed": failed,
+    }
+
+
+def partition_nbytes(partition):
+    """Returns the bytes held by a partition's columns (user strings not included)."""
+    return sum(len(partition[k]) * partition[k].itemsize for k in ["hours", "scores", "users"])
+
+
+def _row_window(partition, query):
+    """Returns the [lo, hi) rows inside the query's optional 'start'/'end' hours."""
+    hours = partition["hours"]
+    lo = bisect.bisect_left(hours, hour_str_to_epoch_hour(query["start"])) if query.get("start") else 0
+    hi = bisect.bisect_left(hours, hour_str_to_epoch_hour(query["end"])) if query.get("end") else len(hours)
+    return lo, hi
+
+
+def scan_partition(partition, query):
+    """Runs one query's scan over this rank's columns and returns a mergeable partial result.
+
+    Args:
+        partition (dict): Columns from load_partition().
+        query (dict): See SERVICE_QUERIES.
+
+    Returns:
+        dict: { key: [score_sum, count, ...] }, merged across ranks by merge_partials().
+    """
+    op = query["op"]
+    if op == "stats":
+        return {RANK: [len(partition["hours"]), partition_nbytes(partition), partition["failed"]]}
+
+    lo, hi = _row_window(partition, query)
+    hours, scores, users = partition["hours"], partition["scores"], partition["users"]
+    partial = {}
+    if op in ["hour_scores", "top_hours"]:
+        for i in range(lo, hi):
+            entry = partial.get(hours[i])
+            if entry is None:
+                partial[hours[i]] = [scores[i], 1]
+            else:
+                entry[0] += scores[i]
+                entry[1] += 1
+        return {epoch_hour_to_hour_str(h): v for h, v in partial.items()}
+
+    # Per-user queries accumulate by index into the user table and only resolve IDs at the end
+    user_filter = None
+    if op == "user":
+        user_filter = {u for u, id_0 in enumerate(partition["user_ids"]) if id_0 == query["id"]}
+    sums, counts = {}, {}
+    for u, s in zip(users[lo:hi], scores[lo:hi]):
+        if user_filter is not None and u not in user_filter:
+            continue
+        sums[u] = sums.get(u, 0.0) + s
+        counts[u] = counts.get(u, 0) + 1
+    return {
+        partition["user_ids"][u]: [sums[u], counts[u], partition["usernames"][u]]
+        for u in sums
+    }
+
+
+def merge_partials(partials):
+    """Adds [score_sum, count, ...] values of the same key over ranks; trailing fields come from the first."""
+    merged = {}
+    for partial in partials:
+        for k, v in partial.items():
+            if k in merged:
+                merged[k][0] += v[0]
+                merged[k][1] += v[1]
+            else:
+                merged[k] = list(v)
+    return merged
+
+
+def finish_query(query, merged):
+    """Turns the merged partials into the answer sent back to the client (rank 0 only)."""
+    op = query["op"]
+    if op == "stats":
+        return {
+            "ranks": SIZE,
+            "rows": sum(v[0] for v in merged.values()),
+            "column_bytes": sum(v[1] for v in merged.values()),
+            "failed": sum(v[2] for v in merged.values()),
+            "per_rank_rows": [merged[r][0] for r in sorted(merged)],
+        }
+    if op == "hour_scores":
+        return [{k: v[0]} for k, v in sorted(merged.items())]
+    if op == "user":
+        return {k: [v[0], v[2]] for k, v in merged.items()} or None
+    top = find_the_top_k_v2(
+        ((v[0], k) for k, v in merged.items()),
+        top_k=int(query.get("k", 5)),
+        get_max=not query.get("saddest", False),
+    )
+    if op == "top_hours":
+        return [{k: score} for score, k in top]
+    return [{k: [score, merged[k][2]]} for score, k in top]
+
+
+# op: description, for the "help" query
+SERVICE_QUERIES = {
+    "stats": "Rows, column bytes and parse failures per rank",
+    "hour_scores": "Score per hour; optional start/end 'YYYY-MM-DD HH:00'",
+    "top_hours": "Happiest (or saddest=true) k hours; optional start/end",
+    "top_users": "Happiest (or saddest=true) k users; optional start/end",
+    "user": "Score of user id; optional start/end",
+    "help": "This list",
+    "shutdown": "Stop the service",
+}
+
+
+def answer_query(partition, query):
+    """Scans every rank's partition for a query all ranks received, and merges on rank 0. Collective.
+
+    Returns:
+        tuple[object, float] | None: On rank 0 the answer and the seconds it took, None elsewhere.
+    """
+    start_time = time.time()
+    if query.get("op") not in SERVICE_QUERIES or query["op"] in ["help", "shutdown"]:
+        partial = {}
+    else:
+        try:
+            partial = scan_partition(partition, query)
+        except Exception as e:
+            # Still take part in the gather, so that one bad query does not hang the service
+            partial = f"Rank={RANK}: {type(e).__name__}: {e}"
+    partials = COMM.gather(partial, root=0)
+    if RANK != 0:
+        return None
+    errors = [partial for partial in partials if isinstance(partial, str)]
+    if errors:
+        return {"error": errors[0]}, time.time() - start_time
+    if query.get("op") == "help":
+        return SERVICE_QUERIES, time.time() - start_time
+    if query.get("op") not in SERVICE_QUERIES:
+        return {"error": f"unknown op {query.get('op')!r}, send {{\"op\": \"help\"}}"}, 0.0
+    if query["op"] == "shutdown":
+        return "bye", 0.0
+    return finish_query(query, merge_partials(partials)), time.time() - start_time
+
+
+def run_query(partition, query):
+    """Broadcasts a query from rank 0 and answers it (rank 0 side of answer_query())."""
+    COMM.bcast(query, root=0)
+    return answer_query(partition, query)
+
+
+def _serve_socket(partition, socket_path):
+    """Answers newline-delimited JSON queries on a Unix socket until a shutdown query (rank 0 side)."""
+    socket_path = Path(socket_path)
+    socket_path.unlink(missing_ok=True)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(str(socket_path))
+        server.listen()
+        print(f"Rank=0: Listening on {socket_path}")
+        while True:
+            connection, _ = server.accept()
+            with connection, connection.makefile("rw", encoding="utf-8") as stream:
+                for line in stream:
+                    if not line.strip():
+                        continue
+                    try:
+                        query = json.loads(line)
+                    except json.JSONDecodeError as e:
+                        stream.write(json.dumps({"error": str(e)}) + "\n")
+                        stream.flush()
+                        continue
+                    answer, seconds = run_query(partition, query)
+                    stream.write(json.dumps({"result": answer, "seconds": seconds}, ensure_ascii=False) + "\n")
+                    stream.flush()
+                    if query.get("op") == "shutdown":
+                        socket_path.unlink(missing_ok=True)
+                        return
+
+
+def serve(ranges, socket_path=None, job_file=None):
+    """Loads this rank's partition once, then answers queries until shutdown. Collective over COMM.
+
+    Rank 0 reads queries, one JSON object per line, from job_file or from clients of a Unix socket,
+    broadcasts each to every rank, and merges the partial results of the in-memory scans.
+
+    Args:
+        ranges (list): One list of (file_path, start, end) ranges per rank.
+        socket_path (str | Path | None): Unix socket rank 0 listens on (when no job_file is given).
+        job_file (str | Path | None): File of queries; the service stops after the last one.
+    """
+    start_time = time.time()
+    partition = load_partition(ranges[RANK])
+    print(f"Rank={RANK}: Loaded {len(partition['hours'])} rows, "
+          f"{partition_nbytes(partition)} column bytes in {time.time() - start_time:.3f} s")
+    COMM.Barrier()
+
+    if RANK != 0:
+        # Workers follow the queries rank 0 broadcasts until it sends None
+        while True:
+            query = COMM.bcast(None, root=0)
+            if query is None:
+                return
+            answer_query(partition, query)
+
+    if job_file is not None:
+        with open(job_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    query = json.loads(line)
+                    answer, seconds = run_query(partition, query)
+                    print(f"Query {query} answered in {seconds * 1000:.3f} ms:")
+                    pprint.pprint(answer)
+    else:
+        _serve_socket(partition, socket_path or SERVICE_SOCKET_PATH)
+    COMM.bcast(None, root=0)
+
+
+def query_service(query, socket_path=SERVICE_SOCKET_PATH):
+    """Sends one query to a running service and returns its decoded reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(socket_path))
+        with client.makefile("rw", encoding="utf-8") as stream:
+            stream.write(json.dumps(query) + "\n")
+            stream.flush()
+            return json.loads(stream.readline())
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Resident in-memory dataset service: load once, answer many queries."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Load the data and answer queries (run under mpirun)")
+    serve_parser.add_argument('--input', default=None, help='File, directory or glob (default: the raw file)')
+    serve_parser.add_argument('--socket', default=SERVICE_SOCKET_PATH, help='Unix socket to listen on')
+    serve_parser.add_argument('--jobs', default=None, help='Answer the queries in this file, then exit')
+
+    query_parser = subparsers.add_parser("query", help="Send one query to a running service")
+    query_parser.add_argument('query', help='JSON, e.g. \'{"op": "top_users", "k": 5}\'')
+    query_parser.add_argument('--socket', default=SERVICE_SOCKET_PATH)
+    return parser.parse_args()
+
+
+def start_service():
+    args = get_args()
+    if args.command == "query":
+        pprint.pprint(query_service(json.loads(args.query), socket_path=args.socket))
+        return
+
+    if args.input:
+        input_paths = resolve_input_paths(args.input)
+    else:
+        input_paths = [RAW_DATA_FOLDER / NDJSON_FILE_NAME_TO_LOAD]
+    ranges = assign_byte_ranges_by_size([(path, path.stat().st_size) for path in input_paths], SIZE)
+    serve(ranges, socket_path=args.socket, job_file=args.jobs)
+
+
+if __name__ == "__main__":
+    start_service()
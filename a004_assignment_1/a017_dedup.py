@@ -0,0 +1,241 @@
+import hashlib
+import itertools
+import math
+from array import array
+
+from mpi4py import MPI
+
+from a004_assignment_1.a000_CFG import COMM, RANK, SIZE, DEDUP_BATCH_LINES, DEDUP_ESTIMATE_BYTES
+from a004_assignment_1.a002_utils import (
+    accumulate_scores,
+    aggregation_init,
+    init_id_score,
+    iter_lines_in_byte_range,
+    parse_one_line,
+    RECORD_EXTRACTOR,
+)
+from a004_assignment_1.a010_pushdown import line_passes_filter, record_passes_filter
+from a004_assignment_1.a025_extract import EXTRACT_OK, describe_extract_error
+
+
+def bloom_init(expected_items, fp_rate, budget_bytes=None):
+    """Creates a Bloom filter sized for expected_items at fp_rate, capped at budget_bytes.
+
+    Args:
+        expected_items (int): Number of distinct keys the filter should hold.
+        fp_rate (float): Target false-positive rate, in (0, 1).
+        budget_bytes (int | None): Most bytes the bit array may take. When the target needs more,
+            the filter gets budget_bytes and a correspondingly higher predicted rate.
+
+    Returns:
+        dict: { "bits": bytearray, "bit_num": int, "hash_num": int, "expected": int,
+        "target_fp_rate": float, "inserted": int }
+    """
+    expected_items = max(expected_items, 1)
+    bit_num = math.ceil(-expected_items * math.log(fp_rate) / (math.log(2) ** 2))
+    if budget_bytes is not None:
+        bit_num = min(bit_num, budget_bytes * 8)
+    bit_num = max(bit_num, 64)
+    hash_num = max(1, round(bit_num / expected_items * math.log(2)))
+    return {
+        "bits": bytearray((bit_num + 7) // 8),
+        "bit_num": bit_num,
+        "hash_num": hash_num,
+        "expected": expected_items,
+        "target_fp_rate": fp_rate,
+        "inserted": 0,
+    }
+
+
+def bloom_check_and_add(bloom, key_hash):
+    """Adds a 64-bit key hash to the filter and returns whether it was (probably) there already.
+
+    The hash_num bit positions come from double hashing the two 32-bit halves of key_hash.
+    """
+    bits, bit_num = bloom["bits"], bloom["bit_num"]
+    h1, h2 = key_hash & 0xFFFFFFFF, (key_hash >> 32) | 1
+    present = True
+    for i in range(bloom["hash_num"]):
+        position = (h1 + i * h2) % bit_num
+        mask = 1 << (position & 7)
+        if not bits[position >> 3] & mask:
+            present = False
+            bits[position >> 3] |= mask
+    if not present:
+        bloom["inserted"] += 1
+    return present
+
+
+def bloom_predicted_fp_rate(bloom, items=None):
+    """Returns the false-positive rate of the filter after inserting items (default: as filled now)."""
+    items = bloom["inserted"] if items is None else items
+    return (1.0 - math.exp(-bloom["hash_num"] * items / bloom["bit_num"])) ** bloom["hash_num"]
+
+
+def post_id_hash(post_id):
+    """Hashes a post id into its owner rank and the 64-bit key the owner's Bloom filter checks."""
+    digest = hashlib.blake2b(post_id.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little") % SIZE, int.from_bytes(digest[8:], "little")
+
+
+def estimate_post_num(ranges, sample_bytes=DEDUP_ESTIMATE_BYTES):
+    """Estimates the posts in all ranks' ranges from the line density of each rank's first bytes. Collective.
+
+    Args:
+        ranges (list): This rank's [(file_path, start, end), ...].
+        sample_bytes (int): Bytes each rank reads to measure its line density.
+
+    Returns:
+        int: The estimated number of lines over every rank.
+    """
+    sampled_bytes, sampled_lines = 0, 0
+    for path, start, end in ranges:
+        for offset, _ in iter_lines_in_byte_range(path, start, end):
+            sampled_lines += 1
+            sampled_bytes = offset - start
+            if sampled_bytes >= sample_bytes:
+                break
+        if sampled_bytes >= sample_bytes:
+            break
+    my_bytes = sum(end - start for _, start, end in ranges)
+    total_bytes, sampled_bytes, sampled_lines = (
+        COMM.allreduce(value, op=MPI.SUM) for value in [my_bytes, sampled_bytes, sampled_lines]
+    )
+    return math.ceil(total_bytes * sampled_lines / sampled_bytes) if sampled_bytes else 0
+
+
+def _parse_line(line, use_filter, line_filter):
+    """Parses one raw line into (record, fields), where fields are None if it is skipped."""
+    if line_filter is not None and not line_passes_filter(line_filter, line):
+        return None, None
+    record = parse_one_line(line, use_filter=use_filter)
+    if not record or (line_filter is not None and not record_passes_filter(line_filter, record)):
+        return record, None
+    code, fields = RECORD_EXTRACTOR["extract"](record)
+    if code != EXTRACT_OK:
+        raise ValueError(describe_extract_error(RECORD_EXTRACTOR, code))
+    return record, fields
+
+
+def dedup_subprocess(
+        ranges,
+        fp_rate,
+        bloom_budget=None,
+        batch_lines=DEDUP_BATCH_LINES,
+        aggregation=None,
+):
+    """Aggregates this rank's byte ranges, counting every post id (doc.id) only once over all ranks.
+
+    Collective over COMM. Ranks parse batch_lines lines per round and send the hash of each
+    post id to the rank owning it (post_id_hash()). Each owner checks and adds the hashes to its
+    own Bloom filter, in rank and line order, and answers with one duplicate flag per hash, so a
+    post is aggregated by whichever rank holds its first copy. A false positive drops a post that
+    is not a duplicate; the filter is sized so that this happens at about fp_rate. Records
+    without a post id are always aggregated.
+
+    Args:
+        ranges (list): This rank's [(file_path, start, end), ...].
+        fp_rate (float): Target false-positive rate of each owner's Bloom filter.
+        bloom_budget (int | None): Most bytes of each rank's Bloom filter.
+        batch_lines (int): Lines parsed per exchange round.
+        aggregation (dict | None): aggregation_init() state, filled in place (see mpi_v4_subprocess()).
+
+    Returns:
+        Tuple[dict, dict, list, dict]: This rank's hour_score, id_score and failed_records (as
+        returned by mpi_v4_subprocess()), and its statistics for format_dedup_stats().
+    """
+    bloom = bloom_init(math.ceil(estimate_post_num(ranges) / SIZE), fp_rate, bloom_budget)
+    hour_score = {}
+    aggregation = aggregation or aggregation_init()
+    id_score = init_id_score(aggregation["approx_capacity"], aggregation["memory_budget"])
+    failed_records = []
+    stats = {"checked": 0, "duplicates": 0, "without_id": 0, "rounds": 0}
+
+    lines = itertools.chain.from_iterable(
+        iter_lines_in_byte_range(path, start, end) for path, start, end in ranges
+    )
+    while True:
+        batch = list(itertools.islice(lines, batch_lines))
+        if COMM.allreduce(len(batch), op=MPI.SUM) == 0:
+            break
+        stats["rounds"] += 1
+
+        # Parse the batch and route the post id hashes to their owners
+        pending = [[] for _ in range(SIZE)]  # Per owner: (record, fields) awaiting its verdict
+        outgoing = [array("Q") for _ in range(SIZE)]
+        for offset, line in batch:
+            record = None
+            try:
+                record, fields = _parse_line(line, aggregation["use_filter"], aggregation["line_filter"])
+                if fields is None:
+                    continue
+                post_id = record["doc"].get("id")
+            except Exception as e:
+                print(f"Rank={RANK}: Error processing line ending at byte {offset}: {e}")
+                failed_records.append(record if record is not None else {"line": line.decode("utf-8", "replace")})
+                continue
+            if post_id is None:
+                stats["without_id"] += 1
+                accumulate_scores(hour_score, id_score, *fields, aggregation, record=record)
+                continue
+            owner, key_hash = post_id_hash(str(post_id))
+            outgoing[owner].append(key_hash)
+            pending[owner].append((record, fields))
+
+        # Check the hashes this rank owns, and get back the verdicts on the ones it sent
+        incoming = COMM.alltoall(outgoing)
+        verdicts = COMM.alltoall([
+            bytes(bloom_check_and_add(bloom, key_hash) for key_hash in hashes) for hashes in incoming
+        ])
+        for owner in range(SIZE):
+            for (record, fields), duplicate in zip(pending[owner], verdicts[owner]):
+                stats["checked"] += 1
+                if duplicate:
+                    stats["duplicates"] += 1
+                    continue
+                accumulate_scores(hour_score, id_score, *fields, aggregation, record=record)
+
+    stats.update({
+        "bloom_bytes": len(bloom["bits"]),
+        "hash_num": bloom["hash_num"],
+        "expected": bloom["expected"],
+        "owned": bloom["inserted"],
+        "target_fp_rate": fp_rate,
+        "planned_fp_rate": bloom_predicted_fp_rate(bloom, bloom["expected"]),
+        "fp_rate": bloom_predicted_fp_rate(bloom),
+    })
+    print(f"Rank={RANK}: {format_dedup_stats(stats)}")
+    return hour_score, id_score, failed_records, stats
+
+
+def format_dedup_stats(stats):
+    """One-line summary of the statistics returned by dedup_subprocess()."""
+    return (
+        f"dedup checked {stats['checked']} post ids in {stats['rounds']} rounds, dropped {stats['duplicates']} "
+        f"as duplicates, {stats['without_id']} records without id; Bloom filter {stats['bloom_bytes']} bytes, "
+        f"{stats['hash_num']} hashes, {stats['owned']} of {stats['expected']} planned ids, "
+        f"false-positive rate {stats['fp_rate']:.2e} (planned {stats['planned_fp_rate']:.2e}, "
+        f"target {stats['target_fp_rate']:.2e})"
+    )
+
+
+def report_dedup(list_of_stats):
+    """Prints the dedup statistics of all ranks combined (rank 0 only).
+
+    Every checked id was tested against one owner's filter, so the expected number of unique
+    posts dropped by false positives is at most the unique posts times the worst owner's rate.
+    """
+    checked = sum(stats["checked"] for stats in list_of_stats)
+    duplicates = sum(stats["duplicates"] for stats in list_of_stats)
+    fp_rate = max(stats["fp_rate"] for stats in list_of_stats)
+    without_id = sum(stats["without_id"] for stats in list_of_stats)
+    if checked == 0 and without_id > 0:
+        print(f"Rank=0: Warning: none of the {without_id} records has a post id, so nothing was deduplicated; "
+              f"input written without doc.id (e.g. pieces split before it was kept) has to be split again")
+    print(
+        f"Rank=0: Dedup over {len(list_of_stats)} rank(s): {checked} post ids checked, {duplicates} dropped "
+        f"as duplicates, {without_id} records without id kept; "
+        f"Bloom filters {sum(stats['bloom_bytes'] for stats in list_of_stats)} bytes in total, "
+        f"false-positive rate <= {fp_rate:.2e}, "
+        f"i.e. <= {fp_rate * (checked - duplicates):.1f} unique posts expected to be dropped"
+    )
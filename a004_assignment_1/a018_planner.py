@@ -0,0 +1,271 @@
+import json
+import math
+import os
+import time
+from pathlib import Path
+
+from mpi4py import MPI
+
+from a004_assignment_1.a000_CFG import (
+    COMM,
+    RANK,
+    SIZE,
+    PIECES_DATA_FOLDER,
+    FILE_PIECES_FOR_MPI_V4,
+    ROOT_READER_BLOCK_BYTES,
+    PLANNER_COST_MODEL_PATH,
+    PLANNER_LOG_PATH,
+    PLANNER_MIN_BLOCK_BYTES,
+    PLANNER_DEFAULT_COST_MODEL,
+)
+from a004_assignment_1.a002_utils import check_split_files_exist, split_file
+from a004_assignment_1.a004_hierarchical import split_comm_by_node
+from a004_assignment_1.a010_pushdown import format_line_filter_stats, reset_line_filter_stats
+from a004_assignment_1.a012_dataset import assign_files_by_size
+
+def load_cost_model(path=PLANNER_COST_MODEL_PATH):
+    """Returns PLANNER_DEFAULT_COST_MODEL, updated by the calibrated coefficients at path if it exists."""
+    cost_model = dict(PLANNER_DEFAULT_COST_MODEL)
+    path = Path(path)
+    if path.is_file():
+        with open(path, "r", encoding="utf-8") as f:
+            cost_model.update(json.load(f)["cost_model"])
+    return cost_model
+
+
+def detect_topology():
+    """Returns the rank layout and the memory available per rank. Collective over COMM.
+
+    Returns:
+        dict: { "size", "nodes", "ranks_per_node" (on the fullest node), "memory_per_rank" (bytes
+        of available physical memory on the node divided by its ranks, minimum over nodes;
+        None where the OS does not report it) }
+    """
+    node_comm, leader_comm = split_comm_by_node()
+    ranks_per_node = node_comm.Get_size()
+    is_leader = node_comm.Get_rank() == 0
+    node_comm.Free()
+    if leader_comm != MPI.COMM_NULL:
+        leader_comm.Free()
+    try:
+        memory_per_rank = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES") // ranks_per_node
+    except (ValueError, OSError, AttributeError):
+        memory_per_rank = -1
+    memory_per_rank = COMM.allreduce(memory_per_rank, op=MPI.MIN)
+    return {
+        "size": SIZE,
+        "nodes": COMM.allreduce(int(is_leader), op=MPI.SUM),
+        "ranks_per_node": COMM.allreduce(ranks_per_node, op=MPI.MAX),
+        "memory_per_rank": memory_per_rank if memory_per_rank >= 0 else None,
+    }
+
+
+def get_piece_folder(pieces_num):
+    """Returns the folder of pieces_num pieces.
+
+    PIECES_DATA_FOLDER holds the FILE_PIECES_FOR_MPI_V4 pieces v4 uses, and auto_<pieces_num> inside it any other count.
+    """
+    return PIECES_DATA_FOLDER if pieces_num == FILE_PIECES_FOR_MPI_V4 else PIECES_DATA_FOLDER / f"auto_{pieces_num}"
+
+
+def get_piece_paths(file_path, pieces_num):
+    """Paths of the pieces split_file() writes for file_path into get_piece_folder(pieces_num)."""
+    file_path = Path(file_path)
+    return [
+        get_piece_folder(pieces_num) / f"{file_path.stem}_piece_{i}{file_path.suffix}"
+        for i in range(pieces_num)
+    ]
+
+
+def find_existing_pieces(file_path, line_filter=None):
+    """Returns the piece sizes of every piece count file_path is already fully split into.
+
+    Pieces written with another filter than line_filter are not counted, as they cannot be reused.
+
+    Returns:
+        dict: { pieces_num: [piece size in bytes, ...] }
+    """
+    counts = set()
+    if check_split_files_exist(file_path, FILE_PIECES_FOR_MPI_V4, PIECES_DATA_FOLDER, line_filter):
+        counts.add(FILE_PIECES_FOR_MPI_V4)
+    for folder in PIECES_DATA_FOLDER.glob("auto_*"):
+        pieces_num = folder.name.removeprefix("auto_")
+        if pieces_num.isdigit() and check_split_files_exist(file_path, int(pieces_num), folder, line_filter):
+            counts.add(int(pieces_num))
+    return {
+        pieces_num: [path.stat().st_size for path in get_piece_paths(file_path, pieces_num)]
+        for pieces_num in sorted(counts)
+    }
+
+
+def predict_plans(file_bytes, topology, cost_model, existing_pieces=None):
+    """Predicts the run time of every feasible strategy with the cost model.
+
+    The model charges, in seconds:
+        - read: bytes per rank at one reader's bandwidth, or all bytes at the nodes' combined
+          bandwidth if that is slower; with root-scatter, all bytes at one reader's bandwidth.
+        - scatter: with root-scatter, the bytes rank 0 sends to the other ranks.
+        - split: with pre-split pieces that do not exist yet, rank 0 writing them.
+        - parse: the most bytes one rank parses. Pieces are smaller than the raw file; existing
+          pieces are bin-packed by their real sizes as v4 --input does, new ones are assumed
+          equal, so a count that is not a multiple of SIZE leaves some ranks one piece more.
+        - gather: a fixed cost per rank.
+
+    Args:
+        file_bytes (int): Size of the input file.
+        topology (dict): From detect_topology().
+        cost_model (dict): From load_cost_model().
+        existing_pieces (dict | None): From find_existing_pieces(); reused without splitting.
+
+    Returns:
+        list[dict]: Plans sorted by predicted time, each { "strategy", "pieces", "block_bytes",
+        "predicted_seconds", "costs": { part: seconds } }. "pieces" is None except for pre-split,
+        "block_bytes" None except for root-scatter.
+    """
+    size, nodes = topology["size"], topology["nodes"]
+    read_bps = cost_model["read_bytes_per_second"]
+    nodes_bps = nodes * cost_model["node_read_bytes_per_second"]
+    gather = size * cost_model["gather_seconds_per_rank"]
+    plans = []
+
+    def add(strategy, costs, pieces=None, block_bytes=None):
+        plans.append({
+            "strategy": strategy,
+            "pieces": pieces,
+            "block_bytes": block_bytes,
+            "predicted_seconds": sum(costs.values()),
+            "costs": costs,
+        })
+
+    add("byte-range", {
+        "read": max(file_bytes / size / read_bps, file_bytes / nodes_bps),
+        "parse": file_bytes / size * cost_model["parse_seconds_per_byte"],
+        "gather": gather,
+    })
+
+    # Rank 0 holds a round of SIZE blocks while splitting it, about three copies
+    block_bytes = ROOT_READER_BLOCK_BYTES
+    if topology["memory_per_rank"] is not None:
+        block_bytes = min(block_bytes, topology["memory_per_rank"] // (3 * size))
+    if block_bytes >= PLANNER_MIN_BLOCK_BYTES:
+        add("root-scatter", {
+            "read": file_bytes / read_bps,
+            "scatter": file_bytes * (size - 1) / size / cost_model["scatter_bytes_per_second"],
+            "parse": file_bytes / size * cost_model["parse_seconds_per_byte"],
+            "gather": gather,
+        }, block_bytes=block_bytes)
+
+    existing_pieces = existing_pieces or {}
+    for pieces_num in sorted(set(existing_pieces) | {size}):
+        if pieces_num in existing_pieces:
+            split = 0.0
+            piece_sizes = existing_pieces[pieces_num]
+            piece_total = sum(piece_sizes)
+            per_rank = max(
+                sum(end - start for _, start, end in ranges)
+                for ranges in assign_files_by_size(list(enumerate(piece_sizes)), size)
+            )
+        else:
+            split = file_bytes * cost_model["split_seconds_per_byte"]
+            piece_total = file_bytes * cost_model["piece_bytes_ratio"]
+            per_rank = math.ceil(pieces_num / size) * piece_total / pieces_num
+        add("pre-split", {
+            "split": split,
+            "read": max(per_rank / read_bps, piece_total / nodes_bps),
+            "parse": per_rank * cost_model["piece_parse_seconds_per_byte"],
+            "gather": gather,
+        }, pieces=pieces_num)
+
+    return sorted(plans, key=lambda plan: plan["predicted_seconds"])
+
+
+def make_plan(file_path, cost_model_path=PLANNER_COST_MODEL_PATH, line_filter=None):
+    """Chooses the strategy for file_path on this job's ranks and prints the alternatives. Collective over COMM.
+
+    Args:
+        file_path (str | Path): The file to process.
+        cost_model_path (str | Path): See load_cost_model().
+        line_filter (dict | None): The build_line_filter() state of the run; only pieces written
+            with it count as existing.
+
+    Returns:
+        dict: The cheapest plan from predict_plans(), with "file_bytes", "topology" and
+        "calibrated" (whether a calibrated cost model was found) added, on every rank.
+    """
+    topology = detect_topology()
+    plan = None
+    if RANK == 0:
+        file_bytes = Path(file_path).stat().st_size
+        cost_model = load_cost_model(cost_model_path)
+        plans = predict_plans(file_bytes, topology, cost_model, find_existing_pieces(file_path, line_filter))
+        plan = dict(plans[0], file_bytes=file_bytes, topology=topology, calibrated=Path(cost_model_path).is_file())
+        print(f"Rank=0: Planning for {file_bytes} bytes on {topology['size']} rank(s), {topology['nodes']} node(s), "
+              f"<= {topology['ranks_per_node']} rank(s) per node, "
+              f"{_format_bytes(topology['memory_per_rank'])} available per rank, "
+              f"{'calibrated' if plan['calibrated'] else 'default'} cost model")
+        for candidate in plans:
+            print(f"  {'*' if candidate is plans[0] else ' '} {format_plan(candidate)}")
+    return COMM.bcast(plan, root=0)
+
+
+def _format_bytes(num):
+    """Formats a byte count in MiB."""
+    return "unknown memory" if num is None else f"{num / (1 << 20):.0f} MiB"
+
+
+def format_plan(plan):
+    """One-line summary of a plan and its predicted cost."""
+    details = ""
+    if plan["pieces"] is not None:
+        details = f" with {plan['pieces']} piece(s)"
+    elif plan["block_bytes"] is not None:
+        details = f" with {_format_bytes(plan['block_bytes'])} blocks"
+    costs = ", ".join(f"{part} {seconds:.3f}" for part, seconds in plan["costs"].items())
+    return f"{plan['strategy']}{details}: predicted {plan['predicted_seconds']:.3f} s ({costs})"
+
+
+def ensure_plan_pieces(plan, file_path, total_line_num, line_filter=None):
+    """Returns the pieces of a pre-split plan, letting rank 0 split file_path first if needed. Collective.
+
+    Args:
+        plan (dict): A "pre-split" plan from make_plan().
+        file_path (str | Path): The file to split.
+        total_line_num (int): Lines in the file, see split_file().
+        line_filter (dict | None): Optional build_line_filter() state applied while splitting.
+            Existing pieces are only reused if written with the same filter, as in try_split_file_by_rank0().
+
+    Returns:
+        list[Path]: The plan["pieces"] piece paths.
+    """
+    pieces_num = plan["pieces"]
+    if RANK == 0 and not check_split_files_exist(
+            file_path, pieces_num, get_piece_folder(pieces_num), line_filter,
+    ):
+        print(f"Rank=0: Splitting {file_path} into {pieces_num} pieces for the plan...")
+        split_file(
+            file_path=file_path,
+            total_line_num=total_line_num,
+            to_pieces_num=pieces_num,
+            output_folder=get_piece_folder(pieces_num),
+            use_filter=True,
+            line_filter=line_filter,
+        )
+        if line_filter is not None:
+            print(f"Rank=0: Splitting {format_line_filter_stats(line_filter)}")
+            # Rank 0 reads its own pieces with the same state next
+            reset_line_filter_stats(line_filter)
+    COMM.Barrier()
+    return get_piece_paths(file_path, pieces_num)
+
+
+def log_plan_result(plan, measured_seconds, log_path=PLANNER_LOG_PATH):
+    """Prints the predicted next to the measured time and appends both to log_path (rank 0 only).
+
+    The log holds one JSON object per run, for checking and recalibrating the cost model.
+    """
+    print(f"Rank=0: Plan {format_plan(plan)}; measured {measured_seconds:.3f} s "
+          f"({measured_seconds / plan['predicted_seconds']:.2f}x predicted)")
+    log_path = Path(log_path)
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(dict(plan, measured_seconds=measured_seconds, time=time.time())) + "\n")
@@ -0,0 +1,236 @@
+from math import ceil
+from pathlib import Path
+
+from mpi4py import MPI
+
+from a004_assignment_1.a000_CFG import COMM, RANK, SIZE, MPIIO_BLOCK_BYTES, MPIIO_DEFAULT_HINTS
+from a004_assignment_1.a002_utils import (
+    aggregate_lines,
+    aggregation_init,
+    compute_byte_ranges,
+    init_id_score,
+    iter_lines_in_block,
+)
+
+
+def parse_mpiio_hints(specs):
+    """Turns KEY=VALUE strings from --mpiio-hint into a hints dict on top of MPIIO_DEFAULT_HINTS.
+
+    An empty VALUE removes a default hint.
+
+    Raises:
+        ValueError: If a spec has no "=".
+    """
+    hints = dict(MPIIO_DEFAULT_HINTS)
+    for spec in specs or []:
+        key, sep, value = spec.partition("=")
+        if not sep or not key:
+            raise ValueError(f"MPI-IO hint must look like KEY=VALUE, got {spec!r}")
+        if value:
+            hints[key] = value
+        else:
+            hints.pop(key, None)
+    return hints
+
+
+def open_for_collective_read(file_path, hints):
+    """Opens a file read-only on every rank of COMM with MPI-IO hints. Collective.
+
+    Returns:
+        tuple[MPI.File, dict]: The file handle, and the hints the MPI-IO layer reports in effect.
+    """
+    info = MPI.Info.Create()
+    for key, value in hints.items():
+        info.Set(key, str(value))
+    fh = MPI.File.Open(COMM, str(file_path), MPI.MODE_RDONLY, info)
+    info.Free()
+    effective = fh.Get_info()
+    effective_hints = {key: effective.Get(key) for key in effective.keys()}
+    effective.Free()
+    return fh, effective_hints
+
+
+def iter_blocks_at_all(fh, ranges, block_bytes):
+    """Reads this rank's byte range in rounds of collective Read_at_all calls. Collective.
+
+    Every rank takes part in the same number of rounds, as many as the longest range needs;
+    ranks that are done read zero bytes.
+
+    Args:
+        fh (MPI.File): From open_for_collective_read().
+        ranges (list): [(start, end), ...] for every rank, as from compute_byte_ranges().
+        block_bytes (int): Bytes per rank and round.
+
+    Yields:
+        tuple[int, bytes]: The file offset of the block and the block, possibly empty.
+    """
+    start, end = ranges[RANK]
+    rounds = max(ceil((range_end - range_start) / block_bytes) for range_start, range_end in ranges)
+    buffer = bytearray(min(block_bytes, end - start))
+    view = memoryview(buffer)
+    for i in range(rounds):
+        offset = min(start + i * block_bytes, end)
+        count = min(block_bytes, end - offset)
+        fh.Read_at_all(offset, [view[:count], MPI.BYTE])
+        yield offset, bytes(view[:count])
+
+
+def complete_boundary_line(head, tail, has_newline):
+    """Passes the head of every rank's range to the rank whose tail line it completes. Collective.
+
+    A line belongs to the rank where it starts, so the bytes before the first newline of a range
+    (its head) end the last line (the tail) of the previous rank. Usually one sendrecv to the
+    left neighbour suffices; if some range holds no newline at all, its head only continues the
+    line, and all heads are gathered to stitch lines that span several ranges.
+
+    Args:
+        head (bytes): Bytes before and including this range's first newline (all of them if it
+            has none); empty on rank 0.
+        tail (bytes): Bytes after this range's last newline.
+        has_newline (bool): Whether the range contains a newline; always True on rank 0.
+
+    Returns:
+        bytes: This rank's tail completed by the following heads; empty if it owns no such line.
+    """
+    if COMM.allreduce(not has_newline, op=MPI.LOR):
+        fragments = COMM.allgather((head, has_newline))
+        if not has_newline:
+            return b""
+        parts = [tail]
+        for next_head, next_has_newline in fragments[RANK + 1:]:
+            parts.append(next_head)
+            if next_has_newline:
+                break
+        return b"".join(parts)
+    next_head = COMM.sendrecv(
+        head,
+        dest=RANK - 1 if RANK > 0 else MPI.PROC_NULL,
+        source=RANK + 1 if RANK < SIZE - 1 else MPI.PROC_NULL,
+    )
+    return tail + (next_head or b"")
+
+
+def mpiio_subprocess(
+        file_path,
+        block_bytes=MPIIO_BLOCK_BYTES,
+        hints=None,
+        aggregation=None,
+):
+    """Aggregates this rank's byte range, read with collective MPI-IO instead of Python open(). Collective.
+
+    All ranks open the file together and read their equal byte ranges in rounds of large
+    Read_at_all calls, which lets the MPI-IO layer aggregate them into few large, coordinated
+    requests (collective buffering, tuned by hints). Blocks are realigned to lines in memory:
+    the partial last line of a block carries over to the next round, and the lines crossing
+    range boundaries are completed by complete_boundary_line().
+
+    Args:
+        file_path (str | Path): The NDJSON file.
+        block_bytes (int): Bytes per rank and round.
+        hints (dict | None): MPI-IO hints, e.g. from parse_mpiio_hints(); None for MPIIO_DEFAULT_HINTS.
+        Other arguments: See mpi_v4_subprocess().
+
+    Returns:
+        Tuple[dict, dict, list]: hour_score, id_score and failed_records, as returned by
+        mpi_v4_subprocess().
+    """
+    hour_score = {}
+    aggregation = aggregation or aggregation_init()
+    id_score = init_id_score(aggregation["approx_capacity"], aggregation["memory_budget"])
+    failed_records = []
+
+    def aggregate(data, data_offset):
+        aggregate_lines(
+            file_path, data_offset, iter_lines_in_block(data, data_offset),
+            hour_score, id_score, failed_records, aggregation,
+        )
+
+    fh, effective_hints = open_for_collective_read(file_path, MPIIO_DEFAULT_HINTS if hints is None else hints)
+    if RANK == 0:
+        print(f"Rank=0: MPI-IO hints in effect: {effective_hints}")
+    ranges = compute_byte_ranges(fh.Get_size(), SIZE)
+    head, has_newline = b"", RANK == 0
+    leftover, leftover_offset = b"", ranges[RANK][0]
+    try:
+        for block_offset, block in iter_blocks_at_all(fh, ranges, block_bytes):
+            data, data_offset = leftover + block, leftover_offset
+            if not has_newline:
+                # Everything up to the first newline ends the previous rank's last line
+                newline = data.find(b"\n")
+                if newline == -1:
+                    head, leftover, leftover_offset = head + data, b"", block_offset + len(block)
+                    continue
+                head += data[:newline + 1]
+                data, data_offset = data[newline + 1:], data_offset + newline + 1
+                has_newline = True
+            cut = data.rfind(b"\n") + 1
+            aggregate(data[:cut], data_offset)
+            leftover, leftover_offset = data[cut:], data_offset + cut
+    finally:
+        fh.Close()
+
+    line = complete_boundary_line(head, leftover, has_newline)
+    if line:
+        aggregate(line, leftover_offset)
+    read_bytes = ranges[RANK][1] - ranges[RANK][0]
+    print(f"Rank={RANK}: Aggregated {read_bytes} bytes read with MPI-IO in {ceil(read_bytes / block_bytes)} round(s)")
+    return hour_score, id_score, failed_records
+
+
+def benchmark_read_bandwidth(file_path, block_bytes=MPIIO_BLOCK_BYTES, hints=None, limit_bytes=None):
+    """Times reading a file through POSIX reads, independent MPI-IO and collective MPI-IO. Collective.
+
+    Every rank reads its compute_byte_ranges() share in blocks of block_bytes; the aggregate
+    bandwidth is the bytes of all ranks divided by the slowest rank's time. Repeated reads hit
+    the page cache, so use a file larger than the nodes' memory, or drop caches between runs,
+    to measure the filesystem.
+
+    Args:
+        file_path (str | Path): File to read.
+        block_bytes (int): Bytes per rank and read call.
+        hints (dict | None): MPI-IO hints; None for MPIIO_DEFAULT_HINTS.
+        limit_bytes (int | None): Read only this many bytes of the file.
+
+    Returns:
+        dict | None: { mode: aggregate bytes per second } on rank 0, None elsewhere.
+    """
+    file_size = Path(file_path).stat().st_size
+    ranges = compute_byte_ranges(min(file_size, limit_bytes or file_size), SIZE)
+    start, end = ranges[RANK]
+    results = {}
+
+    def posix():
+        buffer = bytearray(block_bytes)
+        with open(file_path, "rb", buffering=0) as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                remaining -= f.readinto(memoryview(buffer)[:min(block_bytes, remaining)])
+
+    def mpiio(collective):
+        fh, _ = open_for_collective_read(file_path, MPIIO_DEFAULT_HINTS if hints is None else hints)
+        try:
+            if collective:
+                for _ in iter_blocks_at_all(fh, ranges, block_bytes):
+                    pass
+            else:
+                buffer = bytearray(block_bytes)
+                for offset in range(start, end, block_bytes):
+                    fh.Read_at(offset, [memoryview(buffer)[:min(block_bytes, end - offset)], MPI.BYTE])
+        finally:
+            fh.Close()
+
+    for mode, read in [
+        ("posix", posix),
+        ("mpiio_independent", lambda: mpiio(False)),
+        ("mpiio_collective", lambda: mpiio(True)),
+    ]:
+        COMM.Barrier()
+        start_time = MPI.Wtime()
+        read()
+        seconds = COMM.reduce(MPI.Wtime() - start_time, op=MPI.MAX, root=0)
+        if RANK == 0:
+            results[mode] = ranges[-1][1] / seconds
+            print(f"{mode:>18}: {ranges[-1][1]} bytes in {seconds:.3f} s, "
+                  f"{results[mode] / (1 << 20):.1f} MiB/s aggregate over {SIZE} rank(s)")
+    return results if RANK == 0 else None
@@ -0,0 +1,196 @@
+import re
+from collections import deque
+from pathlib import Path
+
+from mpi4py import MPI
+
+from a004_assignment_1.a000_CFG import RANK, NODE_READER_BLOCK_BYTES, NODE_READER_SLOTS_PER_PARSER
+from a004_assignment_1.a002_utils import aggregate_lines, aggregation_init, init_id_score, read_whole_lines
+from a004_assignment_1.a004_hierarchical import split_comm_by_node
+from a004_assignment_1.a012_dataset import assign_byte_ranges_by_size, assign_files_by_size
+
+NEWLINE_PATTERN = re.compile(rb"\n")
+
+
+def iter_node_blocks(ranges, block_bytes):
+    """Reads byte ranges as blocks of whole lines, following the iter_lines_in_byte_range() convention.
+
+    Args:
+        ranges (list): [(file_path, start, end), ...]
+        block_bytes (int): Bytes read per block; a block is longer only by the incomplete line
+            carried over from the previous one, or by a line longer than block_bytes.
+
+    Yields:
+        tuple[str, int, bytes]: The file, the offset of the block in it, and the block.
+    """
+    for path, start, end in ranges:
+        with open(path, "rb") as f:
+            if start > 0:
+                # Skip the tail of the line owned by the previous range
+                f.seek(start - 1)
+                f.readline()
+            offset = f.tell()
+            leftover = b""
+            eof = False
+            while offset < end and not eof:
+                data, leftover, eof = read_whole_lines(f, block_bytes, leftover)
+                if offset + len(data) > end:
+                    # Drop the lines starting at or after end
+                    cut = data.find(b"\n", max(end - 1 - offset, 0)) + 1
+                    data, eof = data[:cut or len(data)], True
+                if data:
+                    yield str(path), offset, data
+                offset += len(data)
+
+
+def iter_lines_in_view(view, view_offset):
+    """Yields the lines of a block in shared memory, like iter_lines_in_block(), copying only each line.
+
+    Yields:
+        tuple[int, bytes]: The file offset just past the line, and the raw line.
+    """
+    start = 0
+    for match in NEWLINE_PATTERN.finditer(view):
+        yield view_offset + match.end(), bytes(view[start:match.end()])
+        start = match.end()
+    if start < len(view):
+        yield view_offset + len(view), bytes(view[start:])
+
+
+def plan_node_ranges(input_paths, whole_files, node_num):
+    """Returns one list of (file_path, start, end) ranges per node, see a012_dataset."""
+    file_sizes = [(str(path), Path(path).stat().st_size) for path in input_paths]
+    assign = assign_files_by_size if whole_files else assign_byte_ranges_by_size
+    return assign(file_sizes, node_num)
+
+
+def _serve_ring(node_comm, win, shared, slot_bytes, slot_num, blocks):
+    """Node reader side: fills free slots with blocks and hands them to parsers that ask for work.
+
+    Returns:
+        tuple[int, int]: Blocks and bytes streamed.
+    """
+    parser_num = node_comm.Get_size() - 1
+    free_slots, ready, waiting = deque(range(slot_num)), deque(), deque()
+    exhausted, finished = False, 0
+    block_num, byte_num = 0, 0
+    while finished < parser_num:
+        while free_slots and not exhausted:
+            item = next(blocks, None)
+            if item is None:
+                exhausted = True
+                break
+            path, offset, data = item
+            if len(data) > slot_bytes:
+                raise ValueError(f"A block of {len(data)} bytes at {path}:{offset} exceeds the {slot_bytes} "
+                                 f"byte ring slots; raise NODE_READER_BLOCK_BYTES")
+            slot = free_slots.popleft()
+            shared[slot * slot_bytes:slot * slot_bytes + len(data)] = data
+            ready.append((slot, len(data), path, offset))
+            block_num += 1
+            byte_num += len(data)
+        # Make the written slots visible before telling parsers about them
+        win.Sync()
+        while waiting and (ready or exhausted):
+            parser = waiting.popleft()
+            if ready:
+                node_comm.send(ready.popleft(), dest=parser)
+            else:
+                node_comm.send(None, dest=parser)
+                finished += 1
+        if finished == parser_num:
+            break
+        status = MPI.Status()
+        done_slot = node_comm.recv(source=MPI.ANY_SOURCE, status=status)
+        if done_slot is not None:
+            free_slots.append(done_slot)
+        waiting.append(status.Get_source())
+    return block_num, byte_num
+
+
+def node_reader_subprocess(
+        input_paths,
+        whole_files=False,
+        block_bytes=NODE_READER_BLOCK_BYTES,
+        slots_per_parser=NODE_READER_SLOTS_PER_PARSER,
+        aggregation=None,
+):
+    """Aggregates a node's share of the input, read once per node into a shared ring buffer. Collective.
+
+    The input is split over nodes instead of ranks (equal byte shares, or whole files with
+    whole_files as v4 does). On every node the lowest rank reads its node's share in blocks of
+    whole lines into the slots of an MPI.Win.Allocate_shared ring buffer and hands slots out to
+    the other ranks of the node as they ask for work; those parse straight out of shared memory
+    and return the slot. A rank alone on its node reads and parses by itself.
+
+    Args:
+        input_paths (list[Path]): Files of the dataset.
+        whole_files (bool): Never split a file between nodes.
+        block_bytes (int): Bytes the node reader reads per block.
+        slots_per_parser (int): Ring slots per parsing rank, so reading runs ahead of parsing.
+        Other arguments: See mpi_v4_subprocess().
+
+    Returns:
+        Tuple[dict, dict, list]: hour_score, id_score and failed_records, as returned by
+        mpi_v4_subprocess(); empty on node readers of nodes with several ranks.
+    """
+    node_comm, leader_comm = split_comm_by_node()
+    node_rank, node_size = node_comm.Get_rank(), node_comm.Get_size()
+    node_ranges = None
+    if node_rank == 0:
+        node_ranges = plan_node_ranges(input_paths, whole_files, leader_comm.Get_size())[leader_comm.Get_rank()]
+        leader_comm.Free()
+
+    hour_score = {}
+    aggregation = aggregation or aggregation_init()
+    id_score = init_id_score(aggregation["approx_capacity"], aggregation["memory_budget"])
+    failed_records = []
+
+    def aggregate(path, offset, lines):
+        aggregate_lines(
+            path, offset, lines,
+            hour_score, id_score, failed_records, aggregation,
+        )
+
+    if node_size == 1:
+        byte_num = 0
+        for path, offset, data in iter_node_blocks(node_ranges, block_bytes):
+            aggregate(path, offset, iter_lines_in_view(memoryview(data), offset))
+            byte_num += len(data)
+        print(f"Rank={RANK}: Alone on its node, read and parsed {byte_num} bytes")
+        node_comm.Free()
+        return hour_score, id_score, failed_records
+
+    # Slots leave room for the line carried over from the previous block
+    slot_bytes = 2 * block_bytes
+    slot_num = slots_per_parser * (node_size - 1)
+    win = MPI.Win.Allocate_shared(slot_num * slot_bytes if node_rank == 0 else 0, 1, comm=node_comm)
+    buf, _ = win.Shared_query(0)
+    shared = memoryview(buf)
+    win.Lock_all(MPI.MODE_NOCHECK)
+    try:
+        if node_rank == 0:
+            block_num, byte_num = _serve_ring(
+                node_comm, win, shared, slot_bytes, slot_num, iter_node_blocks(node_ranges, block_bytes),
+            )
+            print(f"Rank={RANK}: Node reader streamed {byte_num} bytes in {block_num} blocks through "
+                  f"{slot_num} shared slots of {slot_bytes} bytes to {node_size - 1} parsing rank(s)")
+        else:
+            done_slot, block_num = None, 0
+            while True:
+                node_comm.send(done_slot, dest=0)
+                work = node_comm.recv(source=0)
+                if work is None:
+                    break
+                slot, length, path, offset = work
+                win.Sync()
+                aggregate(path, offset, iter_lines_in_view(shared[slot * slot_bytes:slot * slot_bytes + length], offset))
+                done_slot = slot
+                block_num += 1
+            print(f"Rank={RANK}: Parsed {block_num} blocks from the node's shared buffer")
+    finally:
+        win.Unlock_all()
+        shared.release()
+        win.Free()
+        node_comm.Free()
+    return hour_score, id_score, failed_records
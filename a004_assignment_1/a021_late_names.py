@@ -0,0 +1,141 @@
+import pickle
+import pprint
+from array import array
+
+from mpi4py import MPI
+
+from a004_assignment_1.a000_CFG import COMM, RANK, SIZE, LATE_NAMES_TOP_K
+from a004_assignment_1.a002_utils import write_data_to_ndjson
+from a004_assignment_1.a003_top_k import find_the_top_k_v2
+
+INT64_MAX = (1 << 63) - 1
+
+
+def _compact_id(id_0):
+    """Returns a user id string as an int if it round-trips through one, else None."""
+    if id_0.isdigit() and (id_0 == "0" or id_0[0] != "0"):
+        value = int(id_0)
+        if value <= INT64_MAX:
+            return value
+    return None
+
+
+def split_id_score(id_score):
+    """Splits an exact id_score into compact score arrays and the usernames that stay on this rank.
+
+    Args:
+        id_score (dict): { 'user_id_str': [float_total_score, str_username] }
+
+    Returns:
+        tuple[array, array, dict, dict]: The int64 ids and float64 scores of numeric ids, the
+        scores of the other ids by id string, and the usernames by id string.
+    """
+    ids, scores, other_scores, names = array("q"), array("d"), {}, {}
+    for id_0, (score, username) in id_score.items():
+        names[id_0] = username
+        compact = _compact_id(id_0)
+        if compact is None:
+            other_scores[id_0] = score
+        else:
+            ids.append(compact)
+            scores.append(score)
+    return ids, scores, other_scores, names
+
+
+def _gatherv(local, typecode, mpi_type, counts):
+    """Gathers equally typed arrays of different lengths into one array on rank 0. Collective."""
+    if RANK != 0:
+        COMM.Gatherv([local, mpi_type], None, root=0)
+        return None
+    gathered = array(typecode, bytes(sum(counts) * local.itemsize))
+    displacements = [sum(counts[:r]) for r in range(SIZE)]
+    COMM.Gatherv([local, mpi_type], [gathered, (counts, displacements), mpi_type], root=0)
+    return gathered
+
+
+def gather_id_score_late_names(id_score, top_k=LATE_NAMES_TOP_K):
+    """Gathers user scores without usernames, then fetches only the top users' names. Collective.
+
+    Every rank sends its user ids and scores to rank 0 as int64 and float64 arrays; the rare ids
+    that are not plain integers travel pickled next to them. Rank 0 sums the scores, finds the
+    top_k happiest and saddest users, and asks the lowest rank that saw each of them for its
+    username, the one a flat gather keeps. Usernames of all other users are never gathered.
+
+    Args:
+        id_score (dict): This rank's exact id_score.
+        top_k (int): Users per direction whose usernames are resolved.
+
+    Returns:
+        dict | None: On rank 0, the merged { 'user_id_str': [float_total_score, str_username | None] },
+        with None as the username of users outside the top_k. None elsewhere.
+    """
+    ids, scores, other_scores, names = split_id_score(id_score)
+    full_bytes = COMM.reduce(len(pickle.dumps(id_score, pickle.HIGHEST_PROTOCOL)), op=MPI.SUM, root=0)
+    counts = COMM.gather(len(ids), root=0)
+    all_ids = _gatherv(ids, "q", MPI.INT64_T, counts)
+    all_scores = _gatherv(scores, "d", MPI.DOUBLE, counts)
+    all_other_scores = COMM.gather(other_scores, root=0)
+
+    requests, merged, lowest_rank = None, None, None
+    if RANK == 0:
+        merged, lowest_rank = {}, {}
+        position = 0
+        for r in range(SIZE):
+            rank_items = [(str(id_0), score) for id_0, score in zip(
+                all_ids[position:position + counts[r]], all_scores[position:position + counts[r]],
+            )]
+            position += counts[r]
+            for id_0, score in rank_items + list(all_other_scores[r].items()):
+                if id_0 in merged:
+                    merged[id_0] += score
+                else:
+                    merged[id_0] = score
+                    lowest_rank[id_0] = r
+        top_ids = set()
+        for get_max in [True, False]:
+            top = find_the_top_k_v2(((score, id_0) for id_0, score in merged.items()), top_k, get_max=get_max)
+            top_ids.update(id_0 for _, id_0 in top)
+        requests = [[] for _ in range(SIZE)]
+        for id_0 in top_ids:
+            requests[lowest_rank[id_0]].append(id_0)
+
+    wanted = COMM.scatter(requests, root=0)
+    all_names = COMM.gather({id_0: names[id_0] for id_0 in wanted}, root=0)
+    if RANK != 0:
+        return None
+
+    resolved = {}
+    for rank_names in all_names:
+        resolved.update(rank_names)
+    compact_bytes = sum(counts) * (ids.itemsize + scores.itemsize) + sum(
+        len(pickle.dumps(other, pickle.HIGHEST_PROTOCOL)) for other in all_other_scores
+    )
+    print(f"Rank=0: Late names gathered {len(merged)} users in {compact_bytes} bytes instead of {full_bytes} "
+          f"({1 - compact_bytes / max(full_bytes, 1):.1%} less), then resolved {len(resolved)} usernames "
+          f"from {sum(1 for rank_names in all_names if rank_names)} rank(s)")
+    return {id_0: [score, resolved.get(id_0)] for id_0, score in merged.items()}
+
+
+def print_and_write_late_names_top_k(id_score, target_path, top_k=LATE_NAMES_TOP_K):
+    """Prints the happiest and saddest users of a gather_id_score_late_names() result and saves them.
+
+    Args:
+        id_score (dict): The merged id_score from gather_id_score_late_names().
+        target_path (str | Path): NDJSON file receiving one { 'user_id_str': [float_total_score,
+            str_username] } per line, happiest users first.
+        top_k (int): Users per direction, at most the top_k the usernames were resolved for.
+    """
+    records = []
+    for get_max in [True, False]:
+        top = find_the_top_k_v2(((v[0], id_0) for id_0, v in id_score.items()), top_k, get_max=get_max)
+        rst = [{id_0: id_score[id_0]} for _, id_0 in top]
+        records.extend(rst)
+        print_info = f"Happiest {top_k} " if get_max else f"Saddest {top_k} "
+        print(print_info + "users:")
+        pprint.pprint(rst)
+        print()
+    write_data_to_ndjson(
+        records=records,
+        target_path=target_path,
+        if_dict_is_single_dict=None,
+    )
@@ -0,0 +1,205 @@
+import math
+import pickle
+import struct
+import time
+import zlib
+
+from mpi4py import MPI
+
+from a004_assignment_1.a000_CFG import (
+    COMM,
+    RANK,
+    SIZE,
+    TRANSPORT_ZLIB_LEVEL,
+    TRANSPORT_PROBE_BYTES,
+    TRANSPORT_CALIBRATION_USERS,
+    TRANSPORT_MIN_SAVED_SECONDS,
+)
+
+# Frame header: codec, length of the serialised payload before compression
+FRAME_HEADER = struct.Struct("<BQ")
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+
+
+def _measure_link(probe_bytes=TRANSPORT_PROBE_BYTES, repeats=3):
+    """Ping-pongs between rank 0 and the last rank, likely on another node. Collective.
+
+    Returns:
+        tuple[float, float] | None: Bandwidth in bytes per second and one-way latency in seconds
+        on rank 0; None elsewhere or with a single rank.
+    """
+    peer = SIZE - 1
+    if SIZE == 1 or RANK not in [0, peer]:
+        return None
+    other = peer if RANK == 0 else 0
+    probe, tiny = bytearray(probe_bytes), bytearray(1)
+    timings = {}
+    for name, buffer in [("latency", tiny), ("bandwidth", probe)]:
+        best = math.inf
+        for _ in range(repeats):
+            start = MPI.Wtime()
+            if RANK == 0:
+                COMM.Send([buffer, MPI.BYTE], dest=other)
+                COMM.Recv([tiny, MPI.BYTE], source=other)
+            else:
+                COMM.Recv([buffer, MPI.BYTE], source=other)
+                COMM.Send([tiny, MPI.BYTE], dest=other)
+            best = min(best, MPI.Wtime() - start)
+        timings[name] = best
+    if RANK != 0:
+        return None
+    latency = timings["latency"] / 2
+    return probe_bytes / max(timings["bandwidth"] - latency, 1e-9), latency
+
+
+def _measure_codec(user_num=TRANSPORT_CALIBRATION_USERS, level=TRANSPORT_ZLIB_LEVEL):
+    """Times zlib on a pickled id_score-like payload.
+
+    Returns:
+        tuple[float, float, float]: Compression and decompression speed in raw bytes per second,
+        and the compressed-to-raw size ratio.
+    """
+    payload = pickle.dumps(
+        {str(10 ** 17 + i * 7919): [((i * 37) % 200 - 100) / 100, f"user{i}"] for i in range(user_num)},
+        protocol=pickle.HIGHEST_PROTOCOL,
+    )
+    start = time.perf_counter()
+    compressed = zlib.compress(payload, level)
+    middle = time.perf_counter()
+    zlib.decompress(compressed)
+    end = time.perf_counter()
+    return len(payload) / max(middle - start, 1e-9), len(payload) / max(end - middle, 1e-9), len(compressed) / len(payload)
+
+
+def transport_init(threshold_bytes=None):
+    """Measures the link and the codec on rank 0 and decides from what size payloads are compressed. Collective.
+
+    Compressing n bytes saves n * (1 - ratio) / bandwidth seconds on the wire. Each rank
+    compresses its own payload, in parallel with the others, but rank 0 decompresses all of
+    them one after another, so in a gather to rank 0 the net saving per raw byte is
+        gain = (1 - ratio) / bandwidth - 1 / (SIZE * compress_speed) - 1 / decompress_speed.
+    Payloads are compressed from TRANSPORT_MIN_SAVED_SECONDS / gain bytes on, and never
+    if the gain is not positive, as on shared memory or a fast interconnect.
+
+    Args:
+        threshold_bytes (int | None): Use this threshold instead of measuring; 0 always compresses.
+
+    Returns:
+        dict: Transport state for encode_frame(), decode_frame() and transport_gather(), with
+        this rank's counters for report_transport().
+    """
+    measured = None
+    link = _measure_link() if threshold_bytes is None else None
+    if RANK == 0 and threshold_bytes is None:
+        compress_bps, decompress_bps, ratio = _measure_codec()
+        bandwidth, latency = link if link is not None else (math.inf, 0.0)
+        gain = (1 - ratio) / bandwidth - 1 / (SIZE * compress_bps) - 1 / decompress_bps
+        threshold_bytes = math.ceil(TRANSPORT_MIN_SAVED_SECONDS / gain) if gain > 0 else None
+        measured = {
+            "bandwidth": bandwidth,
+            "latency": latency,
+            "compress_bps": compress_bps,
+            "decompress_bps": decompress_bps,
+            "ratio": ratio,
+        }
+        print(f"Rank=0: Transport measured {_format_rate(bandwidth)} and {latency * 1e6:.1f} us to rank {SIZE - 1}, "
+              f"zlib level {TRANSPORT_ZLIB_LEVEL} at {_format_rate(compress_bps)} / {_format_rate(decompress_bps)} "
+              f"with ratio {ratio:.2f}; compressing "
+              f"{'never' if threshold_bytes is None else f'payloads from {threshold_bytes} bytes'}")
+    threshold_bytes, measured = COMM.bcast((threshold_bytes, measured), root=0)
+    return {
+        "threshold_bytes": threshold_bytes,
+        "measured": measured,
+        "frames": 0,
+        "compressed_frames": 0,
+        "raw_bytes": 0,
+        "wire_bytes": 0,
+        "encode_seconds": 0.0,
+        "decoded_frames": 0,
+        "decode_seconds": 0.0,
+    }
+
+
+def _format_rate(bytes_per_second):
+    return "unlimited bandwidth" if math.isinf(bytes_per_second) else f"{bytes_per_second / (1 << 20):.0f} MiB/s"
+
+
+def encode_frame(obj, transport):
+    """Pickles an object into a frame, compressed if it reaches the transport's threshold.
+
+    A frame is FRAME_HEADER followed by the pickle, raw or zlib-compressed. It stays raw if
+    compression does not make it smaller.
+
+    Returns:
+        bytes: The frame.
+    """
+    start = time.perf_counter()
+    payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    codec, body = CODEC_RAW, payload
+    threshold_bytes = transport["threshold_bytes"]
+    if threshold_bytes is not None and len(payload) >= threshold_bytes:
+        compressed = zlib.compress(payload, TRANSPORT_ZLIB_LEVEL)
+        if len(compressed) < len(payload):
+            codec, body = CODEC_ZLIB, compressed
+    frame = FRAME_HEADER.pack(codec, len(payload)) + body
+    transport["frames"] += 1
+    transport["compressed_frames"] += codec == CODEC_ZLIB
+    transport["raw_bytes"] += len(payload)
+    transport["wire_bytes"] += len(frame)
+    transport["encode_seconds"] += time.perf_counter() - start
+    return frame
+
+
+def decode_frame(frame, transport):
+    """Returns the object in a frame from encode_frame().
+
+    Raises:
+        ValueError: If the frame has an unknown codec or its payload has the wrong length.
+    """
+    start = time.perf_counter()
+    view = memoryview(frame)
+    codec, raw_len = FRAME_HEADER.unpack_from(view)
+    body = view[FRAME_HEADER.size:]
+    if codec == CODEC_ZLIB:
+        body = zlib.decompress(body)
+    elif codec != CODEC_RAW:
+        raise ValueError(f"Unknown transport codec {codec}")
+    if len(body) != raw_len:
+        raise ValueError(f"Transport frame holds {len(body)} bytes, its header says {raw_len}")
+    obj = pickle.loads(body)
+    transport["decoded_frames"] += 1
+    transport["decode_seconds"] += time.perf_counter() - start
+    return obj
+
+
+def transport_gather(obj, transport, comm=COMM, root=0):
+    """Like comm.gather(obj, root), with every object sent as an encode_frame() frame. Collective.
+
+    The frames travel as raw bytes in one Gatherv, without another round of pickling.
+    """
+    frame = encode_frame(obj, transport)
+    counts = comm.gather(len(frame), root=root)
+    if comm.Get_rank() != root:
+        comm.Gatherv([frame, MPI.BYTE], None, root=root)
+        return None
+    displacements = [sum(counts[:r]) for r in range(len(counts))]
+    gathered = bytearray(sum(counts))
+    comm.Gatherv([frame, MPI.BYTE], [gathered, (counts, displacements), MPI.BYTE], root=root)
+    view = memoryview(gathered)
+    return [decode_frame(view[start:start + count], transport) for start, count in zip(displacements, counts)]
+
+
+def report_transport(transport):
+    """Prints the raw and wire bytes and the encode and decode time over all ranks. Collective."""
+    keys = ["frames", "compressed_frames", "raw_bytes", "wire_bytes", "encode_seconds", "decoded_frames", "decode_seconds"]
+    all_counters = COMM.gather({key: transport[key] for key in keys}, root=0)
+    if RANK != 0:
+        return
+    totals = {key: sum(counters[key] for counters in all_counters) for key in keys}
+    encode_max = max(counters["encode_seconds"] for counters in all_counters)
+    print(f"Rank=0: Transport sent {totals['frames']} frames ({totals['compressed_frames']} compressed), "
+          f"{totals['raw_bytes']} raw bytes as {totals['wire_bytes']} wire bytes "
+          f"({totals['wire_bytes'] / max(totals['raw_bytes'], 1):.1%}); encoding took {totals['encode_seconds']:.3f} s "
+          f"over all ranks (slowest rank {encode_max:.3f} s), decoding {totals['decoded_frames']} frames "
+          f"{totals['decode_seconds']:.3f} s")
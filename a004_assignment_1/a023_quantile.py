@@ -0,0 +1,92 @@
+def kll_init(k):
+    """Creates an empty KLL quantile sketch.
+
+    Items live in compactors, one per level, and an item at level h stands for 2 ** h of the
+    inserted values. The top compactor holds up to k items and each one below about 2/3 as many,
+    so the sketch keeps O(k) items whatever the number of values, and a quantile's rank is off
+    by about n / k at most.
+
+    Args:
+        k (int): Capacity of the top compactor; larger is more accurate.
+
+    Returns:
+        dict: { "k": int, "n": int, "levels": [[float, ...], ...], "offsets": [int, ...] }
+    """
+    return {"k": k, "n": 0, "levels": [[]], "offsets": [0]}
+
+
+def _kll_capacity(sketch, level):
+    depth = len(sketch["levels"]) - level - 1
+    return max(2, int(sketch["k"] * (2 / 3) ** depth))
+
+
+def _kll_compress(sketch):
+    """Compacts levels over their capacity, lowest first, until every level is within capacity.
+
+    Each compaction sorts a level and promotes every other item, which can push the level above
+    over its own capacity, or add a level and so shrink the capacities below; hence the loop.
+    """
+    levels, offsets = sketch["levels"], sketch["offsets"]
+    while True:
+        level = next(
+            (level for level, items in enumerate(levels) if len(items) >= _kll_capacity(sketch, level)),
+            None,
+        )
+        if level is None:
+            return
+        if level + 1 == len(levels):
+            levels.append([])
+            offsets.append(0)
+        items = sorted(levels[level])
+        # An odd item stays behind so that the promoted pair weights match
+        kept = [items.pop()] if len(items) % 2 else []
+        # Alternate which half is promoted, so that the rank errors of successive compactions cancel
+        levels[level + 1].extend(items[offsets[level]::2])
+        offsets[level] ^= 1
+        levels[level] = kept
+
+
+def kll_update(sketch, value):
+    """Adds one value to a KLL sketch, in amortised O(log k)."""
+    sketch["levels"][0].append(value)
+    sketch["n"] += 1
+    if len(sketch["levels"][0]) >= _kll_capacity(sketch, 0):
+        _kll_compress(sketch)
+
+
+def kll_merge(sketches):
+    """Merges KLL sketches built on disjoint parts of a stream into a new sketch."""
+    merged = kll_init(max(sketch["k"] for sketch in sketches))
+    for sketch in sketches:
+        for level, items in enumerate(sketch["levels"]):
+            while level >= len(merged["levels"]):
+                merged["levels"].append([])
+                merged["offsets"].append(0)
+            merged["levels"][level].extend(items)
+        merged["n"] += sketch["n"]
+    _kll_compress(merged)
+    return merged
+
+
+def kll_quantiles(sketch, quantiles):
+    """Returns the estimated values at the given quantiles, in (0, 1], or None for an empty sketch.
+
+    Returns:
+        list[float | None]: One estimate per quantile, the smallest item whose cumulative
+        weight reaches quantile * total weight.
+    """
+    weighted = sorted(
+        (value, 1 << level) for level, items in enumerate(sketch["levels"]) for value in items
+    )
+    if not weighted:
+        return [None] * len(quantiles)
+    total = sum(weight for _, weight in weighted)
+    results = []
+    for quantile in quantiles:
+        target, cumulative = quantile * total, 0
+        for value, weight in weighted:
+            cumulative += weight
+            if cumulative >= target:
+                break
+        results.append(value)
+    return results
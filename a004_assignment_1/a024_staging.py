@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import shutil
+import socket
+import tempfile
+from pathlib import Path
+
+from a004_assignment_1.a000_CFG import RANK, STAGE_DIR_ENV, STAGE_SUBFOLDER
+from a004_assignment_1.a004_hierarchical import split_comm_by_node
+
+
+def get_stage_dir(stage_dir=None):
+    """Returns the scratch folder pieces are staged to: stage_dir, else STAGE_SUBFOLDER under $STAGE_DIR_ENV or the temp dir."""
+    if stage_dir:
+        return Path(stage_dir)
+    return Path(os.environ.get(STAGE_DIR_ENV) or tempfile.gettempdir()) / STAGE_SUBFOLDER
+
+
+def _staged_name(source):
+    """Unique name of a staged copy, so pieces of different datasets never collide."""
+    digest = hashlib.sha1(str(source).encode("utf-8")).hexdigest()[:12]
+    return f"{digest}_{source.name}"
+
+
+def _load_manifest(manifest_path):
+    if manifest_path.is_file():
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            print(f"Rank={RANK}: Ignoring unreadable staging manifest {manifest_path}")
+    return {}
+
+
+def _write_atomically(target, write):
+    """Writes target through a temporary file in the same folder, so readers never see a partial file."""
+    tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, target)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def stage_files(sources, stage_dir):
+    """Copies files into stage_dir unless the manifest there shows an up-to-date copy.
+
+    The manifest records the size and modification time of every staged source; a copy is
+    reused when both still match and the copy has the source's size.
+
+    Args:
+        sources (list[Path]): Files to stage.
+        stage_dir (Path): Scratch folder, created if needed.
+
+    Returns:
+        dict: { "staged": copied files, "reused": reused files, "bytes": bytes copied }
+    """
+    stage_dir.mkdir(parents=True, exist_ok=True)
+    # One manifest per host, in case the scratch folder turns out to be shared between nodes
+    manifest_path = stage_dir / f"manifest_{socket.gethostname()}.json"
+    manifest = _load_manifest(manifest_path)
+    stats = {"staged": 0, "reused": 0, "bytes": 0}
+    for source in sources:
+        source = Path(source).resolve()
+        source_stat = source.stat()
+        target = stage_dir / _staged_name(source)
+        entry = manifest.get(str(source))
+        if (
+                entry is not None
+                and entry["size"] == source_stat.st_size
+                and entry["mtime_ns"] == source_stat.st_mtime_ns
+                and target.is_file()
+                and target.stat().st_size == source_stat.st_size
+        ):
+            stats["reused"] += 1
+            continue
+        _write_atomically(target, lambda tmp_path: shutil.copyfile(source, tmp_path))
+        manifest[str(source)] = {
+            "size": source_stat.st_size,
+            "mtime_ns": source_stat.st_mtime_ns,
+            "staged": target.name,
+        }
+        stats["staged"] += 1
+        stats["bytes"] += source_stat.st_size
+
+    def write_manifest(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+
+    _write_atomically(manifest_path, write_manifest)
+    return stats
+
+
+def stage_ranges(my_ranges, stage_dir=None):
+    """Stages the files of every rank's whole-file ranges to node-local scratch. Collective.
+
+    The node leader collects the files all ranks of its node need and stages them with
+    stage_files(), so a node copies only its own ranks' pieces, once per allocation; the other
+    ranks wait and then read the copies.
+
+    Args:
+        my_ranges (list): This rank's [(file_path, start, end), ...] over whole files.
+        stage_dir (str | Path | None): Scratch folder, see get_stage_dir().
+
+    Returns:
+        list: my_ranges with every file_path replaced by its staged copy.
+    """
+    stage_dir = get_stage_dir(stage_dir)
+    node_comm, leader_comm = split_comm_by_node()
+    node_sources = node_comm.gather([path for path, _, _ in my_ranges], root=0)
+    if node_comm.Get_rank() == 0:
+        leader_comm.Free()
+        sources = sorted({Path(path).resolve() for sources in node_sources for path in sources})
+        stats = stage_files(sources, stage_dir)
+        print(f"Rank={RANK}: Staged {stats['staged']} file(s) ({stats['bytes']} bytes) of {node_comm.Get_size()} "
+              f"rank(s) to {stage_dir}, reused {stats['reused']} up-to-date cop(ies)")
+    node_comm.Barrier()
+    node_comm.Free()
+    return [(str(stage_dir / _staged_name(Path(path).resolve())), start, end) for path, start, end in my_ranges]
@@ -0,0 +1,117 @@
+import functools
+
+from a004_assignment_1.a000_CFG import COMM, RANK
+
+EXTRACT_OK = 0
+EXTRACT_NOT_A_DICT = -1  # The record itself is not a dict, so no field is to blame
+
+_MISSING = object()
+
+
+@functools.cache
+def _compile_extractor(schema):
+    """Generates the source of a fused extractor for a schema and compiles it, once per schema.
+
+    Every dict on the fields' paths is looked up once, however many fields go through it, and
+    each field is converted right after its lookup. The generated code is a factory taking the
+    field failure counters, the non-dict record counter and the converters, and returning the
+    extract function.
+
+    Returns:
+        tuple[function, str]: The factory and its source.
+    """
+    lines = ["def make_extract(failures, not_dict, converters, missing):"]
+    lines += [f"    convert_{i} = converters[{i}]" for i in range(len(schema))]
+    lines += ["    def extract(record):", "        if not isinstance(record, dict):", "            not_dict[0] += 1",
+              f"            return {EXTRACT_NOT_A_DICT}, None"]
+    # Variable holding each dict already looked up, by its path
+    nodes = {(): "record"}
+    for i, (_, path, converter) in enumerate(schema):
+        keys = tuple(path.split("."))
+        fail = [f"            failures[{i}] += 1", f"            return {i + 1}, None"]
+        for depth in range(1, len(keys)):
+            if keys[:depth] in nodes:
+                continue
+            parent, node = nodes[keys[:depth - 1]], f"node_{len(nodes)}"
+            nodes[keys[:depth]] = node
+            lines += [f"        {node} = {parent}.get({keys[depth - 1]!r})", f"        if not isinstance({node}, dict):"]
+            lines += fail
+        lines += [f"        value_{i} = {nodes[keys[:-1]]}.get({keys[-1]!r}, missing)",
+                  f"        if value_{i} is missing:"]
+        lines += fail
+        if converter is str:
+            # Most values already have the type, skip the call for them
+            lines += [f"        if type(value_{i}) is not str:"]
+            indent = "            "
+        else:
+            indent = "        "
+        if converter is not None:
+            lines += [f"{indent}try:", f"{indent}    value_{i} = convert_{i}(value_{i})", f"{indent}except Exception:"]
+            lines += [f"{indent}    failures[{i}] += 1", f"{indent}    return {i + 1}, None"]
+    lines += [f"        return 0, ({', '.join(f'value_{i}' for i in range(len(schema)))},)", "    return extract"]
+    source = "\n".join(lines) + "\n"
+    namespace = {}
+    exec(compile(source, f"<extractor {' '.join(name for name, _, _ in schema)}>", "exec"), namespace)
+    return namespace["make_extract"], source
+
+
+def extractor_init(schema):
+    """Compiles a declarative record schema into a fused field extractor.
+
+    Args:
+        schema (tuple): ((field_name, "dotted.path", converter), ...), where converter is a type
+            or a function called on the raw value (e.g. float), or None to keep it as it is.
+            Every dict on a path must be a dict and every leaf must be present.
+
+    Returns:
+        dict: {
+            "fields": [field_name, ...],
+            "paths": ["dotted.path", ...],
+            "failures": [int, ...],  # Records each field failed, the first failing field only
+            "not_dict": [int],       # Records that were not a dict at all
+            "extract": function,     # record -> (code, values)
+            "source": str,           # The generated code, for debugging
+        }
+        extract(record) returns (EXTRACT_OK, (value, ...)) in schema order, (i + 1, None) if
+        field i, the first that failed, is missing, is under a non-dict or cannot be converted,
+        or (EXTRACT_NOT_A_DICT, None) if the record is not a dict. It never raises.
+    """
+    schema = tuple((name, path, converter) for name, path, converter in schema)
+    make_extract, source = _compile_extractor(schema)
+    failures, not_dict = [0] * len(schema), [0]
+    return {
+        "fields": [name for name, _, _ in schema],
+        "paths": [path for _, path, _ in schema],
+        "failures": failures,
+        "not_dict": not_dict,
+        "extract": make_extract(failures, not_dict, [converter for _, _, converter in schema], _MISSING),
+        "source": source,
+    }
+
+
+def describe_extract_error(extractor, code):
+    """Returns a message for an error code from an extractor."""
+    if code == EXTRACT_NOT_A_DICT:
+        return "Record is not a JSON object"
+    i = code - 1
+    return f'Field "{extractor["fields"][i]}" ({extractor["paths"][i]}) is missing or cannot be converted'
+
+
+def format_extract_failures(extractor):
+    """Returns 'field=count, ...' over the fields that failed at least once, or 'none', then the non-dict records."""
+    failed = [f"{name}={count}" for name, count in zip(extractor["fields"], extractor["failures"]) if count]
+    text = ", ".join(failed) if failed else "none"
+    if extractor["not_dict"][0]:
+        text += f"; {extractor['not_dict'][0]} record(s) not a JSON object"
+    return text
+
+
+def report_extract_failures(extractor):
+    """Prints the failures of every field, and the non-dict records, summed over all ranks. Collective."""
+    all_failures = COMM.gather((extractor["failures"], extractor["not_dict"][0]), root=0)
+    if RANK != 0:
+        return
+    totals = [sum(counts) for counts in zip(*(failures for failures, _ in all_failures))]
+    not_dict = sum(count for _, count in all_failures)
+    print(f"Rank=0: Field extraction failures over all ranks: "
+          f"{format_extract_failures({'fields': extractor['fields'], 'failures': totals, 'not_dict': [not_dict]})}")